@@ -1,20 +1,22 @@
+import os
 import sys
+import imp
 #
 # Unfortunate kluge to get to panda3d from old distribution
-# this allows meshtool to run on Ubuntu 12.04
+# this allows meshtool to run on Ubuntu 12.04. Only look for the
+# package here - panda3d is imported by the filters that need it
 #
 try:
-    import panda3d
-except:
-    print >> sys.stderr, 'panda3d not found -- adding to sys.path and trying again'
+    imp.find_module('panda3d')
+except ImportError:
     sys.path.append("/usr/share/panda3d")
     sys.path.append("/usr/lib64/panda3d")
-    import panda3d    
 import argparse
 from collections import defaultdict
 import meshtool.filters as filters
-from meshtool.filters.base_filters import FilterException, OpFilter, LoadFilter
-import collada
+from meshtool.pipeline import FilterChain, ChainError, ChainUsageError
+from meshtool.batch import readManifest, runBatch, runSharedAtlasBatch
+from meshtool.profiling import FilterProfiler
 
 def usage_exit(parser, s):
     parser.print_usage()
@@ -37,11 +39,13 @@ class CustomFormatter(argparse.HelpFormatter):
         
         for action in actions:
             if not isinstance(action, CustomAction):
+                if not isinstance(action, argparse._HelpAction):
+                    action_list['Running'].append(action)
                 continue
             filter_name = action.dest
-            inst = filters.factory.getInstance(filter_name)
+            descriptor = filters.factory.getDescriptor(filter_name)
             
-            action_list[inst.CATEGORY].append(action)
+            action_list[descriptor.CATEGORY].append(action)
         
         order = ['Loading',
                  'Printing',
@@ -50,7 +54,8 @@ class CustomFormatter(argparse.HelpFormatter):
                  'Visualizations',
                  'Meta',
                  'Operations',
-                 'Saving']
+                 'Saving',
+                 'Running']
         
         for section_name in order:
             loaders = action_list[section_name]
@@ -61,47 +66,147 @@ class CustomFormatter(argparse.HelpFormatter):
         
         self.start_section('')
 
-def main():
+def makeParser():
+    """Returns the command line parser, with an argument for each filter"""
     parser = argparse.ArgumentParser(
         description='Tool for manipulating mesh data using pycollada.',
         formatter_class=CustomFormatter,
         usage='meshtool --load_filter [--operation] [--save_filter]')
     for filter_name in filters.factory.getFilterNames():
-        inst = filters.factory.getInstance(filter_name)
+        descriptor = filters.factory.getDescriptor(filter_name)
         parser.add_argument('--' + filter_name, required=False,
-                            nargs=len(inst.arguments), help=inst.description,
-                            metavar=tuple([arg.name for arg in inst.arguments]), action=CustomAction)
-        
+                            nargs=len(descriptor.arguments), help=descriptor.description,
+                            metavar=tuple([arg.name for arg in descriptor.arguments]), action=CustomAction)
+    
+    parser.add_argument('--batch', metavar='manifest',
+                        help='Runs the filter chain over every file listed in the given manifest file, ' +
+                        'one per line, or matching the given glob pattern. Filter arguments are templates: ' +
+                        '{input}, {dir}, {basename}, {name} and {ext} are replaced for each file, e.g. ' +
+                        '--load_collada {input} --save_collada_zip out/{name}.zip')
+    parser.add_argument('--workers', metavar='N', type=int,
+                        help='Number of worker processes to use with --batch or --serve. Defaults to the number of CPUs.')
+    parser.add_argument('--shared_atlases', metavar='dir',
+                        help='With --batch, packs the textures that more than one input uses, found by their ' +
+                        'contents, onto atlas pages saved once in the given directory, and points every input ' +
+                        'that uses them at those pages before its save filters run. All inputs are loaded ' +
+                        'at once in one process to do this. Can\'t be used with --make_atlases, ' +
+                        '--make_atlas_pages or --full_optimizations, which atlas each input on its own first.')
+    parser.add_argument('--shared_atlas_url', metavar='url',
+                        help='What the paths of shared atlas images start with in the saved files, which has to ' +
+                        'point at the --shared_atlases directory from where they are saved. Defaults to the ' +
+                        'directory as given.')
+    parser.add_argument('--serve', metavar='address',
+                        help='Runs as a server that keeps a pool of worker processes warm and runs jobs ' +
+                        'submitted over HTTP. The address is host:port, port, or the path of a UNIX socket. ' +
+                        'POST /jobs with {"input": path, "output": path, "chain": [filter arguments]} to ' +
+                        'submit a job, where the chain can use the same templates as --batch plus {output}. ' +
+                        'GET /jobs/<id> gives its state and timing and GET /stats gives the queue depth.')
+    parser.add_argument('--queue_size', metavar='N', type=int, default=100,
+                        help='Number of jobs that can wait for a worker with --serve before new jobs are refused')
+    parser.add_argument('--job_timeout', metavar='seconds', type=int, default=3600,
+                        help='Seconds a job submitted to --serve has from being submitted to finish before it ' +
+                        'is marked as failed. Defaults to 3600.')
+    parser.add_argument('--profile', metavar='file',
+                        help='Writes a JSON report of wall time, CPU time, peak memory growth and triangle and vertex ' +
+                        'counts for each filter that runs, including the filters run by meta filters. ' +
+                        'Use - for stdout. With --batch, the file name is a template like the filter arguments.')
+    parser.add_argument('--stream_obj', action='store_true',
+                        help='When the filters are only --load_obj and --save_collada, converts the file by ' +
+                        'copying its text into the COLLADA document instead of loading the mesh, so memory ' +
+                        'use doesn\'t depend on its size. The numbers aren\'t rounded, indices keep their ' +
+                        'width (10 is written as 09), no .meshcache file is written and the profile only ' +
+                        'has one entry for the conversion.')
+    parser.add_argument('--cache_dir', metavar='dir', default=os.environ.get('MESHTOOL_CACHE_DIR'),
+                        help='Caches results in the given directory, keyed by the contents of the input file ' +
+                        'and its textures and the filters run on it, so that running the same filters again ' +
+                        'restores the result instead of recomputing it. Defaults to $MESHTOOL_CACHE_DIR if set.')
+    parser.add_argument('--cache_size', metavar='MB', type=int, default=1024,
+                        help='Maximum size of the cache directory. Least recently used results are deleted ' +
+                        'past this. Defaults to 1024.')
+    parser.add_argument('--no_cache', '--no-cache', action='store_true',
+                        help='Disables the cache even if --cache_dir or $MESHTOOL_CACHE_DIR is set')
+    parser.add_argument('--meshcache', action='store_true', default=bool(os.environ.get('MESHTOOL_MESHCACHE')),
+                        help='Writes the parsed mesh of each OBJ or COLLADA file loaded to a .meshcache file ' +
+                        'next to it, and loads from that instead of parsing while the file and its materials ' +
+                        'and textures are unchanged. Defaults to on if $MESHTOOL_MESHCACHE is set.')
+    parser.add_argument('--texture_budget', metavar='MB', type=int,
+                        help='Memory for decoded textures, which are decoded in the background once loaded ' +
+                        'and shared by the filters that use them. Least recently used textures are dropped ' +
+                        'past this. Defaults to $MESHTOOL_TEXTURE_BUDGET if set, otherwise 1024.')
+    parser.add_argument('--texture_threads', metavar='N', type=int,
+                        help='Number of threads used to decode and re-encode textures. Defaults to ' +
+                        '$MESHTOOL_TEXTURE_THREADS if set, otherwise the number of CPUs.')
+    return parser
+
+def main():
+    parser = makeParser()
     args = parser.parse_args()
     
+    if args.texture_budget is not None:
+        from meshtool import textures
+        textures.setBudget(args.texture_budget * 1024 * 1024)
+    if args.texture_threads is not None:
+        from meshtool import textures
+        textures.setThreads(args.texture_threads)
+    
+    if args.meshcache:
+        from meshtool import meshcache
+        meshcache.setEnabled(True)
+    
+    cache = None
+    if args.cache_dir is not None and not args.no_cache:
+        from meshtool.cache import ResultCache
+        cache = ResultCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    
+    if args.serve is not None:
+        from meshtool.serve import serve
+        serve(args.serve, parser, workers=args.workers, max_queued=args.queue_size, cache=cache,
+              timeout=args.job_timeout)
+        return
+    
     if not 'ordered_args' in args:
         usage_exit(parser, "no arguments given")
     
-    ordered_args = args.ordered_args
-
-    (load_filter_name, load_filter_args) = ordered_args.pop(0)
-    load_filter_inst = filters.factory.getInstance(load_filter_name)
-    if load_filter_inst is None or not isinstance(load_filter_inst, LoadFilter):
-        usage_exit(parser, "first argument must be a load filter")
     try:
-        collada_inst = load_filter_inst.apply(*load_filter_args)
-    except FilterException, e:
-        sys.exit("Error: (argument %d) '%s': %s" % (1,load_filter_name,str(e)))
-    if not isinstance(collada_inst, collada.Collada):
-        sys.exit("Error: got an incorrect return value from filter (argument %d) '%s' " % (1, load_filter_name))
-
-    for i, arg in enumerate(ordered_args):
-        filter_name = arg[0]
-        arguments = arg[1]
-        inst = filters.factory.getInstance(filter_name)
-        if inst is None or not isinstance(inst, OpFilter):
-            usage_exit(parser, "specified filter (argument %d:'%s') is not an operation filter" % (i+1, filter_name))
-        try:
-            collada_inst = inst.apply(collada_inst, *arguments)
-        except FilterException, e:
-            sys.exit("Error: (argument %d) '%s': %s" % (i+1, filter_name, str(e)))
-        if not isinstance(collada_inst, collada.Collada):
-            sys.exit("Error: got an incorrect return value from filter (argument %d) '%s' " % (i+1, filter_name))
+        chain = FilterChain(args.ordered_args)
+    except ChainUsageError, e:
+        usage_exit(parser, str(e))
+    
+    if args.shared_atlases is not None:
+        if args.batch is None:
+            usage_exit(parser, "--shared_atlases can only be used with --batch")
+        if args.workers is not None:
+            usage_exit(parser, "--shared_atlases loads every input in one process, so it can't be used with --workers")
+        if cache is not None:
+            # the cache may only be on because of $MESHTOOL_CACHE_DIR
+            sys.stderr.write("Warning: results aren't cached with --shared_atlases\n")
+            cache = None
+    
+    if args.batch is not None:
+        inputs = readManifest(args.batch)
+        if len(inputs) == 0:
+            usage_exit(parser, "no input files found for batch '%s'" % args.batch)
+        if args.shared_atlases is not None:
+            try:
+                results = runSharedAtlasBatch(chain, inputs, args.shared_atlases, args.shared_atlas_url,
+                                              profile_template=args.profile)
+            except ChainUsageError, e:
+                usage_exit(parser, str(e))
+        else:
+            results = runBatch(chain, inputs, workers=args.workers,
+                               profile_template=args.profile, cache=cache, stream=args.stream_obj)
+        if not all(r.succeeded() for r in results):
+            sys.exit(1)
+        return
+    
+    profiler = FilterProfiler() if args.profile is not None else None
+    try:
+        chain.run(profiler, cache, stream=args.stream_obj)
+    except ChainError, e:
+        sys.exit("Error: " + str(e))
+    finally:
+        if profiler is not None:
+            profiler.save(args.profile)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,223 @@
+import os
+import sys
+import glob
+import time
+import traceback
+import multiprocessing
+
+from meshtool.pipeline import FilterChain, ChainError, ChainUsageError
+from meshtool.profiling import FilterProfiler
+from meshtool import textures
+
+def readManifest(spec):
+    """Returns the list of input files for a batch run. The spec is either a
+    glob pattern or the path to a manifest file listing one input per line.
+    Blank lines and lines starting with # are ignored in a manifest."""
+    if os.path.isfile(spec):
+        inputs = []
+        f = open(spec, 'r')
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            inputs.append(line)
+        f.close()
+        return inputs
+    return sorted(glob.glob(spec))
+
+def templateFields(input_path):
+    """Fields that can be used in filter arguments during a batch run. For
+    an input of models/duck.dae, these are input=models/duck.dae, dir=models,
+    basename=duck.dae, name=duck, and ext=.dae"""
+    basename = os.path.basename(input_path)
+    name, ext = os.path.splitext(basename)
+    return {'input': input_path,
+            'dir': os.path.dirname(input_path),
+            'basename': basename,
+            'name': name,
+            'ext': ext}
+
+class BatchResult(object):
+    """Outcome of running the filter chain on a single input"""
+    def __init__(self, input_path, seconds, error=None):
+        self.input_path = input_path
+        self.seconds = seconds
+        self.error = error
+    def succeeded(self):
+        return self.error is None
+
+# the chain is parsed once per worker process and then reused for every input
+_worker_chain = None
+_worker_profile_template = None
+_worker_cache = None
+_worker_stream = False
+
+def _initWorker(ordered_args, profile_template=None, cache=None, stream=False):
+    global _worker_chain, _worker_profile_template, _worker_cache, _worker_stream
+    _worker_chain = FilterChain(ordered_args)
+    _worker_profile_template = profile_template
+    _worker_cache = cache
+    _worker_stream = stream
+
+def _guard(input_path, start, run):
+    """Calls run, returning a failed :class:`BatchResult` for the input if
+    it raises, or None if it doesn't"""
+    try:
+        run()
+    except ChainError, e:
+        return BatchResult(input_path, time.time() - start, str(e))
+    except Exception, e:
+        # don't let a bug in a filter kill the rest of the batch
+        traceback.print_exc()
+        return BatchResult(input_path, time.time() - start,
+                           "unexpected %s: %s" % (type(e).__name__, str(e)))
+    return None
+
+def _runInput(input_path):
+    start = time.time()
+    fields = templateFields(input_path)
+    profiler = FilterProfiler() if _worker_profile_template is not None else None
+    def run():
+        try:
+            _worker_chain.format(**fields).run(profiler, _worker_cache, stream=_worker_stream)
+        finally:
+            if profiler is not None:
+                profiler.save(_worker_profile_template.format(**fields))
+    failed = _guard(input_path, start, run)
+    if failed is not None:
+        return failed
+    return BatchResult(input_path, time.time() - start)
+
+def runBatch(chain, inputs, workers=None, out=sys.stdout, profile_template=None, cache=None, stream=False):
+    """Runs a filter chain over many input files.
+
+    :param chain: A :class:`meshtool.pipeline.FilterChain` whose arguments are
+                  templates filled in with :func:`templateFields` for each input
+    :param inputs: List of input file paths
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+                    If 1, inputs are processed in this process.
+    :param out: File-like object to write progress and the summary to
+    :param profile_template: If given, a profiling report is saved for each
+                             input to this path, formatted like the filter arguments
+    :param cache: An optional :class:`meshtool.cache.ResultCache` shared by all workers
+    :param stream: Passed to :meth:`meshtool.pipeline.FilterChain.run`
+
+    :returns: A list of :class:`BatchResult`, one per input, in input order
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    start = time.time()
+    results = []
+    if workers <= 1 or len(inputs) <= 1:
+        _initWorker(chain.ordered_args, profile_template, cache, stream)
+        results_iter = (_runInput(input_path) for input_path in inputs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, _initWorker, (chain.ordered_args, profile_template, cache, stream))
+        results_iter = pool.imap_unordered(_runInput, inputs)
+
+    try:
+        for result in results_iter:
+            results.append(result)
+            if not result.succeeded():
+                out.write("Failed: %s: %s\n" % (result.input_path, result.error))
+                out.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - start
+    printSummary(results, elapsed, out)
+
+    order = dict((input_path, i) for i, input_path in enumerate(inputs))
+    results.sort(key=lambda r: order[r.input_path])
+    return results
+
+# filters that atlas each mesh's textures on their own, after which there's
+# nothing left in common for shared atlases to find
+ATLASING_FILTERS = set(['make_atlases', 'make_atlas_pages', 'full_optimizations'])
+
+def runSharedAtlasBatch(chain, inputs, directory, url=None, out=sys.stdout, profile_template=None):
+    """Runs a filter chain over many input files like :func:`runBatch`, but
+    makes atlases of the textures they have in common, shared by all of
+    them, with :func:`meshtool.filters.atlas_filters.make_atlases.makeSharedAtlases`
+    before any save filter runs. Since that needs every mesh at once, the
+    inputs are all loaded in this process and kept until they're saved,
+    and results aren't cached.
+
+    :param directory: Where to save the shared atlas pages
+    :param url: What image paths start with to point at directory from
+                where the meshes are saved. Defaults to directory.
+
+    :returns: A list of :class:`BatchResult`, one per input, in input order
+    :raises: :class:`meshtool.pipeline.ChainUsageError` if the chain atlases
+             each input on its own, or decodes textures after its first
+             save filter, when the shared pages have replaced them
+    """
+    from meshtool.filters.atlas_filters.make_atlases import makeSharedAtlases
+
+    for filter_name, arguments in chain.ordered_args:
+        if filter_name in ATLASING_FILTERS:
+            raise ChainUsageError("'%s' atlases each input's textures on its own, so it can't be used "
+                                  "with shared atlases" % filter_name)
+
+    stop = chain.firstSaveIndex()
+    for filter_name, arguments in chain.ordered_args[stop:]:
+        if filter_name in textures.DECODING_FILTERS:
+            raise ChainUsageError("'%s' can't come after a save filter with shared atlases, since the "
+                                  "shared pages aren't loaded" % filter_name)
+
+    start = time.time()
+    loaded = []
+    results = {}
+    for input_path in inputs:
+        input_start = time.time()
+        fields = templateFields(input_path)
+        formatted = chain.format(**fields)
+        profiler = FilterProfiler() if profile_template is not None else None
+        meshes = []
+        failed = _guard(input_path, input_start, lambda: meshes.append(formatted.run(profiler, stop=stop)))
+        if failed is not None:
+            if profiler is not None:
+                profiler.save(profile_template.format(**fields))
+            results[input_path] = failed
+            out.write("Failed: %s: %s\n" % (input_path, failed.error))
+            out.flush()
+            continue
+        # decoded textures are dropped while the other inputs load
+        textures.release(meshes[0])
+        loaded.append((input_path, fields, formatted, profiler, meshes[0], time.time() - input_start))
+
+    names = makeSharedAtlases([mesh for input_path, fields, formatted, profiler, mesh, seconds in loaded],
+                              directory, url)
+    out.write("Saved %d shared atlas pages to %s\n" % (len(names), directory))
+
+    for input_path, fields, formatted, profiler, mesh, seconds in loaded:
+        input_start = time.time() - seconds
+        def run():
+            try:
+                formatted.resume(mesh, stop, profiler)
+            finally:
+                if profiler is not None:
+                    profiler.save(profile_template.format(**fields))
+        failed = _guard(input_path, input_start, run)
+        if failed is not None:
+            results[input_path] = failed
+            out.write("Failed: %s: %s\n" % (input_path, failed.error))
+            out.flush()
+        else:
+            results[input_path] = BatchResult(input_path, time.time() - input_start)
+
+    results = [results[input_path] for input_path in inputs]
+    printSummary(results, time.time() - start, out)
+    return results
+
+def printSummary(results, elapsed, out=sys.stdout):
+    failed = [r for r in results if not r.succeeded()]
+    rate = len(results) / elapsed if elapsed > 0 else 0.0
+    out.write("Processed %d files in %.1fs (%.2f files/sec): %d succeeded, %d failed\n" %
+              (len(results), elapsed, rate, len(results) - len(failed), len(failed)))
+    for result in failed:
+        out.write("  %s: %s\n" % (result.input_path, result.error))
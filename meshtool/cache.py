@@ -0,0 +1,363 @@
+import os
+import re
+import hashlib
+import tempfile
+import cPickle
+from StringIO import StringIO
+
+import collada
+import meshtool
+from meshtool.filters import factory
+from meshtool.filters.load_filters.load_obj import filepath_loader
+from meshtool.pipeline import ChainError
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# Operation filters only get cached if their result depends on nothing but
+# the mesh and their arguments. save_mipmaps writes next to the textures and
+# save_obj and save_threejs_scene write more files than the one they're given,
+# so those (and anything after them) always run.
+CACHEABLE_CATEGORIES = set(['Optimizations', 'Simplification', 'Meta', 'Saving'])
+UNCACHEABLE_FILTERS = set(['save_mipmaps', 'save_obj', 'save_threejs_scene',
+                           'save_screenshot', 'save_rotate_screenshots'])
+
+# arguments that name a file the filter writes, by argument index
+OUTPUT_ARGUMENTS = {'sander_simplify': [0],
+                    'save_collada': [0],
+                    'save_collada_zip': [0],
+                    'save_badgerfish': [0],
+                    'save_ply': [0],
+                    'save_obj_zip': [0],
+                    'save_bam': [0]}
+
+# arguments that name a file the filter reads, by argument index
+INPUT_ARGUMENTS = {'add_back_pm': [0]}
+
+# the mesh is stored after these, so that chains which only differ
+# after them can pick up from there
+CHECKPOINT_FILTERS = set(['sander_simplify', 'make_atlases', 'make_atlas_pages',
+                          'medium_optimizations', 'full_optimizations'])
+
+MTLLIB_RE = re.compile(r'^[ \t]*mtllib[ \t]+(.+?)[ \t\r]*$', re.M)
+MTLMAP_RE = re.compile(r'^[ \t]*(?:map_Kd|map_Ka|map_Ks|map_bump|bump)[ \t]+(.+?)[ \t\r]*$', re.M)
+INIT_FROM_RE = re.compile(r'<init_from>\s*([^<]*?)\s*</init_from>')
+
+def readChunks(path, sha=None):
+    """Yields the contents of a file in chunks, adding each one to the
+    hashlib object sha if given"""
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(1024 * 1024)
+            if len(data) == 0:
+                break
+            if sha is not None:
+                sha.update(data)
+            yield data
+    finally:
+        f.close()
+
+def fileDigest(path):
+    """Returns the sha1 hex digest of a file's contents"""
+    sha = hashlib.sha1()
+    for data in readChunks(path, sha):
+        pass
+    return sha.hexdigest()
+
+def findLines(chunks, word):
+    """Returns the lines containing word in a file given as chunks"""
+    lines = []
+    tail = ''
+    for chunk in chunks:
+        data = tail + chunk
+        end = data.rfind('\n') + 1
+        #the last line may continue in the next chunk
+        tail = data[end:]
+        data = data[:end]
+        pos = data.find(word)
+        while pos != -1:
+            start = data.rfind('\n', 0, pos) + 1
+            pos = data.find('\n', pos)
+            lines.append(data[start:pos])
+            pos = data.find(word, pos)
+    if word in tail:
+        lines.append(tail)
+    return '\n'.join(lines)
+
+def findSections(chunks, begin, end):
+    """Returns the text from each begin marker up to the next end marker in a
+    file given as chunks"""
+    pieces = []
+    tail = ''
+    inside = False
+    for chunk in chunks:
+        data = tail + chunk
+        while True:
+            marker = end if inside else begin
+            pos = data.find(marker)
+            if pos == -1:
+                #the marker may be split across chunks
+                keep = min(len(data), len(marker) - 1)
+                if inside:
+                    pieces.append(data[:len(data) - keep])
+                tail = data[len(data) - keep:]
+                break
+            if inside:
+                pieces.append(data[:pos + len(marker)])
+                data = data[pos + len(marker):]
+            else:
+                data = data[pos:]
+            inside = not inside
+    if inside:
+        pieces.append(tail)
+    return ''.join(pieces)
+
+def auxiliaryText(load_filter_name, chunks):
+    """Returns the parts of a file that's about to be loaded, given as chunks,
+    that can name auxiliary files: the mtllib lines of an OBJ or the
+    library_images sections of a COLLADA file"""
+    if load_filter_name == 'load_obj':
+        return findLines(chunks, 'mtllib')
+    return findSections(chunks, '<library_images', '</library_images>')
+
+def auxiliaryFiles(load_filter_name, filename, text):
+    """Returns the names of the auxiliary files referenced by a file that's about
+    to be loaded, e.g. the MTL files and textures of an OBJ or the images of a
+    COLLADA file, given the text from :func:`auxiliaryText`. Names are given as
+    they appear in the file."""
+    if load_filter_name == 'load_obj':
+        aux_loader = filepath_loader(filename)
+        names = []
+        for mtl_name in MTLLIB_RE.findall(text):
+            names.append(mtl_name)
+            mtl_data = aux_loader(mtl_name)
+            if mtl_data is not None:
+                names.extend(MTLMAP_RE.findall(mtl_data))
+        return names
+    return INIT_FROM_RE.findall(text)
+
+def inputKey(load_filter_name, filename):
+    """Returns a key for a load filter's input that changes if the input file
+    or any of its auxiliary files change, or None if the file can't be read"""
+    if not os.path.isfile(filename):
+        return None
+    sha = hashlib.sha1()
+    sha.update(meshtool.__version__)
+    sha.update('\0' + load_filter_name + '\0')
+    text = auxiliaryText(load_filter_name, readChunks(filename, sha))
+    aux_loader = filepath_loader(filename)
+    for aux_name in auxiliaryFiles(load_filter_name, filename, text):
+        sha.update('\0' + aux_name + '\0')
+        aux_data = aux_loader(aux_name)
+        if aux_data is None:
+            sha.update('missing')
+        else:
+            sha.update(hashlib.sha1(aux_data).hexdigest())
+    return sha.hexdigest()
+
+def isCacheable(filter_name):
+    if filter_name in UNCACHEABLE_FILTERS:
+        return False
+    descriptor = factory.getDescriptor(filter_name)
+    return descriptor is not None and descriptor.CATEGORY in CACHEABLE_CATEGORIES
+
+def chainKeys(ordered_args, stream=False):
+    """Returns a key for the result of each prefix of a chain of filters. The
+    list stops at the first filter that can't be cached, so it's empty if the
+    input can't be read.
+
+    :param stream: The stream argument of :meth:`meshtool.pipeline.FilterChain.run`,
+                   which changes the key of the whole chain, since a streamed
+                   conversion writes different bytes
+    """
+    load_filter_name, load_filter_args = ordered_args[0]
+    key = inputKey(load_filter_name, load_filter_args[0])
+    if key is None:
+        return []
+    keys = [key]
+    for filter_name, arguments in ordered_args[1:]:
+        if not isCacheable(filter_name):
+            break
+        sha = hashlib.sha1(keys[-1])
+        sha.update('\0' + filter_name)
+        for i, arg in enumerate(arguments):
+            if i in OUTPUT_ARGUMENTS.get(filter_name, []):
+                # only the name of an output matters, not where it goes
+                arg = os.path.basename(arg)
+            elif i in INPUT_ARGUMENTS.get(filter_name, []):
+                arg = fileDigest(arg) if os.path.isfile(arg) else 'missing'
+            sha.update('\0' + arg)
+        keys.append(sha.hexdigest())
+    if stream and len(keys) == len(ordered_args):
+        keys[-1] = hashlib.sha1(keys[-1] + '\0stream').hexdigest()
+    return keys
+
+def packMesh(mesh):
+    """Serializes a mesh along with the data of its images"""
+    dae_data = StringIO()
+    mesh.write(dae_data)
+    images = {}
+    for cimg in mesh.images:
+        images[cimg.path] = cimg.data
+    return dae_data.getvalue(), images
+
+def unpackMesh(dae_data, images, filename=None):
+    """Loads a mesh serialized with :func:`packMesh`. The filename is set on the
+    mesh so filters that look for files next to the original input still work."""
+    mesh = collada.Collada(StringIO(dae_data), aux_file_loader=lambda path: images.get(path))
+    mesh.filename = filename
+    return mesh
+
+class ResultCache(object):
+    """An on-disk cache of filter chain results, keyed by :func:`chainKeys`.
+    Each entry is a pickled dict in its own file. When the cache grows past
+    max_size bytes, the least recently used entries are deleted."""
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def get(self, key):
+        """Returns the entry stored for key, or None"""
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            entry = cPickle.load(f)
+        except (cPickle.UnpicklingError, EOFError, ValueError):
+            return None
+        finally:
+            f.close()
+        try:
+            #mark as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        """Stores an entry under key, evicting old entries if needed"""
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        f = os.fdopen(fd, 'wb')
+        try:
+            cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        #rename is atomic, so other processes never see a partial entry
+        os.rename(temp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.pickle'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total_size += st.st_size
+        entries.sort()
+        while total_size > self.max_size and len(entries) > 0:
+            mtime, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total_size -= size
+
+class CachePlan(object):
+    """Tracks where a single run of a chain can be resumed from the cache
+    and which of its results should be stored"""
+
+    def __init__(self, cache, ordered_args, stream=False):
+        self.cache = cache
+        self.ordered_args = ordered_args
+        self.keys = chainKeys(ordered_args, stream)
+        self.outputs = {}
+
+        #store after expensive filters and after the last cacheable filter
+        #that changes the mesh, i.e. before the saves at the end of the chain
+        self.checkpoints = set()
+        last_mesh_filter = None
+        for i in range(1, len(self.keys)):
+            filter_name = ordered_args[i][0]
+            if filter_name in CHECKPOINT_FILTERS:
+                self.checkpoints.add(i)
+            if factory.getDescriptor(filter_name).CATEGORY != 'Saving':
+                last_mesh_filter = i
+        if last_mesh_filter is not None:
+            self.checkpoints.add(last_mesh_filter)
+
+    def isComplete(self):
+        """True if every filter in the chain can be cached"""
+        return len(self.keys) == len(self.ordered_args)
+
+    def restore(self):
+        """Finds the furthest point in the chain stored in the cache, writing
+        back any files the filters up to there would have written.
+
+        :returns: A tuple (position, mesh) of the last filter whose result was
+                  restored and the mesh after it. mesh is None if the whole chain
+                  was restored. (0, None) means nothing was found.
+        """
+        last = len(self.keys) - 1
+        if last > 0 and self.isComplete() and last not in self.checkpoints:
+            entry = self.cache.get(self.keys[last])
+            if entry is not None:
+                self._writeOutputs(entry['outputs'])
+                return last, None
+        for position in sorted(self.checkpoints, reverse=True):
+            entry = self.cache.get(self.keys[position])
+            if entry is not None and entry['mesh'] is not None:
+                self._writeOutputs(entry['outputs'])
+                self.outputs.update(entry['outputs'])
+                filename = self.ordered_args[0][1][0]
+                return position, unpackMesh(entry['mesh'], entry['images'], filename)
+        return 0, None
+
+    def _writeOutputs(self, outputs):
+        """Writes back the files restored filters wrote. Like the save filters
+        themselves, fails if any of them already exists, before writing any.
+
+        :raises: :class:`meshtool.pipeline.ChainError` if a save filter's output exists
+        """
+        for position, arg_index in sorted(outputs):
+            filter_name, arguments = self.ordered_args[position]
+            if factory.getDescriptor(filter_name).CATEGORY == 'Saving' and \
+                    os.path.exists(arguments[arg_index]):
+                raise ChainError("(argument %d) '%s': specified filename already exists" % (position, filter_name))
+        for (position, arg_index), data in outputs.iteritems():
+            f = open(self.ordered_args[position][1][arg_index], 'wb')
+            f.write(data)
+            f.close()
+
+    def store(self, position, mesh):
+        """Called after the filter at position has run"""
+        if position >= len(self.keys):
+            return
+        filter_name, arguments = self.ordered_args[position]
+        for arg_index in OUTPUT_ARGUMENTS.get(filter_name, []):
+            path = arguments[arg_index]
+            if os.path.isfile(path):
+                self.outputs[(position, arg_index)] = open(path, 'rb').read()
+
+        if position in self.checkpoints:
+            dae_data, images = packMesh(mesh)
+            self.cache.put(self.keys[position], {'mesh': dae_data,
+                                                 'images': images,
+                                                 'outputs': dict(self.outputs)})
+        elif position == len(self.ordered_args) - 1 and self.isComplete():
+            #nothing after this, so only the written files are needed
+            self.cache.put(self.keys[position], {'mesh': None,
+                                                 'images': None,
+                                                 'outputs': dict(self.outputs)})
@@ -0,0 +1,31 @@
+from meshtool.filters.base_filters import OptimizationFilter, FilterException
+from meshtool.args import FilterArgument
+from meshtool.filters.atlas_filters.make_atlases import makeAtlases
+
+def FilterGenerator():
+    class MakeAtlasPagesFilter(OptimizationFilter):
+        def __init__(self):
+            super(MakeAtlasPagesFilter, self).__init__('make_atlas_pages', 'Like make_atlases, but makes at most max_pages atlas pages ' +
+                                                       'for textures with alpha and for ones without. If same_size is true, every page is ' +
+                                                       '4096x4096 and the order of the pages is saved in an extra element, ' +
+                                                       'so they can be used as the layers of a texture array.')
+            self.arguments.append(FilterArgument('max_pages', 'The most pages to make for each group of textures'))
+            self.arguments.append(FilterArgument('same_size', 'true to make every page the same size, false otherwise'))
+        def apply(self, mesh, max_pages, same_size):
+            try:
+                max_pages = int(max_pages)
+            except ValueError:
+                raise FilterException('max_pages must be a number')
+            if max_pages < 1:
+                raise FilterException('max_pages must be at least 1')
+            if same_size.lower() in ('true', 'yes', '1'):
+                same_size = True
+            elif same_size.lower() in ('false', 'no', '0'):
+                same_size = False
+            else:
+                raise FilterException('same_size must be true or false')
+            makeAtlases(mesh, max_pages, same_size)
+            return mesh
+    return MakeAtlasPagesFilter()
+from meshtool.filters import factory
+factory.register(FilterGenerator().name, FilterGenerator)
@@ -1,8 +1,13 @@
 from meshtool.filters.base_filters import OptimizationFilter
 from meshtool.filters.atlas_filters.rectpack import RectPack
 from meshtool.util import Image
+from meshtool.textures import getPILImage, getImageInfo, hasAlpha, release
+import os
 import math
+import hashlib
+import posixpath
 import collada
+from collada.common import E, tag
 import numpy
 import itertools
 from StringIO import StringIO
@@ -11,6 +16,9 @@ from StringIO import StringIO
 MAX_IMAGE_DIMENSION = 4096
 MAX_TILING_DIMENSION = 2048
 
+#profile of the extra element that records the layers of same size pages
+LAYERS_PROFILE = 'MESHTOOL_TEXTURE_ARRAY'
+
 class TexcoordSet(object):
     """Container class holding all the information needed to indentify and locate a
     single set of texture coordinates"""
@@ -93,154 +101,320 @@ def combinePacks(to_del1, to_del2):
                 to_del1[geom] = primlist
         return to_del1
 
-def splitAlphas(unique_images):
-    group1 = dict(( (path, pilimg) for path, pilimg in unique_images.iteritems() if 'A' in pilimg.getbands() ))
-    group2 = dict(( (path, pilimg) for path, pilimg in unique_images.iteritems() if 'A' not in pilimg.getbands() ))
+def splitAlphas(mesh, unique_images):
+    alphas = dict(( (path, hasAlpha(getImageInfo(cimg, mesh))) for path, cimg in unique_images.iteritems() ))
+    group1 = dict(( (path, cimg) for path, cimg in unique_images.iteritems() if alphas[path] ))
+    group2 = dict(( (path, cimg) for path, cimg in unique_images.iteritems() if not alphas[path] ))
 
     return group1, group2
 
-def packImages(mesh, img2texs, unique_images, image_scales):
+def lanczosTaps(src_size, tiles, dst_size):
+    """Returns the source pixels and weights that resampling a row of
+    src_size pixels, repeated tiles times, to dst_size pixels adds up for
+    each output pixel. The filter is the same Lanczos one as
+    Image.ANTIALIAS, but since the source repeats, it carries on into the
+    next copy instead of stopping at the edges.
+
+    :returns: A tuple of two (dst_size, taps) arrays, of source pixel
+              positions, which can be outside the source and wrap around,
+              and of their weights
+    """
+    scale = float(src_size * tiles) / dst_size
+    filterscale = max(scale, 1.0)
+    support = 3.0 * filterscale
+    centers = (numpy.arange(dst_size) + 0.5) * scale
+    first = numpy.floor(centers - support + 0.5).astype(numpy.int64)
+    positions = first[:,numpy.newaxis] + numpy.arange(int(math.ceil(2 * support)) + 1)
+    x = (positions - centers[:,numpy.newaxis] + 0.5) / filterscale
+    weights = numpy.where(numpy.abs(x) < 3.0, numpy.sinc(x) * numpy.sinc(x / 3.0), 0.0)
+    weights /= numpy.sum(weights, axis=1)[:,numpy.newaxis]
+    return positions, weights
+
+#output pixels along an axis that are resampled with one matrix multiply
+RESAMPLE_BLOCK = 16
+
+def resampleBlocks(data, axis, tiles, dst_size):
+    """Resamples a float32 array along axis 0 or 1 as if it were repeated
+    tiles times along it, yielding it RESAMPLE_BLOCK output pixels at a time.
+    Each block is a matrix multiply with only the source pixels it covers.
+
+    :returns: A generator of (start, stop, block) tuples
+    """
+    src_size = data.shape[axis]
+    positions, weights = lanczosTaps(src_size, tiles, dst_size)
+    for start in range(0, dst_size, RESAMPLE_BLOCK):
+        stop = min(start + RESAMPLE_BLOCK, dst_size)
+        block_positions = positions[start:stop]
+        first = block_positions.min()
+        matrix = numpy.zeros((block_positions.max() + 1 - first, stop - start), dtype=numpy.float32)
+        columns = numpy.repeat(numpy.arange(stop - start)[:,numpy.newaxis], block_positions.shape[1], axis=1)
+        matrix[block_positions - first, columns] = weights[start:stop]
+        window = numpy.take(data, numpy.arange(first, first + matrix.shape[0]), axis=axis, mode='wrap')
+        if axis == 0:
+            yield start, stop, numpy.dot(matrix.T, window)
+        else:
+            yield start, stop, numpy.dot(window, matrix)
+
+def compositeImage(region, pilimg, tile_x, tile_y):
+    """Writes an image, repeated tile_x by tile_y times and resampled to the
+    size of region, straight into region, an RGBA uint8 array that's a view
+    of the atlas. The tiled image is never made.
+    """
+    height, width = region.shape[:2]
+    src_width, src_height = pilimg.size
+
+    if tile_x == 1 and tile_y == 1:
+        if pilimg.size != (width, height):
+            pilimg = pilimg.resize((width, height), Image.ANTIALIAS)
+        region[:] = numpy.asarray(pilimg.convert('RGBA'))
+        return
+
+    has_alpha = 'A' in pilimg.getbands()
+    src = numpy.asarray(pilimg.convert('RGBA'))
+    if (src_width * tile_x, src_height * tile_y) == (width, height):
+        #already the right size, so just copy each tile into place
+        for y in range(tile_y):
+            for x in range(tile_x):
+                region[y*src_height:(y+1)*src_height, x*src_width:(x+1)*src_width] = src
+        return
+
+    #resample the rows and then the columns of the one copy of the source.
+    #like PIL, colors are weighted by alpha while resampling
+    src = src.astype(numpy.float32)
+    if has_alpha:
+        src[:,:,:3] *= src[:,:,3:] / 255.0
+    src = src.transpose(0, 2, 1).reshape(src_height * 4, src_width)
+    rows = numpy.empty((src_height * 4, width), dtype=numpy.float32)
+    for start, stop, block in resampleBlocks(src, 1, tile_x, width):
+        rows[:,start:stop] = block
+    del src
+
+    rows = rows.reshape(src_height, 4 * width)
+    for start, stop, block in resampleBlocks(rows, 0, tile_y, height):
+        block = block.reshape(-1, 4, width).transpose(0, 2, 1)
+        if has_alpha:
+            alpha = block[:,:,3:]
+            block[:,:,:3] *= numpy.where(alpha > 0, 255.0 / numpy.maximum(alpha, 1e-6), 0)
+        region[start:stop] = numpy.clip(block + 0.5, 0, 255)
+
+def packImages(mesh, img2texs, unique_images, image_sizes, image_scales, max_pages=None, same_size=False):
+    """Packs images onto atlas pages of at most MAX_IMAGE_DIMENSION square in
+    one pass, and points the texture coordinates that use each image at the
+    page it went on
+
+    :param unique_images: The images to pack, by path
+    :param image_sizes: The size each image has in the atlas, by path
+    :param max_pages: The most pages to make. Images that don't fit on any
+                      of them aren't atlased.
+    :param same_size: If True, every page is MAX_IMAGE_DIMENSION square, so
+                      they can be used as the layers of a texture array
+    :returns: A tuple of the primitives to delete, as :func:`combinePacks`
+              takes them, and the new image of each page, in order
+    """
     #if there aren't at least two images left, nothing to do
     if len(unique_images) < 2:
-        return
-    
+        return None, []
+
     #okay, now we can start packing!
     rp = RectPack(MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION)
-    for path, pilimg in unique_images.iteritems():
-        width, height = pilimg.size
+    for path in unique_images:
+        width, height = image_sizes[path]
         rp.addRectangle(path, width, height)
-    success = rp.pack()
-
-    if not success:
-        if len(rp.rejects) == len(unique_images):
-            #this means that nothing could be packed into the max size
-            # if not a single image can be packed into the max size
-            # then there's no point in continuing
-            return
-                
-        group1 = dict(( (path, pilimg) for path, pilimg in unique_images.iteritems() if path in rp.rejects ))
-        group2 = dict(( (path, pilimg) for path, pilimg in unique_images.iteritems() if path not in rp.rejects ))
+    rp.packPages(max_pages, same_size)
+
+    to_del = None
+    pages = []
+    for width, height, paths in rp.pages:
+        #an image alone on a page would only be copied
+        if len(paths) < 2 and not same_size:
+            continue
+        page_images = dict((path, unique_images[path]) for path in paths)
+        page_del, page_cimg = makeAtlasPage(mesh, img2texs, page_images, image_scales,
+                                            rp, width, height)
+        to_del = combinePacks(to_del, page_del)
+        if page_cimg is not None:
+            pages.append(page_cimg)
+    return to_del, pages
+
+def drawAtlas(sources, image_scales, rp, width, height):
+    """Draws the images of one atlas page and encodes it as PNG
+
+    :param sources: The (cimg, mesh) of each image on the page, by its key in rp
+    :param image_scales: How many times each image is tiled, by key
+    :returns: A tuple of the PNG data and the keys of the images drawn.
+              An image that can't be decoded leaves its place empty.
+    """
+    #images are decoded and written into the atlas one at a time, and
+    #dropped from the mesh's decoded textures once they're in it, so only
+    #one of them is ever in memory at once
+    atlas = numpy.empty((height, width, 4), dtype=numpy.uint8)
+    atlas[:] = (0,0,0,255)
+    drawn = []
+    for key, (cimg, mesh) in sources.iteritems():
+        pilimg = getPILImage(cimg, mesh)
+        if pilimg is None:
+            continue
+        x,y,w,h = rp.getPlacement(key)
+        tile_x, tile_y = image_scales[key]
+        compositeImage(atlas[y:y+h, x:x+w], pilimg, tile_x, tile_y)
+        del pilimg
+        release(mesh, [cimg])
+        drawn.append(key)
+
+    #the PIL image shares the array's memory rather than copying it
+    atlasimg = Image.fromarray(atlas, 'RGBA')
+    strbuf = StringIO()
+    atlasimg.save(strbuf, 'PNG', optimize=True)
+    return strbuf.getvalue(), drawn
+
+def moveTexcoords(mesh, texsets, scale, placement, width, height, to_del):
+    """Points the texture coordinates that use an image at where it was
+    placed on an atlas page, adding the primitives they replace to to_del
+
+    :param scale: How many times the image is tiled on the page
+    :param placement: The (x, y, w, h) of the image on the page
+    """
+    x,y,w,h = placement
+    x,y,w,h,width,height = (float(i) for i in (x,y,w,h,width,height))
+    tile_x, tile_y = (float(i) for i in scale)
+
+    for texset in texsets:
+        geom = mesh.geometries[texset.geom_id]
+        prim = geom.primitives[texset.prim_index]
+        texarray = numpy.copy(prim.texcoordset[texset.texcoordset_index])
         
-        return combinePacks(packImages(mesh, img2texs, group1, image_scales),
-                    packImages(mesh, img2texs, group2, image_scales))
-    
-    width = rp.width
-    height = rp.height
-    
-    print "actually making atlas of size %dx%d with %d subimages referenced by %d texcoords" % \
-        (width, height, len(unique_images), sum([len(img2texs[imgpath]) for imgpath in unique_images]))
-    atlasimg = Image.new('RGBA', (width, height), (0,0,0,255))
-    
-    to_del = {}
-    for path, pilimg in unique_images.iteritems():
-        x,y,w,h = rp.getPlacement(path)
-        atlasimg.paste(pilimg, (x,y,x+w,y+h))
+        #this shrinks the texcoords to 0,1 range for a tiled image
+        if tile_x > 1.0:
+            texarray[:,0] = texarray[:,0] / tile_x
+        if tile_y > 1.0:
+            texarray[:,1] = texarray[:,1] / tile_y
         
-        x,y,w,h,width,height = (float(i) for i in (x,y,w,h,width,height))
+        #this computes the coordinates of the lowest and highest texel
+        # if the texcoords go outside that range, rescale so they are inside
+        # suggestion by nvidia texture atlasing white paper
+        minx, maxx = numpy.min(texarray[:,0]), numpy.max(texarray[:,0])
+        miny, maxy = numpy.min(texarray[:,1]), numpy.max(texarray[:,1])
+        lowest_x = 0.5 / w
+        lowest_y = 0.5 / h
+        highest_x = 1.0 - lowest_x
+        highest_y = 1.0 - lowest_y
+        if minx < lowest_x or maxx > highest_x:
+            texarray[:,0] = texarray[:,0] * (highest_x - lowest_x) + lowest_x
+        if miny < lowest_y or maxy > highest_y:
+            texarray[:,1] = texarray[:,1] * (highest_y - lowest_y) + lowest_y
+
+        #this rescales the texcoords to map to the new atlas location
+        texarray[:,0] = texarray[:,0] * (w / width) + (x / (width-1))
+        texarray[:,1] = texarray[:,1] * (h / height) + (1.0 - (y+h)/height)
         
-        for texset in img2texs[path]:
-            geom = mesh.geometries[texset.geom_id]
-            prim = geom.primitives[texset.prim_index]
-            texarray = numpy.copy(prim.texcoordset[texset.texcoordset_index])
-            tile_x, tile_y = (float(i) for i in image_scales[path])
-            
-            #this shrinks the texcoords to 0,1 range for a tiled image
-            if tile_x > 1.0:
-                texarray[:,0] = texarray[:,0] / tile_x
-            if tile_y > 1.0:
-                texarray[:,1] = texarray[:,1] / tile_y
-            
-            #this computes the coordinates of the lowest and highest texel
-            # if the texcoords go outside that range, rescale so they are inside
-            # suggestion by nvidia texture atlasing white paper
-            minx, maxx = numpy.min(texarray[:,0]), numpy.max(texarray[:,0])
-            miny, maxy = numpy.min(texarray[:,1]), numpy.max(texarray[:,1])
-            lowest_x = 0.5 / w
-            lowest_y = 0.5 / h
-            highest_x = 1.0 - lowest_x
-            highest_y = 1.0 - lowest_y
-            if minx < lowest_x or maxx > highest_x:
-                texarray[:,0] = texarray[:,0] * (highest_x - lowest_x) + lowest_x
-            if miny < lowest_y or maxy > highest_y:
-                texarray[:,1] = texarray[:,1] * (highest_y - lowest_y) + lowest_y
-
-            #this rescales the texcoords to map to the new atlas location
-            texarray[:,0] = texarray[:,0] * (w / width) + (x / (width-1))
-            texarray[:,1] = texarray[:,1] * (h / height) + (1.0 - (y+h)/height)
-            
-            oldsources = prim.getInputList().getList()
-            newsources = collada.source.InputList()
-            for (offset, semantic, source, setid) in oldsources:
-                if semantic == 'TEXCOORD' and (setid is None or int(setid) == texset.texcoordset_index):
-                    orig_source = source
-                    i=0
-                    while source[1:] in geom.sourceById:
-                        source = orig_source + '-atlas-' + str(i)
-                        i += 1
-                    new_tex_src = collada.source.FloatSource(source[1:], texarray, ('S', 'T'))
-                    geom.sourceById[source[1:]] = new_tex_src
-                newsources.addInput(offset, semantic, source, setid)
-            
-            if geom not in to_del:
-                to_del[geom] = []
-            to_del[geom].append(texset.prim_index)
-            
-            if type(prim) is collada.triangleset.TriangleSet:
-                prim.index.shape = -1
-                newprim = geom.createTriangleSet(prim.index, newsources, prim.material)
-            elif type(prim) is collada.polylist.Polylist:
-                prim.index.shape = -1
-                prim.vcounts.shape = -1
-                newprim = geom.createPolylist(prim.index, prim.vcounts, newsources, prim.material)
-            elif type(prim) is collada.polygons.Polygons:
-                prim.index.shape = -1
-                newprim = geom.createPolygons(prim.index, newsources, prim.material)
-            elif type(prim) is collada.lineset.LineSet:
-                prim.index.shape = -1
-                newprim = geom.createLineSet(prim.index, newsources, prim.material)
-            else:
-                raise Exception("Unknown primitive type")
-            
-            geom.primitives.append(newprim)
+        oldsources = prim.getInputList().getList()
+        newsources = collada.source.InputList()
+        for (offset, semantic, source, setid) in oldsources:
+            if semantic == 'TEXCOORD' and (setid is None or int(setid) == texset.texcoordset_index):
+                orig_source = source
+                i=0
+                while source[1:] in geom.sourceById:
+                    source = orig_source + '-atlas-' + str(i)
+                    i += 1
+                new_tex_src = collada.source.FloatSource(source[1:], texarray, ('S', 'T'))
+                geom.sourceById[source[1:]] = new_tex_src
+            newsources.addInput(offset, semantic, source, setid)
+        
+        if geom not in to_del:
+            to_del[geom] = []
+        to_del[geom].append(texset.prim_index)
         
+        if type(prim) is collada.triangleset.TriangleSet:
+            prim.index.shape = -1
+            newprim = geom.createTriangleSet(prim.index, newsources, prim.material)
+        elif type(prim) is collada.polylist.Polylist:
+            prim.index.shape = -1
+            prim.vcounts.shape = -1
+            newprim = geom.createPolylist(prim.index, prim.vcounts, newsources, prim.material)
+        elif type(prim) is collada.polygons.Polygons:
+            prim.index.shape = -1
+            newprim = geom.createPolygons(prim.index, newsources, prim.material)
+        elif type(prim) is collada.lineset.LineSet:
+            prim.index.shape = -1
+            newprim = geom.createLineSet(prim.index, newsources, prim.material)
+        else:
+            raise Exception("Unknown primitive type")
+        
+        geom.primitives.append(newprim)
+
+def replaceImages(mesh, paths, newcimage):
+    """Replaces the images with the given paths with newcimage, in the
+    images of the mesh and in the surfaces of its effects"""
+    imgs_deleted = [cimg for cimg in mesh.images if cimg.path in paths]
+    mesh.images = [cimg for cimg in mesh.images if cimg.path not in paths]
+    mesh.images.append(newcimage)
+
+    for effect in mesh.effects:
+        for param in effect.params:
+            if type(param) is collada.material.Surface:
+                if param.image in imgs_deleted:
+                    param.image = newcimage
+
+def makeAtlasPage(mesh, img2texs, unique_images, image_scales, rp, width, height):
+    """Makes the atlas image of one page, replacing the images on it
+
+    :returns: A tuple of the primitives to delete and the new image, which
+              is None if none of the images could be decoded
+    """
+    print "actually making atlas of size %dx%d with %d subimages referenced by %d texcoords" % \
+        (width, height, len(unique_images), sum([len(img2texs[imgpath]) for imgpath in unique_images]))
+    sources = dict((path, (cimg, mesh)) for path, cimg in unique_images.iteritems())
+    data, drawn = drawAtlas(sources, image_scales, rp, width, height)
+    unique_images = dict((path, unique_images[path]) for path in drawn)
+    if len(unique_images) == 0:
+        return {}, None
+
+    to_del = {}
+    for path in unique_images:
+        moveTexcoords(mesh, img2texs[path], image_scales[path], rp.getPlacement(path), width, height, to_del)
+
     imgs_deleted = [cimg for cimg in mesh.images if cimg.path in unique_images]
-    mesh.images = [cimg for cimg in mesh.images if cimg.path not in unique_images]
+    imgs_kept = [cimg for cimg in mesh.images if cimg.path not in unique_images]
     
     baseimgid = imgs_deleted[0].id + '-atlas'
     baseimgpath = './atlas'
     newimgid = baseimgid
     newimgpath = baseimgpath
     ct = 0
-    while newimgid in mesh.images or newimgpath + '.png' in [cimg.path for cimg in mesh.images]:
+    while newimgid in [cimg.id for cimg in imgs_kept] or newimgpath + '.png' in [cimg.path for cimg in imgs_kept]:
         newimgid = baseimgid + '-' + str(ct)
         newimgpath = baseimgpath + '-' + str(ct)
         ct += 1
 
     newimgpath = newimgpath + '.png'
     newcimage = collada.material.CImage(newimgid, newimgpath, mesh)
-    
-    strbuf = StringIO()
-    atlasimg.save(strbuf, 'PNG', optimize=True)
-    newcimage._data = strbuf.getvalue()
-    mesh.images.append(newcimage)
-    
-    for effect in mesh.effects:
-        for param in effect.params:
-            if type(param) is collada.material.Surface:
-                if param.image in imgs_deleted:
-                    param.image = newcimage
+    newcimage._data = data
+    replaceImages(mesh, unique_images, newcimage)
                     
-    return to_del
+    return to_del, newcimage
+
+def getAtlasCandidates(mesh):
+    """Finds the images of a mesh that can be atlased, which are the ones
+    whose texture coordinates are all inside the range (0,1), or tile them
+    into an image no bigger than MAX_TILING_DIMENSION, and aren't bound to
+    the same texture coordinates as any other image
 
-def makeAtlases(mesh):
-    # get a mapping from path to actual image, since theoretically you could have
-    # the same image file in multiple image nodes
+    :returns: A tuple of the images, the texture coordinates that use each
+              one, how many times each one is tiled, and their sizes from
+              their headers, as dicts by image path
+    """
+    # get a mapping from path to image, since theoretically you could have
+    # the same image file in multiple image nodes. images are only decoded
+    # once it's known they'll be atlased, so plan with their header sizes
     unique_images = {}
+    image_sizes = {}
     image_scales = {}
     for cimg in mesh.images:
         path = cimg.path
         if path not in unique_images:
-            unique_images[path] = cimg.pilimage
+            info = getImageInfo(cimg, mesh)
+            unique_images[path] = cimg
+            image_sizes[path] = (info.width, info.height) if info is not None else None
             image_scales[path] = (1,1)
     
     # get a mapping from texture coordinates to all of the images they get bound to
@@ -256,12 +430,12 @@ def makeAtlases(mesh):
     for texset, imgpaths in tex2img.iteritems():
         
         valid_range = False
-        if len(imgpaths) == 1:
+        if len(imgpaths) == 1 and image_sizes[imgpaths[0]] is not None:
             texarray = mesh.geometries[texset.geom_id] \
                         .primitives[texset.prim_index] \
                         .texcoordset[texset.texcoordset_index]
             
-            width, height = unique_images[imgpaths[0]].size
+            width, height = image_sizes[imgpaths[0]]
             tile_x = int(numpy.ceil(numpy.max(texarray[:,0])))
             tile_y = int(numpy.ceil(numpy.max(texarray[:,1])))
             stretched_width = tile_x * width
@@ -286,8 +460,8 @@ def makeAtlases(mesh):
                 if imgpath not in imgs_to_delete:
                     imgs_to_delete.append(imgpath)
             texs_to_delete.append(texset)
-    for imgpath, pilimg in unique_images.iteritems():
-        if max(pilimg.size) > MAX_IMAGE_DIMENSION and imgpath not in imgs_to_delete:
+    for imgpath, size in image_sizes.iteritems():
+        if (size is None or max(size) > MAX_IMAGE_DIMENSION) and imgpath not in imgs_to_delete:
             imgs_to_delete.append(imgpath)
     for imgpath in imgs_to_delete:
         for texset, imgpaths in tex2img.iteritems():
@@ -306,39 +480,181 @@ def makeAtlases(mesh):
             if imgpaths[0] == imgpath:
                 img2texs[imgpath].append(texset)
     
-    for path, pilimg in unique_images.iteritems():
-        tile_x, tile_y = image_scales[path]
-        width, height = pilimg.size
-        if tile_x > 1 or tile_y > 1:
-            if 'A' in pilimg.getbands():
-                imgformat = 'RGBA'
-                initval = (0,0,0,255)
-            else:
-                imgformat = 'RGB'
-                initval = (0,0,0)
-            tiled_img = Image.new(imgformat, (width*tile_x, height*tile_y), initval)
-            for x in range(tile_x):
-                for y in range(tile_y):
-                    tiled_img.paste(pilimg, (x*width,y*height))
-            pilimg = tiled_img
-            width, height = pilimg.size
-        
-        #round down to power of 2
-        width = int(math.pow(2, int(math.log(width, 2))))
-        height = int(math.pow(2, int(math.log(height, 2))))
-        if (width, height) != pilimg.size:
-            pilimg = pilimg.resize((width, height), Image.ANTIALIAS)
-        
-        unique_images[path] = pilimg
-    
-    group1, group2 = splitAlphas(unique_images)
-    to_del = combinePacks(packImages(mesh, img2texs, group1, image_scales),
-                packImages(mesh, img2texs, group2, image_scales))
+    return unique_images, img2texs, image_scales, image_sizes
+
+def atlasSize(size, scale):
+    """Returns the size an image of the given size, tiled scale times, gets
+    in an atlas, which is the tiled size rounded down to powers of 2"""
+    width, height = size
+    tile_x, tile_y = scale
+    width = int(math.pow(2, int(math.log(width * tile_x, 2))))
+    height = int(math.pow(2, int(math.log(height * tile_y, 2))))
+    return (width, height)
+
+def deletePrimitives(to_del):
+    """Deletes the primitives that atlasing replaced, given as
+    :func:`combinePacks` returns them"""
     if to_del is not None:
         for geom, primindices in to_del.iteritems():
             for i in sorted(primindices, reverse=True):
                 del geom.primitives[i]
 
+def setAtlasLayers(mesh, pages):
+    """Records the order of atlas pages made to be the layers of a texture
+    array in an extra element of the document, replacing any recorded
+    before, so it's saved along with the mesh. See :func:`getAtlasLayers`."""
+    root = mesh.xmlnode.getroot()
+    for extra in root.findall(tag('extra')):
+        technique = extra.find(tag('technique'))
+        if technique is not None and technique.get('profile') == LAYERS_PROFILE:
+            root.remove(extra)
+    layers = E.texture_array(*[E.layer(image=cimg.id) for cimg in pages])
+    root.append(E.extra(E.technique(layers, profile=LAYERS_PROFILE)))
+
+def getAtlasLayers(mesh):
+    """Returns the ids of the images recorded by :func:`setAtlasLayers`, in
+    layer order, or None if the mesh has none"""
+    for technique in mesh.xmlnode.getroot().findall('%s/%s' % (tag('extra'), tag('technique'))):
+        if technique.get('profile') == LAYERS_PROFILE:
+            return [layer.get('image') for layer in technique.findall('%s/%s' % (tag('texture_array'), tag('layer')))]
+    return None
+
+def makeAtlases(mesh, max_pages=None, same_size=False):
+    """Packs the images of a mesh that can be atlased onto atlas pages,
+    images with alpha separately from ones without
+
+    :param max_pages: The most pages to make for each of the two groups.
+                      Images that don't fit are left as they are.
+    :param same_size: If True, all pages of a group are MAX_IMAGE_DIMENSION
+                      square, so they can be used as the layers of a
+                      texture array. Their order is recorded in the mesh
+                      with :func:`setAtlasLayers`.
+    :returns: The new image of each page, as a list of the layers of the
+              group with alpha followed by the group without
+    """
+    unique_images, img2texs, image_scales, image_sizes = getAtlasCandidates(mesh)
+    
+    #planned from the sizes in the images' headers. each image is only
+    # decoded when it's drawn onto its page
+    atlas_sizes = dict((path, atlasSize(image_sizes[path], image_scales[path]))
+                       for path in unique_images)
+    
+    group1, group2 = splitAlphas(mesh, unique_images)
+    to_del1, pages1 = packImages(mesh, img2texs, group1, atlas_sizes, image_scales, max_pages, same_size)
+    to_del2, pages2 = packImages(mesh, img2texs, group2, atlas_sizes, image_scales, max_pages, same_size)
+    deletePrimitives(combinePacks(to_del1, to_del2))
+
+    if same_size:
+        setAtlasLayers(mesh, pages1 + pages2)
+    return pages1 + pages2
+
+def makeSharedAtlases(meshes, directory, url=None, max_pages=None):
+    """Packs the textures that more than one of a list of meshes use, found
+    by their contents, onto atlas pages that are saved once and shared by
+    all of them. Each mesh's texture coordinates are moved onto the pages
+    and its images replaced with ones pointing at the saved pages, so that
+    the same texels are only fetched once and draws of different meshes
+    can be batched. The new images are marked with
+    :func:`meshtool.util.isExternalImage` and don't have the pages' data,
+    so filters that decode textures can't be run on the meshes after this. Images used by only one mesh are left as they are.
+    This has to run before :func:`makeAtlases`, which would bake each
+    mesh's textures into atlases of its own that aren't shared.
+
+    :param meshes: The :class:`collada.Collada` instances
+    :param directory: Where to save the pages, as shared-atlas-N.png
+    :param url: What the paths of the new images start with, which has to
+                point at directory from where the meshes will be saved.
+                Defaults to directory.
+    :param max_pages: The most pages to make for each of the groups of
+                      images with and without alpha
+    :returns: The file names of the pages saved in directory
+    """
+    if url is None:
+        url = directory
+
+    candidates = []
+    users = {}
+    for mesh in meshes:
+        unique_images, img2texs, image_scales, image_sizes = getAtlasCandidates(mesh)
+        digests = dict((path, hashlib.sha1(cimg.data).hexdigest())
+                       for path, cimg in unique_images.iteritems())
+        candidates.append((mesh, unique_images, img2texs, image_scales, image_sizes, digests))
+        for digest in set(digests.itervalues()):
+            users[digest] = users.get(digest, 0) + 1
+
+    #one copy of each shared image is drawn, tiled as many times as the
+    # mesh that tiles it the most needs
+    sources = {}
+    sizes = {}
+    scales = {}
+    for mesh, unique_images, img2texs, image_scales, image_sizes, digests in candidates:
+        for path, digest in digests.iteritems():
+            if users[digest] < 2:
+                continue
+            if digest not in sources:
+                sources[digest] = (unique_images[path], mesh)
+                sizes[digest] = image_sizes[path]
+            scale_x, scale_y = scales.get(digest, (1,1))
+            tile_x, tile_y = image_scales[path]
+            scales[digest] = (max(scale_x, tile_x), max(scale_y, tile_y))
+
+    atlas_sizes = {}
+    groups = ({}, {})
+    for digest, (cimg, mesh) in sources.iteritems():
+        atlas_sizes[digest] = atlasSize(sizes[digest], scales[digest])
+        #images with alpha go on separate pages from ones without
+        groups[not hasAlpha(getImageInfo(cimg, mesh))][digest] = sources[digest]
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    to_del = {}
+    names = []
+    for group in groups:
+        if len(group) == 0:
+            continue
+        rp = RectPack(MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION)
+        for digest in group:
+            width, height = atlas_sizes[digest]
+            rp.addRectangle(digest, width, height)
+        rp.packPages(max_pages)
+
+        for width, height, digests in rp.pages:
+            name = 'shared-atlas-%d.png' % len(names)
+            print "making shared atlas %s of size %dx%d with %d subimages" % (name, width, height, len(digests))
+            data, drawn = drawAtlas(dict((digest, group[digest]) for digest in digests), scales, rp, width, height)
+            if len(drawn) == 0:
+                continue
+            f = open(os.path.join(directory, name), 'wb')
+            f.write(data)
+            f.close()
+            names.append(name)
+
+            for mesh, unique_images, img2texs, image_scales, image_sizes, mesh_digests in candidates:
+                paths = [path for path, digest in mesh_digests.iteritems() if digest in drawn]
+                if len(paths) == 0:
+                    continue
+                mesh_del = to_del.setdefault(mesh, {})
+                for path in paths:
+                    digest = mesh_digests[path]
+                    moveTexcoords(mesh, img2texs[path], scales[digest], rp.getPlacement(digest),
+                                  width, height, mesh_del)
+
+                newimgid = baseimgid = name[:-4]
+                ct = 0
+                while newimgid in [cimg.id for cimg in mesh.images]:
+                    newimgid = baseimgid + '-' + str(ct)
+                    ct += 1
+                #the page isn't loaded into the mesh, so that savers refer
+                # to the one copy in directory instead of copying it
+                newcimage = collada.material.CImage(newimgid, posixpath.join(url, name), mesh)
+                newcimage.external = True
+                replaceImages(mesh, paths, newcimage)
+
+    for mesh_del in to_del.itervalues():
+        deletePrimitives(mesh_del)
+
+    return names
+
 def FilterGenerator():
     class MakeAtlasesFilter(OptimizationFilter):
         def __init__(self):
@@ -1,40 +1,10 @@
-import bisect
+import math
+
+import numpy
 
 class CouldNotPack:
     pass
 
-class TreeNode:
-    def __init__(self, left, right, rect, key):
-        self.left = left
-        self.right = right
-        self.rect = rect
-        self.key = key
-        self.area = rect[2]*rect[3]
-
-    def __cmp__(self, other):
-        return cmp(self.area, other.area)
-
-    def __iter__(self):
-        if self.left is not None:
-            for k in self.left:
-                yield k
-        if self.key is not None:
-            yield (self.key, self.rect)
-        if self.right is not None:
-            for k in self.right:
-                yield k
-
-    def __str__(self):
-        return '<TreeNode id=%s %d-%d-%d-%d>' % (id(self), self.rect[0], self.rect[1], self.rect[2], self.rect[3])
-    def __repr__(self):
-        return self.__str__()
-
-class DummyAreaSorter(object):
-    def __init__(self, area):
-        self.area = area
-    def __cmp__(self, other):
-        return cmp(self.area, other.area)
-
 # Sort by longer side then shorter side, descending
 def rectcmp(rect1, rect2):
     (k1, w1, h1) = rect1
@@ -47,6 +17,174 @@ def rectcmp(rect1, rect2):
     if h2 > h1: return 1
     return 0
 
+def log2Floor(n):
+    """Returns the exponent of the largest power of 2 not above n"""
+    if n <= 1:
+        return 0
+    return int(math.floor(math.log(n, 2) + 1e-9))
+
+def log2Ceil(n):
+    """Returns the exponent of the smallest power of 2 not below n"""
+    if n <= 1:
+        return 0
+    return int(math.ceil(math.log(n, 2) - 1e-9))
+
+class WasteMap:
+    """The free rectangles left under the skyline when a rectangle is placed
+    above a lower part of it, so they can still be used for smaller ones.
+    They're kept as rows of x, y, right and bottom in a numpy array, so that
+    all of them can be tried at once."""
+
+    def __init__(self):
+        self.free = numpy.empty((64, 4), dtype=numpy.int64)
+        self.count = 0
+
+    def add(self, x, y, width, height):
+        if width <= 0 or height <= 0:
+            return
+        if self.count == len(self.free):
+            self.free = numpy.concatenate((self.free, numpy.empty_like(self.free)))
+        self.free[self.count] = (x, y, x + width, y + height)
+        self.count += 1
+
+    def insert(self, width, height):
+        """Places a rectangle in the free rectangle it fits best, returning
+        its (x, y) or None if it doesn't fit in any"""
+        if self.count == 0:
+            return None
+        free = self.free[:self.count]
+        xs = -(-free[:,0] // width) * width
+        ys = -(-free[:,1] // height) * height
+        leftover_x = free[:,2] - xs - width
+        leftover_y = free[:,3] - ys - height
+        fit = numpy.minimum(leftover_x, leftover_y)
+        fit[(leftover_x < 0) | (leftover_y < 0)] = numpy.iinfo(numpy.int64).max
+        i = numpy.argmin(fit)
+        if leftover_x[i] < 0 or leftover_y[i] < 0:
+            return None
+
+        x, y = int(xs[i]), int(ys[i])
+        free_x, free_y, right, bottom = (int(v) for v in free[i])
+        self.count -= 1
+        self.free[i] = self.free[self.count]
+        #split what's left around the rectangle into four, cutting across
+        #the full width above and below it and the rectangle's height beside it
+        self.add(free_x, free_y, right - free_x, y - free_y)
+        self.add(free_x, y + height, right - free_x, bottom - y - height)
+        self.add(free_x, y, x - free_x, height)
+        self.add(x + width, y, right - x - width, height)
+        return x, y
+
+class Skyline:
+    """Packs rectangles bottom-left into a fixed size bin, keeping only the
+    top edge of what's been placed so far as a list of segments, and the
+    space left under it in a :class:`WasteMap`"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        #segment i covers x from xs[i] to xs[i+1] (or the bin's width) at height ys[i]
+        self.xs = [0]
+        self.ys = [0]
+        self.waste = WasteMap()
+
+    def insert(self, width, height):
+        """Places a rectangle, returning its (x, y) or None if it doesn't fit
+
+        To avoid bleeding in mipmaps, a rectangle can't cross a power of 2
+        boundary, so it's only placed at x and y that are multiples of its
+        width and height.
+        """
+        if self.waste.count > 0:
+            location = self.waste.insert(width, height)
+            if location is not None:
+                return location
+
+        xs = self.xs
+        ys = self.ys
+        numsegs = len(xs)
+        bin_width = self.width
+        bin_height = self.height
+
+        best_top = bin_height + 1
+        best_x = best_y = None
+        i = 0
+        while i < numsegs:
+            x = xs[i]
+            if x % width != 0:
+                x += width - (x % width)
+            right = x + width
+            if right > bin_width:
+                break
+            seg_end = xs[i + 1] if i + 1 < numsegs else bin_width
+            if x >= seg_end:
+                #the aligned x is in a later segment, which will try it itself
+                i += 1
+                continue
+
+            #the rectangle rests on the highest segment under it
+            y = ys[i]
+            j = i + 1
+            while j < numsegs and xs[j] < right:
+                if ys[j] > y:
+                    y = ys[j]
+                j += 1
+            if y % height != 0:
+                y += height - (y % height)
+
+            top = y + height
+            if top < best_top:
+                best_top = top
+                best_x = x
+                best_y = y
+            i += 1
+
+        if best_x is None or best_top > bin_height:
+            return None
+        self._raise(best_x, best_x + width, best_y, best_top)
+        return best_x, best_y
+
+    def _raise(self, left, right, bottom, top):
+        xs = self.xs
+        ys = self.ys
+        numsegs = len(xs)
+
+        #the segments from the one under left to the last one before right
+        i = 0
+        while i + 1 < numsegs and xs[i + 1] <= left:
+            i += 1
+        j = i
+        while j + 1 < numsegs and xs[j + 1] < right:
+            j += 1
+
+        #the space between them and the rectangle can still hold smaller ones
+        for k in range(i, j + 1):
+            seg_left = max(xs[k], left)
+            seg_right = min(xs[k + 1] if k + 1 < numsegs else self.width, right)
+            self.waste.add(seg_left, ys[k], seg_right - seg_left, bottom - ys[k])
+
+        new_xs = xs[:i]
+        new_ys = ys[:i]
+        if xs[i] < left:
+            new_xs.append(xs[i])
+            new_ys.append(ys[i])
+        new_xs.append(left)
+        new_ys.append(top)
+        if right < self.width and (j + 1 >= numsegs or xs[j + 1] != right):
+            #the last segment carries on past the rectangle
+            new_xs.append(right)
+            new_ys.append(ys[j])
+        new_xs.extend(xs[j + 1:])
+        new_ys.extend(ys[j + 1:])
+
+        #join neighbours at the same height
+        self.xs = [new_xs[0]]
+        self.ys = [new_ys[0]]
+        for x, y in zip(new_xs[1:], new_ys[1:]):
+            if y != self.ys[-1]:
+                self.xs.append(x)
+                self.ys.append(y)
+
 class RectPack:
     def __init__(self, maxwidth=None, maxheight=None):
         self.maxwidth = maxwidth
@@ -56,169 +194,197 @@ class RectPack:
     def addRectangle(self, key, width, height):
         self.rectangles[key] = (width, height)
 
-    def pack(self):
-        global min_x_reject, min_y_reject
-        
+    def _tryPack(self, rects, width, height):
+        """Packs rects into a bin of the given size, returning the placements
+        and the rects that didn't fit"""
+        skyline = Skyline(width, height)
+        placements = {}
+        rejects = []
+        for key, rect_width, rect_height in rects:
+            location = skyline.insert(rect_width, rect_height)
+            if location is None:
+                rejects.append((key, rect_width, rect_height))
+            else:
+                placements[key] = (location[0], location[1], rect_width, rect_height)
+        return placements, rejects
+
+    def _sortedRects(self, max_width_exp, max_height_exp):
+        """Returns the rectangles in the order they're packed in, and
+        separately the ones bigger than the largest size, which can never
+        be placed"""
         rects = [(key, self.rectangles[key][0], self.rectangles[key][1])
                  for key in self.rectangles]
         rects.sort(rectcmp)
-        
-        #initial smallest pack could be two 1x1 rects, although not likely
-        width = 2
-        height = 2
-        
-        done = False
-        while not done:
-            locations = TreeNode(None, None, (0,0,width,height), None)
-            self.free_locations = [locations]
-            rejects = []
-            for rect in rects:
-                if self.insert(rect) is None:
+        fits = []
+        too_big = []
+        for rect in rects:
+            if max_width_exp is not None and rect[1] > 2 ** max_width_exp or \
+                    max_height_exp is not None and rect[2] > 2 ** max_height_exp:
+                too_big.append(rect)
+            else:
+                fits.append(rect)
+        return fits, too_big
+
+    def _shapes(self, area_exp, min_width_exp, min_height_exp, max_width_exp, max_height_exp):
+        """Returns the power of 2 sizes with an area of 2**area_exp that are
+        within the limits, squarest first"""
+        shapes = []
+        for width_exp in range(min_width_exp, area_exp - min_height_exp + 1):
+            height_exp = area_exp - width_exp
+            if max_width_exp is not None and width_exp > max_width_exp:
+                continue
+            if max_height_exp is not None and height_exp > max_height_exp:
+                continue
+            shapes.append((abs(width_exp - height_exp), -width_exp, 2 ** width_exp, 2 ** height_exp))
+        shapes.sort()
+        #a squarer bin almost always packs at least as well, so only the
+        #two squarest are worth trying
+        return [(width, height) for squareness, order, width, height in shapes[:2]]
+
+    def pack(self):
+        """Packs the rectangles into the smallest power of 2 sized bin it can
+        find, no bigger than maxwidth by maxheight. Sizes are searched for
+        starting at the smallest that could hold the total area of the
+        rectangles, growing by larger and larger steps until they fit and
+        then binary searching between the last size that didn't and the
+        one that did.
+
+        :returns: True if all rectangles were packed. Otherwise the ones
+                  that didn't fit in the largest size are in rejects.
+        """
+        max_width_exp = log2Floor(self.maxwidth) if self.maxwidth else None
+        max_height_exp = log2Floor(self.maxheight) if self.maxheight else None
+        rects, too_big = self._sortedRects(max_width_exp, max_height_exp)
+
+        #the bin has to be at least as wide and tall as the largest
+        #rectangle, and at least 2x2 like before
+        min_width_exp = max([1] + [log2Ceil(w) for key, w, h in rects])
+        min_height_exp = max([1] + [log2Ceil(h) for key, w, h in rects])
+        if max_width_exp is not None:
+            min_width_exp = min(min_width_exp, max_width_exp)
+        if max_height_exp is not None:
+            min_height_exp = min(min_height_exp, max_height_exp)
+        total_area = sum(w * h for key, w, h in rects)
+        low_exp = max(log2Ceil(total_area), min_width_exp + min_height_exp)
+        if max_width_exp is not None and max_height_exp is not None:
+            high_exp = max_width_exp + max_height_exp
+            low_exp = min(low_exp, high_exp)
+        else:
+            high_exp = None
+
+        def attempt(area_exp):
+            for width, height in self._shapes(area_exp, min_width_exp, min_height_exp,
+                                              max_width_exp, max_height_exp):
+                placements, rejects = self._tryPack(rects, width, height)
+                if len(rejects) == 0:
+                    return width, height, placements, rejects
+            return None
+
+        #the exponent grows by 1, 3, 7, 15... past low_exp, so the area is 2x,
+        # 8x, 128x... the lower bound, until everything fits or the largest
+        # size doesn't
+        packed = None
+        tried_exp = low_exp - 1
+        area_exp = low_exp
+        while True:
+            packed = attempt(area_exp)
+            if packed is not None or (high_exp is not None and area_exp >= high_exp):
+                break
+            tried_exp = area_exp
+            area_exp = min(area_exp * 2 - low_exp + 1, high_exp) if high_exp is not None \
+                        else area_exp * 2 - low_exp + 1
+
+        if packed is None:
+            #doesn't fit at the largest size, so pack what fits there
+            width = 2 ** max_width_exp
+            height = 2 ** max_height_exp
+            placements, rejects = self._tryPack(rects, width, height)
+            packed = (width, height, placements, rejects)
+        else:
+            #binary search between the last area that failed and the one that fit
+            low = tried_exp + 1
+            high = area_exp
+            while low < high:
+                mid = (low + high) // 2
+                result = attempt(mid)
+                if result is not None:
+                    packed = result
+                    high = mid
+                else:
+                    low = mid + 1
+
+        self.width, self.height, self.placements, rejects = packed
+        self.rejects = [reject[0] for reject in rejects + too_big]
+        return len(self.rejects) == 0
+
+    def packPages(self, maxpages=None, samesize=False):
+        """Packs the rectangles in one pass into pages of maxwidth by
+        maxheight, placing each one on the first page it fits on and only
+        starting a new page when it fits on none of them. Afterwards, each
+        page is shrunk to the smallest power of 2 size that still holds its
+        rectangles.
+
+        :param maxpages: The most pages to start. Rectangles that don't fit
+                         on any of them are in rejects.
+        :param samesize: If True, pages aren't shrunk, so they can be used
+                         as the layers of a texture array
+        :returns: True if all rectangles were packed. The page each one is
+                  on is given by :meth:`getPage`, and the size and keys of
+                  each page are in pages.
+        """
+        max_width_exp = log2Floor(self.maxwidth)
+        max_height_exp = log2Floor(self.maxheight)
+        page_width = 2 ** max_width_exp
+        page_height = 2 ** max_height_exp
+        rects, too_big = self._sortedRects(max_width_exp, max_height_exp)
+
+        skylines = []
+        page_rects = []
+        rejects = list(too_big)
+        placements = {}
+        for rect in rects:
+            key, rect_width, rect_height = rect
+            for skyline, on_page in zip(skylines, page_rects):
+                location = skyline.insert(rect_width, rect_height)
+                if location is not None:
+                    break
+            else:
+                if maxpages is not None and len(skylines) >= maxpages:
                     rejects.append(rect)
-            if len(rejects) == 0 or \
-                self.maxwidth and width >= self.maxwidth and \
-                self.maxheight and height >= self.maxheight:
-                done = True
-                
-            if not done:
-                minx = min((reject[1] for reject in rejects))
-                miny = min((reject[2] for reject in rejects))
-                totx = sum((reject[1] for reject in rejects))
-                toty = sum((reject[2] for reject in rejects))
-                
-                next_width = width
-                while width + minx > next_width:
-                    next_width *= 2
-                next_height = height
-                while height + miny > next_height:
-                    next_height *= 2
-
-                if (next_width - width < next_height - height or self.maxheight and height >= self.maxheight) and \
-                        (self.maxwidth is None or next_width <= self.maxwidth):
-                    width = next_width
-                elif (next_height - height <= next_width - width or self.maxwidth and width >= self.maxwidth) and \
-                        (self.maxheight is None or next_height <= self.maxheight):
-                    height = next_height
-                if width < minx:
-                    width = next_width
-                if height < miny:
-                    height = next_height
-        
+                    continue
+                skyline = Skyline(page_width, page_height)
+                on_page = []
+                skylines.append(skyline)
+                page_rects.append(on_page)
+                location = skyline.insert(rect_width, rect_height)
+            on_page.append(rect)
+            placements[key] = (location[0], location[1], rect_width, rect_height)
+
+        self.pages = []
+        self.page_of = {}
+        for page, on_page in enumerate(page_rects):
+            width, height = page_width, page_height
+            if not samesize:
+                #the page's rectangles go in the same order whatever else
+                #is packed, so they always fit again at the full size
+                shrunk = RectPack(page_width, page_height)
+                shrunk.rectangles = dict((key, (w, h)) for key, w, h in on_page)
+                if shrunk.pack():
+                    width, height = shrunk.width, shrunk.height
+                    placements.update(shrunk.placements)
+            keys = [key for key, w, h in on_page]
+            self.pages.append((width, height, keys))
+            for key in keys:
+                self.page_of[key] = page
+
+        self.placements = placements
         self.rejects = [reject[0] for reject in rejects]
-        
-        self.placements = dict(locations)
-        self.width = width
-        self.height = height
-        
-        if len(self.rejects) > 0:
-            return False
-        else:
-            return True
+        self.width = max([width for width, height, keys in self.pages] or [0])
+        self.height = max([height for width, height, keys in self.pages] or [0])
+        return len(self.rejects) == 0
 
     def getPlacement(self, key):
         return self.placements[key]
-    
-    def insert(self, rect):
-        width_to_insert = rect[1]*rect[2]
-        area_loc = bisect.bisect_left(self.free_locations, DummyAreaSorter(width_to_insert))
-        while area_loc < len(self.free_locations):
-            if self.free_locations[area_loc].key is not None or self.free_locations[area_loc].left is not None:
-                self.free_locations.pop(area_loc)
-                area_loc -= 1
-            else:
-                try_insert = self._insert(self.free_locations[area_loc], rect)
-                if try_insert is not None:
-                    return try_insert
-            area_loc += 1
-
-        return None
-            
-
-    def _insert(self, rootnode, rect):
-        toconsider = []
-        toconsider.append(rootnode)
-        
-        while len(toconsider) > 0:
-            node = toconsider.pop(0)
-            
-            if node.left is not None:
-                #we have children so try to insert at one of the children
-                toconsider.append(node.left)
-                toconsider.append(node.right)
-                continue
-        
-            if node.key is not None:
-                #this node already has something in it
-                continue
-            
-            #the x,y,width,height of this current rectangle
-            this_x, this_y, this_width, this_height = node.rect
-            #the key, width and height of the rect trying to be inserted
-            insert_key, insert_width, insert_height = rect
-            #location to try and put the new rect
-            insert_x, insert_y = this_x, this_y
-        
-            if insert_width == this_width and insert_height == this_height:
-                node.key = insert_key
-                node.rect = (this_x, this_y, this_width, this_height)
-                return node
-        
-            #to avoid bleeding in mipmaps, texture can't cross a power of 2 boundary
-            if insert_x % insert_width != 0:
-                insert_x += insert_width - (insert_x % insert_width)
-            if insert_y % insert_height != 0:
-                insert_y += insert_height - (insert_y % insert_height)
-        
-            if insert_x + insert_width > this_x + this_width or \
-                insert_y + insert_height > this_y + this_height:
-                #after adjusting, we don't have room for you here
-                continue
-        
-        
-            #the following will create the four possible pairs of rectangles
-            # we could split this rectangle into
-        
-            rects = []
-            
-            leftrect = (this_x, this_y, insert_x-this_x, this_height)
-            leftother = (insert_x, this_y, this_width-(insert_x-this_x), this_height)
-            rects.append((leftrect, leftother))
-            
-            toprect = (this_x, this_y, this_width, insert_y-this_y)
-            topother = (this_x, insert_y, this_width, this_height-(insert_y-this_y))
-            rects.append((toprect, topother))
-            
-            rightrect = (insert_x+insert_width, this_y, this_width-insert_width-(insert_x-this_x), this_height)
-            rightother = (this_x, this_y, (insert_x-this_x)+insert_width, this_height)
-            rects.append((rightrect, rightother))
-            
-            bottomrect = (this_x, insert_y+insert_height, this_width, this_height-insert_height-(insert_y-this_y))
-            bottomother = (this_x, this_y, this_width, (insert_y-this_y)+insert_height)
-            rects.append((bottomrect, bottomother))
-            
-            #now find the rectangle pair that maximizes the 
-            max_area = -1
-            max_offset = 0
-            for i, (irect, other) in enumerate(rects):
-                x,y,width,height = irect
-                if width*height > max_area:
-                    max_area = width*height
-                    max_offset = i
-            
-            insert_rect, other_rect = rects[max_offset]
-            node.left = TreeNode(None, None, insert_rect, None)
-            node.right = TreeNode(None, None, other_rect, None)
-            
-            bisect.insort(self.free_locations, node.left)
-            bisect.insort(self.free_locations, node.right)
-            
-            toconsider.insert(0, node.right)
-            toconsider.append(node.left)
-            
-        return None
-
-if __name__ == '__main__':
-    rp = RectPack()
-    for i in range(2000):
-        rp.addRectangle(i, 4, 4)
-    rp.pack()
\ No newline at end of file
+
+    def getPage(self, key):
+        return self.page_of[key]
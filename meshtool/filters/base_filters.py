@@ -1,4 +1,5 @@
 from meshtool.args import FileArgument
+import sys
 
 class FilterException(Exception):
     """Exception message thrown by a filter"""
@@ -65,19 +66,61 @@ class SaveFilter(OpFilter):
         
     CATEGORY = 'Saving'
 
+class FilterDescriptor(object):
+    """Describes a filter's name, category and arguments without importing the
+    module that implements it"""
+    def __init__(self, name, module, category, description, arguments):
+        self.name = name
+        self.module = module
+        self.CATEGORY = category
+        self.description = description
+        self.arguments = arguments
+    def __str__(self):
+        return "<FilterDescriptor (name=%s, module=%s)>" % (self.name, self.module)
+
 class FilterFactory(object):
     """Factor for registering and retrieving filters"""
     def __init__(self):
         self.registrar = {}
+        self.descriptors = {}
+        self.failed_modules = set()
         #keeping a list of names to preserve ordering
         self.nameList = []
     def register(self, name, filter_generator):
         self.registrar[name] = filter_generator
-        self.nameList.append(name)
-    def getInstance(self, name):
+        if name not in self.nameList:
+            self.nameList.append(name)
+    def registerLazy(self, descriptor):
+        """Registers a filter by descriptor. Its module is only imported the
+        first time an instance of the filter is requested."""
+        self.descriptors[descriptor.name] = descriptor
+        if descriptor.name not in self.nameList:
+            self.nameList.append(descriptor.name)
+    def loadFilter(self, name):
+        """Imports the module for a lazily registered filter. Returns False
+        if the module could not be imported."""
         if name in self.registrar:
+            return True
+        descriptor = self.descriptors.get(name)
+        if descriptor is None or descriptor.module in self.failed_modules:
+            return False
+        try:
+            __import__(descriptor.module)
+        except ImportError as e:
+            self.failed_modules.add(descriptor.module)
+            sys.stderr.write("Warning: filter '%s' disabled because of ImportError: %s\n" % (name, str(e)))
+            return False
+        return name in self.registrar
+    def getInstance(self, name):
+        if self.loadFilter(name):
             return self.registrar[name]()
         else:
             return None
+    def getDescriptor(self, name):
+        """Returns the descriptor for a filter without importing it, falling
+        back to an instance for filters registered directly"""
+        if name in self.descriptors:
+            return self.descriptors[name]
+        return self.getInstance(name)
     def getFilterNames(self):
         return self.nameList
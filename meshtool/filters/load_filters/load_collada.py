@@ -1,7 +1,20 @@
 from meshtool.filters.base_filters import LoadFilter, FilterException
+from meshtool.filters.load_filters.load_obj import SlowPathNeeded
+from meshtool.filters.load_filters.stream_collada import loadColladaStreamed
+from meshtool import meshcache
 import collada
 import os
 
+def loadColladaFromFile(filename, streamed=True):
+    """Loads a COLLADA file with :func:`stream_collada.loadColladaStreamed`,
+    or with pycollada if streamed is False or the file can't be streamed"""
+    if streamed:
+        try:
+            return loadColladaStreamed(filename)
+        except SlowPathNeeded:
+            pass
+    return collada.Collada(filename)
+
 def FilterGenerator():
     class ColladaLoadFilter(LoadFilter):
         def __init__(self):
@@ -10,7 +23,8 @@ def FilterGenerator():
             if not os.path.isfile(filename):
                 raise FilterException("argument is not a valid file")
             try:
-                col = collada.Collada(filename)
+                col = meshcache.loadWithSidecar(self.name, filename,
+                                                lambda aux_file_loader: loadColladaFromFile(filename))
             except collada.DaeError, e:
                 print e
                 raise FilterException("errors while loading file")
@@ -1,6 +1,8 @@
 import collections
 import os
+import mmap
 import sys
+import multiprocessing
 from meshtool.util import to_unicode, slugify
 from StringIO import StringIO
 import string
@@ -11,6 +13,7 @@ import collada
 
 from meshtool.filters.base_filters import FilterException, LoadFilter
 from meshtool.filters import factory
+from meshtool import meshcache
 
 class NameUniqifier(object):
     def __init__(self):
@@ -53,12 +56,36 @@ class ObjGroup(object):
         self.face_lengths = []
         self.line_indices = []
         self.face_mode = FACEMODE.UNKNOWN
+        # faces written straight to a COLLADA file instead of being kept here,
+        # see :mod:`meshtool.filters.load_filters.obj_to_collada`
+        self.streamed_faces = 0
     
     def empty(self):
-        if len(self.face_lengths) > 0 or len(self.line_indices) > 0:
+        if len(self.face_lengths) > 0 or len(self.line_indices) > 0 or self.streamed_faces > 0:
             return False
         return True
     
+    def getFaceLengths(self):
+        """Returns the number of vertices in each face as an int32 array"""
+        if len(self.face_lengths) > 0 and isinstance(self.face_lengths[0], numpy.ndarray):
+            return numpy.concatenate(self.face_lengths)
+        return numpy.array(self.face_lengths, dtype=numpy.int32)
+    
+    def getFaceIndices(self):
+        """Returns the OBJ (1-based) index values of the faces as an int32 array.
+        face_indices holds either the text of each face line or, when parsed in
+        bulk, arrays of index values."""
+        if len(self.face_indices) > 0 and isinstance(self.face_indices[0], numpy.ndarray):
+            return numpy.concatenate(self.face_indices)
+        # First, join the individual face lines together, separated by spaces. Then,        
+        # just replace 1/2/3 and 1//3 with "1 2 3" and "1  3", as numpy.fromstring can
+        # handle any whitespace it's given, similar to python's split(). Concatenating
+        # together this way is much faster than parsing the numbers in python - let
+        # numpy do it. Note that sep=" " is actually misleading - it handles tabs and
+        # other whitespace also
+        face_indices = (" ".join(self.face_indices)).replace("/", " ")
+        return numpy.fromstring(face_indices, dtype=numpy.int32, sep=" ")
+    
     def __str__(self):
         return "<ObjGroup '%s' %d faces>" % (self.name, len(self.face_lengths))
     def __repr__(self):
@@ -158,9 +185,8 @@ def loadMaterialLib(data, namer, aux_file_loader=None):
     effects = []
     current_effect = collada.material.Effect(' empty ', [], 'blinn')
     
-    file_like = StringIO(to_unicode(data))
-    for line in file_like:
-        line = line.strip()
+    for line in iterLines(data):
+        line = to_unicode(line).strip()
         
         # ignore blank lines and comments
         if len(line) == 0 or line.startswith('#'):
@@ -254,191 +280,640 @@ def loadMaterialLib(data, namer, aux_file_loader=None):
             'images': cimages,
             'effects': effects}
 
-def loadOBJ(data, aux_file_loader=None, validate_output=False):
-    """Loads an OBJ file
-    
-    :param data: A binary data string containing the OBJ file
-    :param aux_file_loader: Should be a callable function that takes one parameter.
-                            The parameter will be a string containing an auxiliary
-                            file that needs to be found, in this case usually a .mtl
-                            file or a texture file.
-    
-    :returns: An instance of :class:`collada.Collada` or None if could not be loaded
+class ObjState(object):
+    """Group, material and naming state built up while reading an OBJ file"""
+    def __init__(self, aux_file_loader=None):
+        self.aux_file_loader = aux_file_loader
+        self.namer = NameUniqifier()
+        self.materialNamer = NameUniqifier()
+        self.material_map = {}
+        self.cimages = []
+        self.groups = []
+        self.group = ObjGroup(self.namer.name("default"))
+        self.geometry_name = self.namer.name("convertedobjgeometry")
+
+def handleObjStatement(state, command, line):
+    """Handles an OBJ statement that isn't vertex data or a face, i.e. lines,
+    points, and group, object and material statements.
+
+    :returns: False if the file can't be loaded, True otherwise
+    """
+    group = state.group
+
+    if command == 'l':
+        faces = line.split()
+
+        if group.face_mode == FACEMODE.UNKNOWN:
+            group.face_mode = detectFaceStyle(faces[0])
+            if group.face_mode is None:
+                sys.stderr.write("Error: could not detect face type for line '%s'" % line)
+                return False
+
+        # COLLADA defines lines as a pair of points, so the index values "1 2 3 4" would
+        # refer to *two* lines, one between 1 and 2 and one between 3 and 4. OBJ defines
+        # lines as continous, so it would be three lines: 1-2, 2-3, 3-4. This duplicates
+        # the points to get pairs for COLLADA. This is not very efficient, but not sure
+        # of a faster way to do this and I've never seen any files with a huge number of
+        # lines in it anyway.
+        line = faces[0] + " " + faces[1]
+        prev = faces[1]
+        for cur in faces[2:]:
+            line += " " + prev + " " + cur
+            prev = cur
+        group.line_indices.append(line)
+
+    elif command == 'p':
+        faces = line.split()
+
+        if group.face_mode == FACEMODE.UNKNOWN:
+            group.face_mode = detectFaceStyle(faces[0])
+            if group.face_mode is None:
+                sys.stderr.write("Error: could not detect face type for line '%s'" % line)
+                return False
+
+        # COLLADA does not have points, so this converts a point to a line with two
+        # identical endpoints
+        line = " ".join(f + " " + f for f in faces)
+        group.line_indices.append(line)
+
+    # TODO: other elements
+    # curv
+    # curv2
+    # surf
+
+    elif command == 'g':
+        if group.empty():
+            # first group without any previous data, so just set name
+            group.name = state.namer.name(line)
+            return True
+
+        # end of previous group and start of new group
+        state.groups.append(group)
+        state.group = ObjGroup(state.namer.name(line))
+
+    elif command == 's':
+        # there is no way to map shading groups into collada
+        pass
+
+    elif command == 'o':
+        state.geometry_name = state.namer.name(line)
+
+    # TODO: grouping info
+    # mg
+
+    # TODO: Free-form curve/surface body statements
+    # parm
+    # trim
+    # hole
+    # scrv
+    # sp
+    # end
+    # con
+
+    elif command == 'mtllib':
+        mtl_file = None
+        if state.aux_file_loader is not None:
+            mtl_file = state.aux_file_loader(line)
+        if mtl_file is not None:
+            material_data = loadMaterialLib(mtl_file, namer=state.materialNamer, aux_file_loader=state.aux_file_loader)
+            state.material_map.update(material_data['material_map'])
+            state.cimages.extend(material_data['images'])
+
+    elif command == 'usemtl':
+        group.material = slugify(line)
+
+    # TODO: display and render attributes
+    # bevel
+    # c_interp
+    # d_interp
+    # lod
+    # shadow_obj
+    # trace_obj
+    # ctech
+    # stech
+
+    else:
+        print '  MISSING LINE: %s %s' % (command, line)
+
+    return True
+
+def iterLines(data):
+    """Iterates over the lines of a string or mmap without copying the whole thing"""
+    if isinstance(data, basestring):
+        return iter(StringIO(data))
+    data.seek(0)
+    return iter(data.readline, '')
+
+def parseOBJLines(data, state):
+    """Reads an OBJ file one line at a time
+
+    :returns: A tuple (vertices, normals, texcoords) of float32 arrays, or None
+              if the file can't be loaded
     """
-    
-    mesh = collada.Collada(validate_output=validate_output)
-    namer = NameUniqifier()
-    material_map = {}
-    cimages = []
-    materialNamer = NameUniqifier()
-    
     vertices = []
     normals = []
     texcoords = []
-    
-    groups = []
-    group = ObjGroup(namer.name("default"))
-    geometry_name = namer.name("convertedobjgeometry")
-    
-    file_like = StringIO(to_unicode(data))
-    for line in file_like:
-        line = line.strip()
-        
+
+    for line in iterLines(data):
+        line = to_unicode(line).strip()
+
         # ignore blank lines and comments
         if len(line) == 0 or line.startswith('#'):
             continue
-        
+
         # split off the first non-whitespace token and ignore the line if there isn't > 1 token
         splitup = line.split(None, 1)
         if len(splitup) != 2:
             continue
         command, line = splitup
-        
+
         if command == 'v':
             line_tokens = line.split()
             vertices.extend(line_tokens[:3])
-            
+
         elif command == 'vn':
             line_tokens = line.split()
             normals.extend(line_tokens[:3])
-           
+
         elif command == 'vt':
             line_tokens = line.split()
             texcoords.extend(line_tokens[:2])
-            
+
         # TODO: other vertex data statements
         # vp
         # cstype
         # deg
         # bmat
         # step
-            
+
         elif command == 'f':
             faces = line.split()
-            
+            group = state.group
+
             if group.face_mode == FACEMODE.UNKNOWN:
                 group.face_mode = detectFaceStyle(faces[0])
                 if group.face_mode is None:
                     sys.stderr.write("Error: could not detect face type for line '%s'" % line)
-                    return
-            
+                    return None
+
             group.face_lengths.append(len(faces))
-            
+
             # Don't decode the faces here because the / separators have to be parsed out
             # and this is very slow to do one at a time. Instead, just append to a list
             # which is much faster than appending to a string, and it will get joined and
             # parsed later
             group.face_indices.append(line)
-        
-        elif command == 'l':
-            faces = line.split()
-            
-            if group.face_mode == FACEMODE.UNKNOWN:
-                group.face_mode = detectFaceStyle(faces[0])
-                if group.face_mode is None:
-                    sys.stderr.write("Error: could not detect face type for line '%s'" % line)
-                    return
-            
-            # COLLADA defines lines as a pair of points, so the index values "1 2 3 4" would
-            # refer to *two* lines, one between 1 and 2 and one between 3 and 4. OBJ defines
-            # lines as continous, so it would be three lines: 1-2, 2-3, 3-4. This duplicates
-            # the points to get pairs for COLLADA. This is not very efficient, but not sure
-            # of a faster way to do this and I've never seen any files with a huge number of
-            # lines in it anyway.
-            line = faces[0] + " " + faces[1]
-            prev = faces[1]
-            for cur in faces[2:]:
-                line += " " + prev + " " + cur
-                prev = cur
-            group.line_indices.append(line)
-        
-        elif command == 'p':
-            faces = line.split()
-            
-            if group.face_mode == FACEMODE.UNKNOWN:
-                group.face_mode = detectFaceStyle(faces[0])
-                if group.face_mode is None:
-                    sys.stderr.write("Error: could not detect face type for line '%s'" % line)
-                    return
-                
-            # COLLADA does not have points, so this converts a point to a line with two
-            # identical endpoints
-            line = " ".join(f + " " + f for f in faces)
-            group.line_indices.append(line)
-        
-        # TODO: other elements
-        # curv
-        # curv2
-        # surf
-        
-        elif command == 'g':
-            if group.empty():
-                # first group without any previous data, so just set name
-                group.name = namer.name(line)
-                continue
-            
-            # end of previous group and start of new group
-            groups.append(group)
-            group = ObjGroup(namer.name(line))
-        
-        elif command == 's':
-            # there is no way to map shading groups into collada
+
+        elif not handleObjStatement(state, command, line):
+            return None
+
+    vertices = numpy.array(vertices, dtype=numpy.float32).reshape(-1, 3)
+    normals = numpy.array(normals, dtype=numpy.float32).reshape(-1, 3)
+    texcoords = numpy.array(texcoords, dtype=numpy.float32).reshape(-1, 2)
+    return vertices, normals, texcoords
+
+class SlowPathNeeded(Exception):
+    """Raised by :func:`parseOBJVectorized` for input it can't handle in bulk"""
+    pass
+
+# line kinds used by the vectorized parser
+LINE_OTHER, LINE_SKIP, LINE_V, LINE_VN, LINE_VT, LINE_F = range(6)
+
+_IS_WHITESPACE = numpy.zeros(256, dtype=numpy.bool_)
+_IS_WHITESPACE[[ord(c) for c in ' \t\r\n\x0b\x0c']] = True
+
+# vertex data records and the number of values kept from each
+_VERTEX_RECORDS = ((LINE_V, 3), (LINE_VN, 3), (LINE_VT, 2))
+
+# how much of a file the vectorized parser works on at once
+OBJ_WINDOW_SIZE = 4 * 1024 * 1024
+
+# number of index values per face vertex for each face mode
+_FACE_VALUES = {FACEMODE.V: 1, FACEMODE.VT: 2, FACEMODE.VN: 2, FACEMODE.VTN: 3}
+
+def classifyLines(buf):
+    """Splits a buffer of OBJ data into lines without creating a string per line
+
+    :param buf: A uint8 numpy array of the file's bytes
+
+    :returns: A tuple (starts, ends, kinds) of arrays, where kinds is one of
+              the LINE_* values, based on the first bytes of the line
+    """
+    newlines = numpy.flatnonzero(buf == ord('\n'))
+    starts = numpy.concatenate(([0], newlines + 1))
+    ends = numpy.concatenate((newlines, [len(buf)]))
+    if starts[-1] == len(buf):
+        # no line after the last newline
+        starts = starts[:-1]
+        ends = ends[:-1]
+    lengths = ends - starts
+
+    def byteAt(offset):
+        # bytes past the end of a line read as a newline
+        b = buf[numpy.minimum(starts + offset, max(len(buf) - 1, 0))]
+        return numpy.where(lengths > offset, b, ord('\n'))
+    b0 = byteAt(0)
+    b1 = byteAt(1)
+    b2 = byteAt(2)
+
+    kinds = numpy.empty(len(starts), dtype=numpy.int8)
+    kinds.fill(LINE_OTHER)
+    kinds[(lengths == 0) | ((lengths == 1) & (b0 == ord('\r'))) | (b0 == ord('#'))] = LINE_SKIP
+    is_v = b0 == ord('v')
+    kinds[is_v & _IS_WHITESPACE[b1]] = LINE_V
+    kinds[is_v & (b1 == ord('n')) & _IS_WHITESPACE[b2]] = LINE_VN
+    kinds[is_v & (b1 == ord('t')) & _IS_WHITESPACE[b2]] = LINE_VT
+    kinds[(b0 == ord('f')) & _IS_WHITESPACE[b1]] = LINE_F
+    return starts, ends, kinds
+
+def countTokens(buf, starts):
+    """Returns the number of whitespace separated tokens on each line"""
+    is_space = _IS_WHITESPACE[buf]
+    token_start = ~is_space
+    token_start[1:] &= is_space[:-1]
+    return numpy.add.reduceat(token_start, starts, dtype=numpy.int32)
+
+def firstValues(values, counts, width):
+    """Given the flattened values of records with counts values each, returns
+    a (N, width) array of the first width values of each record"""
+    if numpy.all(counts == width):
+        return values.reshape(-1, width)
+    offsets = numpy.cumsum(counts) - counts
+    return values[offsets[:,numpy.newaxis] + numpy.arange(width)]
+
+def lineWindows(data, window_size):
+    """Returns (start, end) offsets that split data into pieces of about
+    window_size bytes, each ending at the end of a line"""
+    windows = []
+    start = 0
+    size = len(data)
+    while start < size:
+        end = min(start + window_size, size)
+        if end < size:
+            newline = data.rfind('\n', start, end)
+            if newline == -1:
+                # a line longer than the window
+                newline = data.find('\n', end)
+            end = size if newline == -1 else newline + 1
+        windows.append((start, end))
+        start = end
+    return windows
+
+# outputs of the vectorized parser: the v, vn and vt records, the number of
+# vertices in each face, and the face index values
+_OUTPUT_KINDS = (LINE_V, LINE_VN, LINE_VT, 'face_lengths', 'face_values')
+
+def scanWindow(window):
+    """Returns how much of each output a window of OBJ data needs room for. The
+    count of face index values is an upper bound based on the size of the faces."""
+    start, end = window
+    buf = numpy.frombuffer(_parse_data[start:end], dtype=numpy.uint8)
+    if len(buf) == 0:
+        return dict((kind, 0) for kind in _OUTPUT_KINDS)
+    starts, ends, kinds = classifyLines(buf)
+    sizes = dict((kind, numpy.count_nonzero(kinds == kind)) for kind, width in _VERTEX_RECORDS)
+    is_face = kinds == LINE_F
+    sizes['face_lengths'] = numpy.count_nonzero(is_face)
+    # every index value takes at least two bytes, a digit and a separator
+    sizes['face_values'] = int((ends[is_face] - starts[is_face] + 1).sum() // 2)
+    return sizes
+
+def splitWindow(data):
+    """Classifies the lines of a window of OBJ data and blanks out the commands
+    and slashes of its records, so that the records of each kind are just numbers
+
+    :returns: A tuple (starts, ends, kinds, num_tokens, clean, byte_kinds), where
+              num_tokens is the number of values on each line, clean is the
+              blanked out data and byte_kinds is the kind of line each byte is on
+    """
+    buf = numpy.frombuffer(data, dtype=numpy.uint8)
+    starts, ends, kinds = classifyLines(buf)
+    num_tokens = countTokens(buf, starts) - 1
+
+    clean = buf.copy()
+    clean[buf == ord('/')] = ord(' ')
+    clean[starts[kinds >= LINE_V]] = ord(' ')
+    clean[starts[(kinds == LINE_VN) | (kinds == LINE_VT)] + 1] = ord(' ')
+
+    byte_kinds = numpy.repeat(kinds, numpy.diff(numpy.append(starts, len(buf))))
+    return starts, ends, kinds, num_tokens, clean, byte_kinds
+
+def parseFaces(data, starts, ends, kinds, num_tokens, face_text, num_values=None):
+    """Parses the faces of a window split up by :func:`splitWindow`, where
+    face_text is the blanked out text of just the face lines. Statements
+    that depend on what came before them (groups, materials, lines, etc.) aren't
+    handled here, but are returned along with where they fall between the faces.
+
+    :param num_values: The number of index values in face_text, if already
+                       known. The values aren't parsed if this is given, and
+                       face_values is None.
+
+    :raises: :class:`SlowPathNeeded` if the faces can't be parsed in bulk
+
+    :returns: A tuple (face_lengths, face_values, events), where events is a list,
+              in file order, of either ('statement', line) or ('faces', first_face,
+              num_faces, first_value, num_values, num_vertices, first_vertex) where
+              first_vertex is the text of the first vertex of the first face
+    """
+    face_lines = numpy.flatnonzero(kinds == LINE_F)
+    statement_lines = numpy.flatnonzero(kinds == LINE_OTHER)
+    events = [(i, ('statement', data[starts[i]:ends[i]])) for i in statement_lines.tolist()]
+    if len(face_lines) == 0:
+        return numpy.zeros(0, dtype=numpy.int32), numpy.zeros(0, dtype=numpy.int32), [e for i, e in events]
+
+    face_counts = num_tokens[face_lines]
+    if numpy.any(face_counts < 1):
+        raise SlowPathNeeded()
+    indices = None
+    if num_values is None:
+        indices = numpy.fromstring(face_text.tostring(), dtype=numpy.int32, sep=' ')
+        num_values = len(indices)
+
+    # faces go to whichever group is current, so split them up at each statement
+    breaks = numpy.searchsorted(face_lines, statement_lines)
+    bounds = numpy.unique(numpy.concatenate(([0], breaks, [len(face_lines)])))
+    vertex_bounds = numpy.concatenate(([0], numpy.cumsum(face_counts)))[bounds]
+    if len(bounds) == 2:
+        value_bounds = numpy.array([0, num_values])
+    else:
+        # count the values before the first face of each run
+        is_space = _IS_WHITESPACE[face_text]
+        token_start = ~is_space
+        token_start[1:] &= is_space[:-1]
+        tokens_before = numpy.concatenate(([0], numpy.cumsum(token_start, dtype=numpy.int32)))
+        if tokens_before[-1] != num_values:
+            raise SlowPathNeeded()
+        spans = numpy.diff(numpy.append(starts, len(data)))
+        byte_bounds = numpy.concatenate(([0], numpy.cumsum(spans[face_lines])))[bounds]
+        value_bounds = tokens_before[byte_bounds]
+
+    for first, last, first_value, last_value, first_vertex, last_vertex in zip(
+            bounds[:-1].tolist(), bounds[1:].tolist(),
+            value_bounds[:-1].tolist(), value_bounds[1:].tolist(),
+            vertex_bounds[:-1].tolist(), vertex_bounds[1:].tolist()):
+        i = face_lines[first]
+        first_face_vertex = data[starts[i]:ends[i]].split()[1]
+        events.append((i, ('faces', first, last - first, first_value, last_value - first_value,
+                           last_vertex - first_vertex, first_face_vertex)))
+    events.sort(key=lambda event: event[0])
+    return face_counts, indices, [event for line, event in events]
+
+def parseWindow(job):
+    """Parses a window of OBJ data, writing the vertex data and faces into the
+    output arrays at the given offsets.
+
+    :param job: A tuple ((start, end), offsets), where offsets gives the
+                position in each output array to write to
+
+    :raises: :class:`SlowPathNeeded` if the window has something the bulk
+             parser doesn't handle exactly like :func:`parseOBJLines` would
+
+    :returns: The events from :func:`parseFaces`, with positions in the
+              face_lengths and face_values outputs
+    """
+    (window_start, window_end), offsets = job
+    data = _parse_data[window_start:window_end]
+    out = _parse_output
+    if len(data) == 0:
+        return []
+    starts, ends, kinds, num_tokens, clean, byte_kinds = splitWindow(data)
+
+    for kind, width in _VERTEX_RECORDS:
+        counts = num_tokens[kinds == kind]
+        if len(counts) == 0:
             continue
-        
-        elif command == 'o':
-            geometry_name = namer.name(line)
-        
-        # TODO: grouping info
-        # mg
-        
-        # TODO: Free-form curve/surface body statements
-        # parm
-        # trim
-        # hole
-        # scrv
-        # sp
-        # end
-        # con
-        
-        elif command == 'mtllib':
-            mtl_file = None
-            if aux_file_loader is not None:
-                mtl_file = aux_file_loader(line)
-            if mtl_file is not None:
-                material_data = loadMaterialLib(mtl_file, namer=materialNamer, aux_file_loader=aux_file_loader)
-                material_map.update(material_data['material_map'])
-                cimages.extend(material_data['images'])
-            
-        elif command == 'usemtl':
-            group.material = slugify(line)
-        
-        # TODO: display and render attributes
-        # bevel
-        # c_interp
-        # d_interp
-        # lod
-        # shadow_obj
-        # trace_obj
-        # ctech
-        # stech
-        
+        if numpy.any(counts < width):
+            raise SlowPathNeeded()
+        # parse as double and then round, like numpy.array does from strings
+        values = numpy.fromstring(clean[byte_kinds == kind].tostring(), dtype=numpy.float64, sep=' ')
+        if len(values) != counts.sum():
+            raise SlowPathNeeded()
+        offset = offsets[kind]
+        out[kind][offset:offset + len(counts)] = firstValues(values, counts, width)
+
+    face_lengths, face_values, events = parseFaces(data, starts, ends, kinds, num_tokens,
+                                                   clean[byte_kinds == LINE_F])
+    first_face = offsets['face_lengths']
+    first_value = offsets['face_values']
+    out['face_lengths'][first_face:first_face + len(face_lengths)] = face_lengths
+    out['face_values'][first_value:first_value + len(face_values)] = face_values
+    return [event if event[0] == 'statement' else
+            event[:1] + (event[1] + first_face, event[2], event[3] + first_value) + event[4:]
+            for event in events]
+
+def applyStatement(state, text):
+    """Handles a statement event from :func:`parseFaces`
+
+    :returns: False if the file can't be loaded, True otherwise
+    """
+    line = to_unicode(text).strip()
+    if len(line) == 0 or line.startswith('#'):
+        return True
+    splitup = line.split(None, 1)
+    if len(splitup) != 2:
+        return True
+    command, line = splitup
+    if command in ('v', 'vn', 'vt', 'f'):
+        # indented vertex data
+        raise SlowPathNeeded()
+    return handleObjStatement(state, command, line)
+
+def checkFaces(group, first_vertex, num_values, num_vertices):
+    """Sets the face mode of a group from the first faces added to it, and
+    checks that faces being added to it have the same style of indices
+
+    :returns: False if the file can't be loaded, True otherwise
+    """
+    if group.face_mode == FACEMODE.UNKNOWN:
+        group.face_mode = detectFaceStyle(first_vertex)
+        if group.face_mode is None:
+            sys.stderr.write("Error: could not detect face type for line '%s'" % first_vertex)
+            return False
+    if num_values != num_vertices * _FACE_VALUES[group.face_mode]:
+        # faces with different index styles in one group
+        raise SlowPathNeeded()
+    return True
+
+def applyEvents(state, events, face_lengths, face_values):
+    """Handles the events from :func:`parseWindow` in order, adding faces to
+    the current group and running each statement.
+
+    :returns: False if the file can't be loaded, True otherwise
+    """
+    for event in events:
+        if event[0] == 'statement':
+            if not applyStatement(state, event[1]):
+                return False
+            continue
+
+        kind, first_face, num_faces, first_value, num_values, num_vertices, first_vertex = event
+        group = state.group
+        if not checkFaces(group, first_vertex, num_values, num_vertices):
+            return False
+        group.face_lengths.append(face_lengths[first_face:first_face + num_faces])
+        group.face_indices.append(face_values[first_value:first_value + num_values])
+    return True
+
+# files bigger than this are parsed with a process per CPU
+PARALLEL_PARSE_SIZE = 64 * 1024 * 1024
+
+# data being parsed and the arrays being parsed into, set in each worker process
+_parse_data = None
+_parse_output = None
+
+def _initParseWorker(data, output):
+    global _parse_data, _parse_output
+    _parse_data = data
+    _parse_output = output
+
+def sharedArray(shape, dtype, shared):
+    """Returns an uninitialized array, in memory shared with child processes if
+    shared is True. Pages that are never written to aren't allocated."""
+    if not shared:
+        return numpy.empty(shape, dtype=dtype)
+    nbytes = int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+    # an anonymous mmap is shared with processes forked after it's created
+    buf = mmap.mmap(-1, max(nbytes, 1))
+    return numpy.frombuffer(buf, dtype=dtype, count=int(numpy.prod(shape))).reshape(shape)
+
+def parseOBJVectorized(data, state, window_size=None, processes=None):
+    """Reads an OBJ file by classifying its lines in bulk and parsing all of the
+    vertex, normal, texcoord and face lines with one call to numpy.fromstring
+    each. Everything else goes through :func:`handleObjStatement` in order, as
+    in :func:`parseOBJLines`.
+
+    The data is read window_size bytes at a time, so it can be an mmap of a
+    file much larger than memory. Only the parsed arrays and one window per
+    process are in memory at once. With more than one process, windows are
+    parsed in parallel into shared memory, and then the groups and materials
+    are put together in file order.
+
+    :raises: :class:`SlowPathNeeded` if the file has something the bulk parser
+             doesn't handle exactly like :func:`parseOBJLines` would, e.g. vertices
+             with too few values or faces that mix index styles
+
+    :returns: A tuple (vertices, normals, texcoords) of float32 arrays, or None
+              if the file can't be loaded
+    """
+    windows = lineWindows(data, window_size or OBJ_WINDOW_SIZE)
+    parallel = processes is not None and processes > 1 and len(windows) > 1
+    pool = None
+    if parallel:
+        pool = multiprocessing.Pool(processes, _initParseWorker, (data, None))
+    _initParseWorker(data, None)
+    try:
+        # find out how much room each window needs, so each window's results
+        # can be written straight into the output arrays
+        scans = pool.map(scanWindow, windows) if parallel else map(scanWindow, windows)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    offsets = []
+    totals = dict((kind, 0) for kind in _OUTPUT_KINDS)
+    for sizes in scans:
+        offsets.append(dict(totals))
+        for kind in _OUTPUT_KINDS:
+            totals[kind] += sizes[kind]
+    output = {}
+    for kind, width in _VERTEX_RECORDS:
+        output[kind] = sharedArray((totals[kind], width), numpy.float32, parallel)
+    output['face_lengths'] = sharedArray((totals['face_lengths'],), numpy.int32, parallel)
+    output['face_values'] = sharedArray((totals['face_values'],), numpy.int32, parallel)
+
+    jobs = zip(windows, offsets)
+    if parallel:
+        pool = multiprocessing.Pool(processes, _initParseWorker, (data, output))
+        results = pool.imap(parseWindow, jobs)
+    else:
+        _initParseWorker(data, output)
+        results = (parseWindow(job) for job in jobs)
+    try:
+        for events in results:
+            if not applyEvents(state, events, output['face_lengths'], output['face_values']):
+                return None
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        _initParseWorker(None, None)
+
+    return tuple(output[kind] for kind, width in _VERTEX_RECORDS)
+
+def loadOBJ(data, aux_file_loader=None, validate_output=False, vectorized=True, processes=None):
+    """Loads an OBJ file
+
+    :param data: A binary data string containing the OBJ file, or an mmap of it
+    :param aux_file_loader: Should be a callable function that takes one parameter.
+                            The parameter will be a string containing an auxiliary
+                            file that needs to be found, in this case usually a .mtl
+                            file or a texture file.
+    :param vectorized: If True, parse vertex data and faces in bulk with numpy,
+                       falling back to reading line by line if the file has
+                       something the bulk parser doesn't handle
+    :param processes: Number of processes to parse with when vectorized. The
+                      file is split into windows at line boundaries, which
+                      are parsed in parallel.
+
+    :returns: An instance of :class:`collada.Collada` or None if could not be loaded
+    """
+
+    parsed = None
+    if vectorized:
+        state = ObjState(aux_file_loader)
+        try:
+            parsed = parseOBJVectorized(data, state, processes=processes)
+        except SlowPathNeeded:
+            parsed = None
         else:
-            print '  MISSING LINE: %s %s' % (command, line)
-    
+            if parsed is None:
+                return None
+    if parsed is None:
+        state = ObjState(aux_file_loader)
+        parsed = parseOBJLines(data, state)
+        if parsed is None:
+            return None
+
+    vertices, normals, texcoords = parsed
+    return buildCollada(state, vertices, normals, texcoords, validate_output=validate_output)
+
+def loadOBJFromFile(filename, aux_file_loader=None, validate_output=False, vectorized=True, processes=None):
+    """Loads an OBJ file from disk by memory-mapping it, so the file is never
+    read into memory as a whole. Parameters are the same as :func:`loadOBJ`,
+    and aux files are found relative to the file if aux_file_loader isn't given."""
+    if aux_file_loader is None:
+        aux_file_loader = filepath_loader(filename)
+    f = open(filename, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            # can't mmap an empty file
+            return loadOBJ('', aux_file_loader, validate_output, vectorized, processes)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return loadOBJ(data, aux_file_loader, validate_output, vectorized, processes)
+        finally:
+            data.close()
+    finally:
+        f.close()
+
+def buildCollada(state, vertices, normals, texcoords, validate_output=False):
+    """Creates the :class:`collada.Collada` instance for a parsed OBJ file"""
+    mesh = collada.Collada(validate_output=validate_output)
+    namer = state.namer
+    material_map = state.material_map
+
     # done, append last group
-    if not group.empty():
-        groups.append(group)
-    
+    groups = list(state.groups)
+    if not state.group.empty():
+        groups.append(state.group)
+
     for material in material_map.values():
         mesh.effects.append(material.effect)
         mesh.materials.append(material)
-    for cimg in cimages:
+    for cimg in state.cimages:
         mesh.images.append(cimg)
-    
-    vertices = numpy.array(vertices, dtype=numpy.float32).reshape(-1, 3)
-    normals = numpy.array(normals, dtype=numpy.float32).reshape(-1, 3)
-    texcoords = numpy.array(texcoords, dtype=numpy.float32).reshape(-1, 2)
-    
+
     sources = []
     # all modes have vertex source
     sources.append(collada.source.FloatSource("obj-vertex-source", vertices, ('X', 'Y', 'Z')))
@@ -446,9 +921,9 @@ def loadOBJ(data, aux_file_loader=None, validate_output=False):
         sources.append(collada.source.FloatSource("obj-normal-source", normals, ('X', 'Y', 'Z')))
     if len(texcoords) > 0:
         sources.append(collada.source.FloatSource("obj-uv-source", texcoords, ('S', 'T')))
-    
-    geom = collada.geometry.Geometry(mesh, geometry_name, geometry_name, sources)
-    
+
+    geom = collada.geometry.Geometry(mesh, state.geometry_name, state.geometry_name, sources)
+
     materials_mapped = set()
     for group in groups:
         input_list = collada.source.InputList()
@@ -460,37 +935,29 @@ def loadOBJ(data, aux_file_loader=None, validate_output=False):
         elif group.face_mode == FACEMODE.VTN:
             input_list.addInput(1, 'TEXCOORD', '#obj-uv-source')
             input_list.addInput(2, 'NORMAL', '#obj-normal-source')
-        
+
         if len(group.face_lengths) > 0:
-            face_lengths = numpy.array(group.face_lengths, dtype=numpy.int32)
-    
-            # First, join the individual face lines together, separated by spaces. Then,        
-            # just replace 1/2/3 and 1//3 with "1 2 3" and "1  3", as numpy.fromstring can
-            # handle any whitespace it's given, similar to python's split(). Concatenating
-            # together this way is much faster than parsing the numbers in python - let
-            # numpy do it. Note that sep=" " is actually misleading - it handles tabs and
-            # other whitespace also
-            group.face_indices = (" ".join(group.face_indices)).replace("/", " ")
-            face_indices = numpy.fromstring(group.face_indices, dtype=numpy.int32, sep=" ")
-            
+            face_lengths = group.getFaceLengths()
+            face_indices = group.getFaceIndices()
+
             # obj indices start at 1, while collada start at 0
             face_indices -= 1
-            
+
             polylist = geom.createPolylist(face_indices, face_lengths, input_list, group.material or namer.name("nullmaterial"))
             geom.primitives.append(polylist)
-            
+
         if len(group.line_indices) > 0:
             group.line_indices = (" ".join(group.line_indices)).replace("/", " ")
             line_indices = numpy.fromstring(group.line_indices, dtype=numpy.int32, sep=" ")
             line_indices -= 1
             lineset = geom.createLineSet(line_indices, input_list, group.material or namer.name("nullmaterial"))
             geom.primitives.append(lineset)
-        
+
         if group.material in material_map:
             materials_mapped.add(group.material)
-    
+
     mesh.geometries.append(geom)
-    
+
     matnodes = []
     for matref in materials_mapped:
         matnode = collada.scene.MaterialNode(matref, material_map[matref], inputs=[('TEX0', 'TEXCOORD', '0')])
@@ -500,13 +967,15 @@ def loadOBJ(data, aux_file_loader=None, validate_output=False):
     myscene = collada.scene.Scene(namer.name("scene"), [node])
     mesh.scenes.append(myscene)
     mesh.scene = myscene
-    
+
     return mesh
 
-def filepath_loader(obj_filename):
+def filepath_resolver(obj_filename):
+    """Returns a function that finds the path of a file referenced by the OBJ
+    file, or returns None if it doesn't exist"""
     obj_dir = os.path.dirname(obj_filename)
     
-    def aux_loader(auxpath):
+    def resolve(auxpath):
         auxloc = os.path.normpath(os.path.join(obj_dir, auxpath))
         if not os.path.isfile(auxloc):
             # try with replacing backslashes
@@ -518,6 +987,17 @@ def filepath_loader(obj_filename):
                 auxpath = auxpath[1:]
                 auxloc = os.path.normpath(os.path.join(obj_dir, auxpath))
         if os.path.isfile(auxloc):
+            return auxloc
+        return None
+    
+    return resolve
+
+def filepath_loader(obj_filename):
+    resolve = filepath_resolver(obj_filename)
+    
+    def aux_loader(auxpath):
+        auxloc = resolve(auxpath)
+        if auxloc is not None:
             f = open(auxloc, 'rb')
             return f.read()
         return None
@@ -532,8 +1012,14 @@ class OBJLoadFilter(LoadFilter):
         if not os.path.isfile(filename):
             raise FilterException("argument is not a valid file")
         
-        col = loadOBJ(open(filename, 'rb').read(),
-                      aux_file_loader=filepath_loader(filename))
+        processes = None
+        # batch and server workers are daemons, which can't start their own pool
+        if os.path.getsize(filename) > PARALLEL_PARSE_SIZE and not multiprocessing.current_process().daemon:
+            processes = multiprocessing.cpu_count()
+        load = lambda aux_file_loader: loadOBJFromFile(filename, aux_file_loader=aux_file_loader,
+                                                       processes=processes)
+        col = meshcache.loadWithSidecar(self.name, filename, load, filepath_loader(filename),
+                                        filepath_resolver(filename))
             
         return col    
 
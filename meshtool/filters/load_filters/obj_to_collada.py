@@ -0,0 +1,305 @@
+"""Converts an OBJ file straight to a COLLADA file, without building a
+:class:`collada.Collada` with all of the mesh's data in it. The file is read a
+window at a time and its records are copied out as text to temporary files,
+which are then stitched into the document, so memory use doesn't depend on the
+size of the mesh."""
+
+import os
+import re
+import tempfile
+from StringIO import StringIO
+
+import numpy
+import collada
+from collada.xmlutil import writeXML, COLLADA_NS
+
+from meshtool.filters.load_filters import load_obj
+from meshtool.filters.load_filters.load_obj import (ObjState, SlowPathNeeded,
+                                                    LINE_V, LINE_VN, LINE_VT, LINE_F, _VERTEX_RECORDS,
+                                                    _IS_WHITESPACE, _FACE_VALUES, buildCollada,
+                                                    filepath_loader, splitWindow,
+                                                    parseFaces, applyStatement, checkFaces,
+                                                    firstValues)
+
+# characters that can be copied from an OBJ number to a COLLADA float_array as-is
+_IS_NUMBER_TEXT = _IS_WHITESPACE.copy()
+_IS_NUMBER_TEXT[[ord(c) for c in '0123456789.+-eE']] = True
+_IS_INDEX_TEXT = _IS_WHITESPACE.copy()
+_IS_INDEX_TEXT[[ord(c) for c in '0123456789']] = True
+
+_SOURCE_IDS = {LINE_V: 'obj-vertex-source', LINE_VN: 'obj-normal-source', LINE_VT: 'obj-uv-source'}
+
+_STREAM_MARKER_RE = re.compile(r'@@stream-(\d+)@@')
+
+def formatInts(values):
+    """Returns the text of an array of non-negative integers, separated by spaces"""
+    values = numpy.asarray(values, dtype=numpy.int64)
+    if len(values) == 0:
+        return ''
+    width = len(str(values.max()))
+    # one row of digits per value, followed by a space
+    digits = numpy.empty((len(values), width + 1), dtype=numpy.uint8)
+    digits[:, width] = ord(' ')
+    rest = values.copy()
+    for column in range(width - 1, -1, -1):
+        digits[:, column] = rest % 10 + ord('0')
+        rest //= 10
+    num_digits = numpy.searchsorted(10 ** numpy.arange(1, width, dtype=numpy.int64), values, side='right') + 1
+    # drop the leading zeros
+    keep = numpy.arange(width + 1) >= (width - num_digits)[:, numpy.newaxis]
+    return digits[keep].tostring()
+
+def decrementInts(text):
+    """Takes the text of positive integers separated by whitespace, as a uint8
+    array, and subtracts one from each of them without parsing them. The numbers
+    keep their width, so 10 becomes 09, which is still a valid COLLADA index.
+
+    :raises: :class:`load_obj.SlowPathNeeded` if there's anything other than
+             digits and whitespace in the text, or any of the numbers are 0
+
+    :returns: A tuple (text, count) of the new text and the number of integers in it
+    """
+    if not numpy.all(_IS_INDEX_TEXT[text]):
+        raise SlowPathNeeded()
+    text = text.copy()
+    is_space = _IS_WHITESPACE[text]
+    # the last digit of each number
+    digits = numpy.flatnonzero(~is_space & numpy.append(is_space[1:], True))
+    count = len(digits)
+    while len(digits) > 0:
+        # 0 becomes 9, borrowing from the digit before it
+        zeros = text[digits] == ord('0')
+        text[digits] = numpy.where(zeros, ord('9'), text[digits] - 1)
+        digits = digits[zeros] - 1
+        if len(digits) > 0 and (digits[0] < 0 or numpy.any(is_space[digits])):
+            # borrowed past the first digit of a 0
+            raise SlowPathNeeded()
+    return text, count
+
+def vertexText(values_text, counts, width):
+    """Returns the text of the first width values of each vertex record. The
+    numbers are copied from the OBJ text unless some of them are written in a
+    way that COLLADA loaders might not read the same, e.g. nan."""
+    if not numpy.all(_IS_NUMBER_TEXT[values_text]):
+        values = numpy.fromstring(values_text.tostring(), dtype=numpy.float64, sep=' ')
+        if len(values) != counts.sum():
+            raise SlowPathNeeded()
+        values = firstValues(values, counts, width).astype(numpy.float32)
+        # enough digits to get back the same float32
+        return ' '.join('%.9g' % v for v in values.flat) + ' '
+    if numpy.all(counts == width):
+        return values_text.tostring()
+
+    # drop the extra values, keeping the whitespace after each value kept
+    is_space = _IS_WHITESPACE[values_text]
+    value_starts = numpy.flatnonzero(~is_space & numpy.insert(is_space[:-1], 0, True))
+    value_ends = numpy.flatnonzero(~is_space & numpy.append(is_space[1:], True)) + 1
+    if len(value_starts) != counts.sum():
+        raise SlowPathNeeded()
+    position = numpy.arange(len(value_starts)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    kept = position < width
+    edges = numpy.zeros(len(values_text) + 1, dtype=numpy.int32)
+    edges[value_starts[kept]] += 1
+    edges[numpy.minimum(value_ends[kept] + 1, len(values_text))] -= 1
+    return values_text[numpy.cumsum(edges[:-1]) > 0].tostring()
+
+class _Spool(object):
+    """A temporary file that text is appended to, and ranges of it later copied out"""
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.records = 0
+    def write(self, text):
+        self.file.write(text)
+        self.size += len(text)
+    def copyTo(self, out, start, end):
+        self.file.flush()
+        self.file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = self.file.read(min(remaining, 1024 * 1024))
+            if len(chunk) == 0:
+                break
+            out.write(chunk)
+            remaining -= len(chunk)
+    def close(self):
+        self.file.close()
+
+def streamWindow(data, state, spools, group_spans):
+    """Writes the vertex data and faces of a window of OBJ data to the spools,
+    and runs its statements
+
+    :returns: False if the file can't be loaded, True otherwise
+    """
+    starts, ends, kinds, num_tokens, clean, byte_kinds = splitWindow(data)
+    for kind, width in _VERTEX_RECORDS:
+        counts = num_tokens[kinds == kind]
+        if len(counts) == 0:
+            continue
+        if numpy.any(counts < width):
+            raise SlowPathNeeded()
+        spools[kind].write(vertexText(clean[byte_kinds == kind], counts, width))
+        spools[kind].records += len(counts)
+
+    # obj indices start at 1, while collada start at 0
+    face_text, num_values = decrementInts(clean[byte_kinds == LINE_F])
+    face_lengths, face_values, events = parseFaces(data, starts, ends, kinds, num_tokens, face_text, num_values)
+    spans = numpy.diff(numpy.append(starts, len(data)))
+    face_offsets = numpy.concatenate(([0], numpy.cumsum(spans[kinds == LINE_F])))
+    for event in events:
+        if event[0] == 'statement':
+            if not applyStatement(state, event[1]):
+                return False
+            continue
+
+        kind, first_face, num_faces, first_value, num_values, num_vertices, first_vertex = event
+        group = state.group
+        if not checkFaces(group, first_vertex, num_values, num_vertices):
+            return False
+        # a group's faces are all together in the file, so they're all together in the spools
+        if group.streamed_faces == 0:
+            group_start = (spools['vcount'].size, spools['p'].size)
+        else:
+            group_start = group_spans[group][0]
+        last_face = first_face + num_faces
+        spools['vcount'].write(formatInts(face_lengths[first_face:last_face]))
+        spools['p'].write(face_text[face_offsets[first_face]:face_offsets[last_face]].tostring())
+        group.streamed_faces += num_faces
+        group_spans[group] = (group_start, (spools['vcount'].size, spools['p'].size))
+    return True
+
+def findElement(root, name, element_id):
+    for node in root.iter('{%s}%s' % (COLLADA_NS, name)):
+        if node.get('id') == element_id:
+            return node
+    return None
+
+def writeCollada(out, state, spools, group_spans, validate_output=False):
+    """Writes the COLLADA document for a streamed OBJ file. The document is
+    built by :func:`buildCollada` with a placeholder for each source and
+    polylist, which are then filled in from the spools as it's written."""
+    groups = list(state.groups)
+    if not state.group.empty():
+        groups.append(state.group)
+    if any(len(group.line_indices) > 0 for group in groups):
+        # pycollada checks line indices against the sources, so they can't be
+        # put in the document with placeholder sources
+        raise SlowPathNeeded()
+
+    placeholders = {}
+    for kind, width in _VERTEX_RECORDS:
+        placeholders[kind] = numpy.zeros((1 if spools[kind].records > 0 or kind == LINE_V else 0, width),
+                                         dtype=numpy.float32)
+    for group in groups:
+        if group.streamed_faces > 0:
+            group.face_lengths = [numpy.ones(1, dtype=numpy.int32)]
+            group.face_indices = [numpy.ones(_FACE_VALUES[group.face_mode], dtype=numpy.int32)]
+    skeleton = buildCollada(state, placeholders[LINE_V], placeholders[LINE_VN], placeholders[LINE_VT],
+                            validate_output=validate_output)
+    skeleton.save()
+    root = skeleton.xmlnode.getroot()
+
+    streams = []
+    def placeholder(node, spool, start, end):
+        node.text = '@@stream-%d@@' % len(streams)
+        streams.append((spool, start, end))
+
+    for kind, width in _VERTEX_RECORDS:
+        source = findElement(root, 'source', _SOURCE_IDS[kind])
+        if source is None:
+            continue
+        records = spools[kind].records
+        array = source.find('{%s}float_array' % COLLADA_NS)
+        array.set('count', str(records * width))
+        source.find('{%s}technique_common/{%s}accessor' % (COLLADA_NS, COLLADA_NS)).set('count', str(records))
+        placeholder(array, spools[kind], 0, spools[kind].size)
+
+    polylists = [prim for prim in skeleton.geometries[0].primitives if isinstance(prim, collada.polylist.Polylist)]
+    streamed = [group for group in groups if group.streamed_faces > 0]
+    for group, polylist in zip(streamed, polylists):
+        (vcount_start, p_start), (vcount_end, p_end) = group_spans[group]
+        node = polylist.xmlnode
+        node.set('count', str(group.streamed_faces))
+        placeholder(node.find('{%s}vcount' % COLLADA_NS), spools['vcount'], vcount_start, vcount_end)
+        placeholder(node.find('{%s}p' % COLLADA_NS), spools['p'], p_start, p_end)
+
+    text = StringIO()
+    writeXML(skeleton.xmlnode, text)
+    pieces = _STREAM_MARKER_RE.split(text.getvalue())
+    for i, piece in enumerate(pieces):
+        if i % 2 == 0:
+            out.write(piece)
+        else:
+            spool, start, end = streams[int(piece)]
+            spool.copyTo(out, start, end)
+
+def readWindows(obj_file, window_size):
+    """Reads a file about window_size bytes at a time, yielding pieces of it
+    that end at the end of a line"""
+    rest = ''
+    while True:
+        chunk = obj_file.read(window_size)
+        if len(chunk) == 0:
+            break
+        data = rest + chunk
+        newline = data.rfind('\n')
+        if newline == -1:
+            # a line longer than the window
+            rest = data
+            continue
+        rest = data[newline + 1:]
+        yield data[:newline + 1]
+    if len(rest) > 0:
+        yield rest
+
+def convertOBJ(obj_file, out, aux_file_loader=None, validate_output=False):
+    """Converts an OBJ file to COLLADA. The result is the same mesh as loading
+    it with :func:`load_obj.loadOBJ` and writing it, but not the same bytes:
+    the OBJ file's numbers are copied as they are instead of being rounded,
+    and indices keep their width, so 10 is written as 09.
+
+    :param obj_file: A file-like object to read the OBJ file from
+    :param out: A file-like object to write the COLLADA document to
+    :param aux_file_loader: As for :func:`load_obj.loadOBJ`
+
+    :raises: :class:`load_obj.SlowPathNeeded` if the file has something that
+             can't be streamed, in which case nothing has been written to out
+
+    :returns: False if the file can't be loaded, True otherwise
+    """
+    state = ObjState(aux_file_loader)
+    spools = dict((kind, _Spool()) for kind in (LINE_V, LINE_VN, LINE_VT, 'vcount', 'p'))
+    # where each group's faces start and end in the spools
+    group_spans = {}
+    try:
+        for data in readWindows(obj_file, load_obj.OBJ_WINDOW_SIZE):
+            if not streamWindow(data, state, spools, group_spans):
+                return False
+        writeCollada(out, state, spools, group_spans, validate_output)
+    finally:
+        for spool in spools.values():
+            spool.close()
+    return True
+
+def convertOBJFile(obj_filename, collada_filename, aux_file_loader=None, validate_output=False):
+    """Converts an OBJ file to a COLLADA file. Aux files are found relative
+    to the OBJ file if aux_file_loader isn't given.
+
+    :raises: :class:`load_obj.SlowPathNeeded` if the file has something that
+             can't be streamed, in which case no file is written
+
+    :returns: False if the file can't be loaded, True otherwise
+    """
+    if aux_file_loader is None:
+        aux_file_loader = filepath_loader(obj_filename)
+    obj_file = open(obj_filename, 'rb')
+    out = open(collada_filename, 'wb')
+    converted = False
+    try:
+        converted = convertOBJ(obj_file, out, aux_file_loader, validate_output)
+    finally:
+        obj_file.close()
+        out.close()
+        if not converted:
+            os.remove(collada_filename)
+    return converted
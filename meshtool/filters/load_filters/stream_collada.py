@@ -0,0 +1,168 @@
+"""Loads a COLLADA file by parsing it incrementally with iterparse, decoding
+each geometry array as soon as its element has been read and dropping its
+text, so the whole document is never in memory as text. What's left of the
+document, without the geometry data, is then loaded by pycollada and the
+data is put back into the :class:`collada.Collada` it returns."""
+
+import zipfile
+import warnings
+from StringIO import StringIO
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+import numpy
+import collada
+from collada.xmlutil import COLLADA_NS
+
+from meshtool.filters.load_filters.load_obj import SlowPathNeeded
+from meshtool.meshcache import fillGeometry
+
+def _tag(name):
+    return '{%s}%s' % (COLLADA_NS, name)
+
+_LIBRARY_GEOMETRIES = _tag('library_geometries')
+_GEOMETRY = _tag('geometry')
+_MESH = _tag('mesh')
+_SOURCE = _tag('source')
+_FLOAT_ARRAY = _tag('float_array')
+_ACCESSOR_PARAMS = '%s/%s/%s' % (_tag('technique_common'), _tag('accessor'), _tag('param'))
+# mesh children that pycollada loads as primitives, in the order it loads them
+_PRIMITIVES = set(_tag(name) for name in ('polylist', 'triangles', 'lines', 'polygons'))
+# the primitives whose indices are decoded here, and their index elements
+_INDEXED_PRIMITIVES = {_tag('polylist'): (_tag('vcount'), _tag('p')),
+                       _tag('triangles'): (_tag('p'),),
+                       _tag('lines'): (_tag('p'),)}
+
+def parseInts(text):
+    """Parses the text of a p or vcount element as pycollada does"""
+    if text is None:
+        return numpy.array([], dtype=numpy.int32)
+    return numpy.fromstring(text, dtype=numpy.int32, sep=' ')
+
+def parseFloats(text):
+    """Parses the text of a float_array element as pycollada does"""
+    if text is None:
+        return numpy.array([], dtype=numpy.float32)
+    data = numpy.fromstring(text, dtype=numpy.float32, sep=' ')
+    data[numpy.isnan(data)] = 0
+    return data
+
+def sourceValues(node, data):
+    """Returns the values of a float source as pycollada stores them, given
+    its source element and the values of its float_array"""
+    components = [param.get('name') for param in node.findall(_ACCESSOR_PARAMS)]
+    if components == ['S', 'T', 'P']:
+        # pycollada drops the third texture coordinate
+        data = numpy.delete(data.reshape(-1, 3), -1, 1).ravel()
+    return data
+
+def readGeometry(source_file):
+    """Parses a COLLADA document, taking the float arrays of geometry sources
+    and the indices of triangle sets, polylists and line sets out of it.
+
+    :raises: :class:`load_obj.SlowPathNeeded` if a geometry has more than one
+             mesh or a primitive is missing its indices
+
+    :returns: A tuple (root, sources, primitives) of the root element of what's
+              left of the document, and the data taken out of it in the form
+              :func:`meshtool.meshcache.fillGeometry` takes, except that each
+              source is (geometry index, source id, float_array values, source element)
+    """
+    sources = []
+    primitives = []
+    polylists = []
+    path = []
+    geometry_index = -1
+    primitive_index = -1
+    primitive = None
+    source_node = None
+    root = None
+
+    for event, elem in ElementTree.iterparse(source_file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            parent = path[-1] if len(path) > 0 else None
+            path.append(elem)
+            in_mesh = len(path) >= 4 and parent.tag == _MESH and \
+                      path[-3].tag == _GEOMETRY and path[-4].tag == _LIBRARY_GEOMETRIES
+            if elem.tag == _MESH and parent is not None and parent.tag == _GEOMETRY and \
+                    len(path) >= 3 and path[-3].tag == _LIBRARY_GEOMETRIES:
+                if parent.find(_MESH) is not elem:
+                    # pycollada only loads the first mesh of a geometry
+                    raise SlowPathNeeded()
+                geometry_index += 1
+                primitive_index = -1
+            elif in_mesh and elem.tag in _PRIMITIVES:
+                primitive_index += 1
+                if elem.tag in _INDEXED_PRIMITIVES:
+                    primitive = [geometry_index, primitive_index, None, None, {}]
+                    primitives.append(primitive)
+                    if elem.tag == _tag('polylist'):
+                        polylists.append(primitive)
+            elif in_mesh and elem.tag == _SOURCE:
+                source_node = elem
+            continue
+
+        path.pop()
+        parent = path[-1] if len(path) > 0 else None
+        if elem.tag == _FLOAT_ARRAY and parent is source_node and source_node is not None:
+            if source_node.get('id') is not None and source_node.find(_FLOAT_ARRAY) is elem:
+                sources.append((geometry_index, source_node.get('id'), parseFloats(elem.text), source_node))
+                elem.text = None
+        elif primitive is not None and parent is not None and parent.tag in _INDEXED_PRIMITIVES and \
+                elem.tag in _INDEXED_PRIMITIVES[parent.tag] and parent.find(elem.tag) is elem:
+            values = parseInts(elem.text)
+            if elem.tag == _tag('vcount'):
+                primitive[3] = values
+            else:
+                primitive[2] = values
+            primitive[4][elem.tag[len(_tag('')):]] = elem.text
+            elem.text = None
+        elif elem.tag == _SOURCE:
+            source_node = None
+        elif elem.tag in _INDEXED_PRIMITIVES:
+            primitive = None
+
+    for primitive in primitives:
+        if primitive[2] is None:
+            # no p element, which pycollada reports
+            raise SlowPathNeeded()
+    for primitive in polylists:
+        if primitive[3] is None:
+            raise SlowPathNeeded()
+
+    return root, sources, primitives
+
+def loadColladaStreamed(filename):
+    """Loads a COLLADA file with :func:`readGeometry`, giving the same
+    :class:`collada.Collada` as loading it with pycollada.
+
+    :raises: :class:`load_obj.SlowPathNeeded` for zip archives and documents
+             that pycollada would load differently than they are read here
+    """
+    if zipfile.is_zipfile(filename):
+        raise SlowPathNeeded()
+
+    # numpy warns when it can't parse all of an array, where pycollada's
+    # results depend on exactly how far it got
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            root, sources, primitives = readGeometry(filename)
+        except DeprecationWarning:
+            raise SlowPathNeeded()
+        except SyntaxError:
+            # let pycollada report the file as malformed
+            raise SlowPathNeeded()
+
+    sources = [(g, src_id, sourceValues(node, data)) for g, src_id, data, node in sources]
+    skeleton = ElementTree.tostring(root)
+
+    mesh = collada.Collada(StringIO(skeleton))
+    mesh.filename = filename
+    mesh.getFileData = mesh._getFileFromDisk
+    fillGeometry(mesh, sources, primitives)
+    return mesh
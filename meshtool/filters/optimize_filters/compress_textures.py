@@ -0,0 +1,106 @@
+from meshtool.filters.base_filters import OptimizationFilter, FilterException
+from meshtool.args import FilterArgument
+from meshtool.textures import getPILImage, getThreads, probeImage
+from meshtool.util import saveDDS, DXT_BLOCK_SIZES
+from meshtool.filters.optimize_filters.save_mipmaps import getMipMapLevels
+import sys
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+def makeDDS(rgba, fourcc, mipmaps):
+    """Returns a DDS file of an RGBA PIL image
+
+    :param fourcc: 'DXT1' or 'DXT5'
+    :param mipmaps: If True, the file also has the image's mipmaps, made by
+                    :func:`meshtool.filters.optimize_filters.save_mipmaps.getMipMapLevels`
+                    down from the image's own size
+    """
+    if mipmaps:
+        levels = getMipMapLevels(rgba, power_of_2=False)
+        levels.reverse()
+    else:
+        levels = [rgba]
+    return saveDDS([numpy.asarray(level) for level in levels], fourcc)
+
+def compressTexture(cimg, mesh, mipmaps):
+    """Block compresses one image into a DDS file, as DXT1 (BC1) if it's
+    opaque and DXT5 (BC3) if it uses alpha
+
+    :param mipmaps: See :func:`makeDDS`
+    :returns: The DDS file's data, or None if the image can't be decoded
+    """
+    pilimg = getPILImage(cimg, mesh)
+    if pilimg is None:
+        return None
+
+    rgba = pilimg.convert('RGBA')
+    #the smallest alpha value, found in C over the band's buffer
+    alpha_min = rgba.split()[-1].getextrema()[0]
+    fourcc = 'DXT5' if alpha_min < 255 else 'DXT1'
+    return makeDDS(rgba, fourcc, mipmaps)
+
+def compressTextures(mesh, mipmaps=False, threads=None):
+    """Converts the textures of a mesh to block compressed DDS files, which
+    GPUs can use without decoding them. Images are compressed in a pool of
+    threads and the results applied in order.
+
+    :param mipmaps: See :func:`makeDDS`
+    :param threads: Number of threads. Defaults to :func:`meshtool.textures.getThreads`.
+    """
+    if threads is None:
+        threads = getThreads()
+
+    def compress(cimg):
+        info = probeImage(cimg.data)
+        if info is not None and info.compression in DXT_BLOCK_SIZES:
+            #already block compressed, and doing it again would only lose quality
+            return cimg.data
+        return compressTexture(cimg, mesh, mipmaps)
+
+    if threads <= 1 or len(mesh.images) <= 1:
+        results = map(compress, mesh.images)
+    else:
+        pool = ThreadPool(min(threads, len(mesh.images)))
+        try:
+            results = pool.map(compress, mesh.images)
+        finally:
+            pool.close()
+
+    previous_images = []
+
+    for cimg, data in zip(mesh.images, results):
+        previous_images.append(cimg.path)
+
+        if data is None:
+            print >> sys.stderr, "Couldn't load image %s" % cimg.path
+            continue
+
+        output_extension = '.dds'
+        if cimg.path.lower()[-len(output_extension):] != output_extension:
+            dot = cimg.path.rfind('.')
+            before_ext = cimg.path[0:dot] if dot != -1 else cimg.path
+            while before_ext + output_extension in previous_images:
+                before_ext = before_ext + '-x'
+            cimg.path = before_ext + output_extension
+            previous_images.append(cimg.path)
+
+        cimg.data = data
+
+def FilterGenerator():
+    class CompressTexturesFilter(OptimizationFilter):
+        def __init__(self):
+            super(CompressTexturesFilter, self).__init__('compress_textures', 'Converts all textures to DDS, block compressed with DXT1 (BC1) if they have no alpha and DXT5 (BC3) if they do. Each file also has mipmaps if mipmaps is true.')
+            self.arguments.append(FilterArgument('mipmaps', 'true to include mipmaps in each DDS file, false otherwise'))
+        def apply(self, mesh, mipmaps):
+            if mipmaps.lower() in ('true', 'yes', '1'):
+                mipmaps = True
+            elif mipmaps.lower() in ('false', 'no', '0'):
+                mipmaps = False
+            else:
+                raise FilterException('mipmaps must be true or false')
+            compressTextures(mesh, mipmaps)
+            return mesh
+    return CompressTexturesFilter()
+from meshtool.filters import factory
+factory.register(FilterGenerator().name, FilterGenerator)
@@ -0,0 +1,277 @@
+from meshtool.filters.base_filters import OptimizationFilter, FilterException
+from meshtool.args import FilterArgument
+from meshtool.textures import getPILImage, getImageInfo, getThreads, imageRAM
+from meshtool.util import Image, DXT_BLOCK_SIZES
+from meshtool.filters.optimize_filters.compress_textures import makeDDS
+import sys
+import math
+import struct
+import itertools
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+import collada
+import numpy
+
+#DDS header flag for a mipmap count
+DDSD_MIPMAPCOUNT = 0x20000
+
+def getImageAreas(mesh):
+    """Returns the texture space area, as a fraction of the image, and the 3D
+    surface area of the triangles in the default scene that use each image
+
+    :returns: A tuple of two dicts, by image path
+    """
+    uv_areas = {}
+    areas_3d = {}
+    scene = mesh.scene
+    if scene is None:
+        return uv_areas, areas_3d
+
+    for boundobj in itertools.chain(scene.objects('geometry'), scene.objects('controller')):
+        if isinstance(boundobj, collada.geometry.BoundGeometry):
+            boundgeom = boundobj
+        else:
+            boundgeom = boundobj.geometry
+        for boundprim in boundgeom.primitives():
+            if boundprim.material is None or isinstance(boundprim, collada.lineset.BoundLineSet):
+                continue
+
+            #the texture coordinate sets in the order the primitive has them
+            setids = []
+            for offset, semantic, srcid, setid in boundprim.original.getInputList().getList():
+                if semantic == 'TEXCOORD':
+                    setids.append(setid if setid else '0')
+
+            effect = boundprim.material.effect
+            inputmap = boundprim.inputmap
+            image_sets = {}
+            for prop in itertools.chain(effect.supported, ['bumpmap']):
+                propval = getattr(effect, prop)
+                if type(propval) is collada.material.Map and propval.texcoord in inputmap:
+                    semantic, setid = inputmap[propval.texcoord]
+                    setid = setid if setid else '0'
+                    if semantic == 'TEXCOORD' and setid in setids:
+                        image_sets[propval.sampler.surface.image.path] = setids.index(setid)
+            if len(image_sets) == 0:
+                continue
+
+            if isinstance(boundprim, collada.triangleset.BoundTriangleSet):
+                triset = boundprim
+            else:
+                triset = boundprim.triangleset()
+            if len(triset) == 0:
+                continue
+
+            tris3d = triset.vertex[triset.vertex_index]
+            crosses = numpy.cross(tris3d[:,1] - tris3d[:,0], tris3d[:,2] - tris3d[:,0])
+            area_3d = numpy.sum(numpy.sqrt(numpy.sum(crosses * crosses, axis=1))) / 2.0
+
+            for path, texindex in image_sets.iteritems():
+                tris2d = triset.texcoordset[texindex][triset.texcoord_indexset[texindex]]
+                uv_area = numpy.sum(numpy.abs(
+                    (tris2d[:,1,0] - tris2d[:,0,0]) * (tris2d[:,2,1] - tris2d[:,0,1]) -
+                    (tris2d[:,2,0] - tris2d[:,0,0]) * (tris2d[:,1,1] - tris2d[:,0,1]))) / 2.0
+                uv_areas[path] = uv_areas.get(path, 0) + uv_area
+                areas_3d[path] = areas_3d.get(path, 0) + area_3d
+
+    return uv_areas, areas_3d
+
+def getImageWeights(mesh, images):
+    """Returns the share of texture memory each image should get, by image
+    path. Like the fair share in :meth:`SanderSimplify.resize_charts`, it's
+    the geometric mean of the fraction of all texture space area and the
+    fraction of all 3D surface area the image's triangles have, so a texture
+    gets more memory for covering more of the model and for using more of
+    itself to do it.
+
+    :returns: The weights, or None if no triangles use the images
+    """
+    uv_areas, areas_3d = getImageAreas(mesh)
+    total_uv = sum(uv_areas.get(cimg.path, 0) for cimg in images)
+    total_3d = sum(areas_3d.get(cimg.path, 0) for cimg in images)
+    if total_uv <= 0 or total_3d <= 0:
+        return None
+    return dict((cimg.path, math.sqrt((uv_areas.get(cimg.path, 0) / total_uv) *
+                                      (areas_3d.get(cimg.path, 0) / total_3d)))
+                for cimg in images)
+
+def powerOf2Below(n):
+    """Returns the largest power of 2 not above n, and 1 for anything less"""
+    if n < 2:
+        return 1
+    return 1 << int(math.floor(math.log(n, 2)))
+
+def planSizes(images, budget, weights):
+    """Picks the new size of each image so that they fit in the budget
+
+    :param images: Tuples of (path, width, height, bytes per texel)
+    :param budget: Bytes all the images should fit in
+    :param weights: Share of the budget each image should get, by path
+    :returns: The new (width, height) of each image, by path. Images keep
+              their size if they fit in their share and are otherwise
+              scaled down to powers of 2.
+    """
+    original = dict((path, (width, height)) for path, width, height, b in images)
+    sizes = dict(original)
+    texel_bytes = dict((path, b) for path, width, height, b in images)
+    current = dict((path, width * height * b) for path, width, height, b in images)
+
+    #hand out the budget by weight, giving what's left over by images that
+    #fit in their share to the others, until the ones left don't fit
+    remaining_budget = float(budget)
+    remaining = set(sizes)
+    shares = {}
+    while len(remaining) > 0:
+        total_weight = sum(weights[path] for path in remaining)
+        if total_weight <= 0:
+            for path in remaining:
+                shares[path] = 0
+            break
+        fits = [path for path in remaining
+                if current[path] <= remaining_budget * weights[path] / total_weight]
+        if len(fits) == 0:
+            for path in remaining:
+                shares[path] = remaining_budget * weights[path] / total_weight
+            break
+        for path in fits:
+            remaining.remove(path)
+            remaining_budget -= current[path]
+
+    #scale the rest down to the powers of 2 that fit their shares
+    for path, share in shares.iteritems():
+        width, height = sizes[path]
+        scale = math.sqrt(share / current[path])
+        sizes[path] = (min(powerOf2Below(width * scale), width),
+                       min(powerOf2Below(height * scale), height))
+
+    #rounding down leaves some of the budget unused, so double the sides
+    #of the most important images again while it still fits
+    total = sum(w * h * texel_bytes[path] for path, (w, h) in sizes.iteritems())
+    growing = sorted(shares, key=lambda path: weights[path], reverse=True)
+    changed = True
+    while changed:
+        changed = False
+        for path in growing:
+            width, height = sizes[path]
+            orig_width, orig_height = original[path]
+            #double whichever side is further below its original size
+            if width * orig_height <= height * orig_width:
+                new_size = (width * 2, height)
+            else:
+                new_size = (width, height * 2)
+            if new_size[0] > orig_width or new_size[1] > orig_height:
+                continue
+            extra = (new_size[0] * new_size[1] - width * height) * texel_bytes[path]
+            if total + extra <= budget:
+                sizes[path] = new_size
+                total += extra
+                changed = True
+
+    return sizes
+
+def canResize(info):
+    """Returns whether an image can be saved again in its format once resized"""
+    Image.init()
+    return info.compression in DXT_BLOCK_SIZES or info.format in Image.SAVE
+
+def resizeTexture(cimg, mesh, info, size):
+    """Returns the data of an image resized, in the same format as before"""
+    pilimg = getPILImage(cimg, mesh)
+    if pilimg is None:
+        print >> sys.stderr, "Couldn't load image %s" % cimg.path
+        return cimg.data
+    resized = pilimg.resize(size, Image.ANTIALIAS)
+
+    if info.compression in DXT_BLOCK_SIZES:
+        #block compressed, so compress it again, with mipmaps if it had them
+        flags, mipmap_count = struct.unpack('<I16xI', cimg.data[8:32])
+        mipmaps = (flags & DDSD_MIPMAPCOUNT) != 0 and mipmap_count > 1
+        return makeDDS(resized.convert('RGBA'), info.compression, mipmaps)
+
+    output_format = info.format
+    output_options = {}
+    if output_format == 'JPEG':
+        output_options = {'quality': 95, 'optimize': True}
+    elif output_format == 'PNG':
+        output_options = {'optimize': True}
+    outbuf = StringIO()
+    resized.save(outbuf, output_format, **output_options)
+    return outbuf.getvalue()
+
+def downscaleTextures(mesh, budget, threads=None):
+    """Scales textures down so that all of them together take up no more
+    than a number of bytes of texture memory, as counted by
+    :func:`meshtool.filters.print_filters.print_render_info.getTextureRAM`.
+    Textures are never scaled up.
+
+    :param budget: Bytes of texture memory
+    :param threads: Number of threads to resize images in. Defaults to
+                    :func:`meshtool.textures.getThreads`.
+    """
+    infos = {}
+    images = []
+    for cimg in mesh.images:
+        info = getImageInfo(cimg, mesh)
+        if info is None:
+            print >> sys.stderr, "Couldn't load image %s" % cimg.path
+            continue
+        infos[cimg.path] = info
+        images.append(cimg)
+
+    total = sum(imageRAM(infos[cimg.path]) for cimg in images)
+    if total <= budget:
+        return
+
+    #images in formats that can't be saved again keep their size
+    fixed = [cimg for cimg in images if not canResize(infos[cimg.path])]
+    for cimg in fixed:
+        print >> sys.stderr, "Can't resize image %s in %s format" % (cimg.path, infos[cimg.path].format)
+        budget -= imageRAM(infos[cimg.path])
+        images.remove(cimg)
+    budget = max(budget, 0)
+
+    weights = getImageWeights(mesh, images)
+    if weights is None:
+        #nothing to go by, so scale them all by the same amount
+        weights = dict((cimg.path, float(imageRAM(infos[cimg.path]))) for cimg in images)
+
+    plan = [(cimg.path, infos[cimg.path].width, infos[cimg.path].height,
+             imageRAM(infos[cimg.path]) / float(infos[cimg.path].width * infos[cimg.path].height))
+            for cimg in images]
+    sizes = planSizes(plan, budget, weights)
+
+    to_resize = [cimg for cimg in images
+                 if sizes[cimg.path] != (infos[cimg.path].width, infos[cimg.path].height)]
+    resize = lambda cimg: resizeTexture(cimg, mesh, infos[cimg.path], sizes[cimg.path])
+    if threads is None:
+        threads = getThreads()
+    if threads <= 1 or len(to_resize) <= 1:
+        results = map(resize, to_resize)
+    else:
+        pool = ThreadPool(min(threads, len(to_resize)))
+        try:
+            results = pool.map(resize, to_resize)
+        finally:
+            pool.close()
+
+    for cimg, data in zip(to_resize, results):
+        cimg.data = data
+
+def FilterGenerator():
+    class DownscaleTexturesFilter(OptimizationFilter):
+        def __init__(self):
+            super(DownscaleTexturesFilter, self).__init__('downscale_textures', 'Scales textures down to powers of 2 until they fit in the given number of bytes of texture memory, giving each texture a share by how much of the model it covers. Textures are never scaled up.')
+            self.arguments.append(FilterArgument('budget', 'Bytes of texture memory, as print_render_info reports it'))
+        def apply(self, mesh, budget):
+            try:
+                budget = int(budget)
+            except ValueError:
+                raise FilterException('budget must be a number of bytes')
+            if budget < 0:
+                raise FilterException('budget must be a number of bytes')
+            downscaleTextures(mesh, budget)
+            return mesh
+    return DownscaleTexturesFilter()
+from meshtool.filters import factory
+factory.register(FilterGenerator().name, FilterGenerator)
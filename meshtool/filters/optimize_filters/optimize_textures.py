@@ -1,79 +1,114 @@
 from meshtool.filters.base_filters import OptimizationFilter
 from meshtool.util import Image
+from meshtool.textures import getPILImage, getThreads
 import sys
 from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
 
-import numpy
+def encodeTexture(cimg, mesh):
+    """Re-encodes one image as PNG if it uses alpha and JPEG otherwise
 
-def optimizeTextures(mesh):
+    :returns: A tuple (output_extension, data, error), where data is None
+              if the image doesn't need converting and error is a message
+              to print, or None
+    """
+    pilimg = getPILImage(cimg, mesh)
     
-    previous_images = []
-
-    for cimg in mesh.images:
-        previous_images.append(cimg.path)
+    #if PIL and the DXT decoder both failed, try and load it as a DDS with panda3d
+    if pilimg is None:
+        imgdata = cimg.data
         
-        pilimg = cimg.pilimage
+        #if we can't even load the image's data, can't convert
+        if imgdata is None:
+            return (None, None, "Couldn't load image data")
         
-        #PIL doesn't support DDS, so if loading failed, try and load it as a DDS with panda3d
-        if pilimg is None:
-            imgdata = cimg.data
-            
-            #if we can't even load the image's data, can't convert
-            if imgdata is None:
-                print >> sys.stderr, "Couldn't load image data"
-                continue
-            
-            try:
-                from panda3d.core import Texture
-                from panda3d.core import StringStream
-                from panda3d.core import PNMImage
-            except ImportError:
-                #if panda3d isn't installed and PIL failed, can't convert
-                print >> sys.stderr, 'Tried loading image with PIL and DDS and both failed'
-                continue
-            
-            t = Texture()
-            success = t.readDds(StringStream(imgdata))
-            if success == 0:
-                #failed to load as DDS, so let's give up
-                print >> sys.stderr, 'Tried loading image as DDS and failed'
-                continue
-
-            #convert DDS to PNG
-            outdata = t.getRamImageAs('RGB').getData()
-            try:
-                im = Image.fromstring('RGB', (t.getXSize(), t.getYSize()), outdata)
-                im.load()
-            except IOError:
-                #Any problem with panda3d might generate an invalid image buffer, so don't convert this
-                print >> sys.stderr, 'Problem loading DDS file with PIL'
-                continue
-            
-            pilimg = im
+        try:
+            from panda3d.core import Texture
+            from panda3d.core import StringStream
+            from panda3d.core import PNMImage
+        except ImportError:
+            #if panda3d isn't installed and PIL failed, can't convert
+            return (None, None, 'Tried loading image with PIL and DDS and both failed')
         
-        if pilimg.format == 'JPEG':
-            #PIL image is already in JPG format so don't convert
-            continue
+        t = Texture()
+        success = t.readDds(StringStream(imgdata))
+        if success == 0:
+            #failed to load as DDS, so let's give up
+            return (None, None, 'Tried loading image as DDS and failed')
+
+        #convert DDS to PNG
+        outdata = t.getRamImageAs('RGB').getData()
+        try:
+            im = Image.fromstring('RGB', (t.getXSize(), t.getYSize()), outdata)
+            im.load()
+        except IOError:
+            #Any problem with panda3d might generate an invalid image buffer, so don't convert this
+            return (None, None, 'Problem loading DDS file with PIL')
         
-        if 'A' in pilimg.getbands():
-            alpha = numpy.array(pilimg.split()[-1].getdata())
-            if not numpy.any(alpha < 255):
-                alpha = None
-                #this means that none of the pixels are using alpha, so convert to RGB
-                pilimg = pilimg.convert('RGB') 
+        pilimg = im
+    
+    if pilimg.format == 'JPEG':
+        #PIL image is already in JPG format so don't convert
+        return (None, None, None)
+    
+    if 'A' in pilimg.getbands():
+        #the smallest alpha value, found in C over the band's buffer
+        alpha_min = pilimg.split()[-1].getextrema()[0]
+        if alpha_min == 255:
+            #this means that none of the pixels are using alpha, so convert to RGB
+            pilimg = pilimg.convert('RGB') 
+    
+    if 'A' in pilimg.getbands():
+        #save textures with an alpha channel in PNG
+        output_format = 'PNG'
+        output_extension = '.png'
+        output_options = {'optimize':True}
+    else:
+        if pilimg.format != 'RGB':
+            pilimg = pilimg.convert("RGB")
+        #otherwise save as JPEG since it gets 
+        output_format = 'JPEG'
+        output_extension = '.jpg'
+        output_options = {'quality':95, 'optimize':True}
+    
+    outbuf = StringIO()
+    error = None
+    try:
+        pilimg.save(outbuf, output_format, **output_options)
+    except IOError, ex:
+        error = str(ex)
+    
+    return (output_extension, outbuf.getvalue(), error)
+
+def optimizeTextures(mesh, threads=None):
+    """Converts the textures of a mesh with alpha to PNG and the ones without
+    to JPEG. The images are encoded in a pool of threads, since PIL releases
+    the GIL while encoding, and the results are applied in order.
+
+    :param threads: Number of threads. Defaults to :func:`meshtool.textures.getThreads`.
+    """
+    if threads is None:
+        threads = getThreads()
+    
+    encode = lambda cimg: encodeTexture(cimg, mesh)
+    if threads <= 1 or len(mesh.images) <= 1:
+        results = map(encode, mesh.images)
+    else:
+        pool = ThreadPool(min(threads, len(mesh.images)))
+        try:
+            results = pool.map(encode, mesh.images)
+        finally:
+            pool.close()
+    
+    previous_images = []
+
+    for cimg, (output_extension, data, error) in zip(mesh.images, results):
+        previous_images.append(cimg.path)
         
-        if 'A' in pilimg.getbands():
-            #save textures with an alpha channel in PNG
-            output_format = 'PNG'
-            output_extension = '.png'
-            output_options = {'optimize':True}
-        else:
-            if pilimg.format != 'RGB':
-                pilimg = pilimg.convert("RGB")
-            #otherwise save as JPEG since it gets 
-            output_format = 'JPEG'
-            output_extension = '.jpg'
-            output_options = {'quality':95, 'optimize':True}
+        if data is None:
+            if error is not None:
+                print >> sys.stderr, error
+            continue
         
         if cimg.path.lower()[-len(output_extension):] != output_extension:
             dot = cimg.path.rfind('.')
@@ -83,14 +118,10 @@ def optimizeTextures(mesh):
             cimg.path = before_ext + output_extension
             previous_images.append(cimg.path)
         
-        outbuf = StringIO()
-               
-        try:
-            pilimg.save(outbuf, output_format, **output_options)
-        except IOError, ex:
-            print ex
+        if error is not None:
+            print error
 
-        cimg.data = outbuf.getvalue()
+        cimg.data = data
 
 def FilterGenerator():
     class OptimizeTexturesFilter(OptimizationFilter):
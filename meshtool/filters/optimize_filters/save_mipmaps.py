@@ -1,6 +1,10 @@
 from meshtool.filters.base_filters import OptimizationFilter, FilterException
+from meshtool.textures import getPILImage, getThreads
+from meshtool import mipmaps as mipmap_index
 import os.path
 import posixpath
+import itertools
+from multiprocessing.pool import ThreadPool
 
 import collada
 from meshtool.util import Image
@@ -8,127 +12,232 @@ from StringIO import StringIO
 import math
 import tarfile
 
-def getMipMaps(mesh):
-    
-    mipmaps = {}
+def getMipMapImages(mesh):
+    """Returns the images used by the texture maps of a mesh, each one once"""
+    images = []
+    seen = set()
     for effect in mesh.effects:
         for prop in effect.supported:
             propval = getattr(effect, prop)
             if isinstance(propval, collada.material.Map):
-                image_name = propval.sampler.surface.image.path
-                image_data = propval.sampler.surface.image.data
-
-                try:
-                    im = Image.open(StringIO(image_data))
-                    im.load()
-                except IOError:
-                    from panda3d.core import Texture
-                    from panda3d.core import StringStream
-                    from panda3d.core import PNMImage
-                    
-                    #PIL failed, so lets try DDS reader with panda3d
-                    t = Texture(image_name)
-                    success = t.readDds(StringStream(image_data))
-                    if success == 0:
-                        raise FilterException("Failed to read image file %s" % image_name)
-        
-                    #convert DDS to PNG
-                    outdata = t.getRamImageAs('RGBA').getData()
-                    try:
-                        im = Image.fromstring('RGBA', (t.getXSize(), t.getYSize()), outdata)
-                        im.load()
-                    except IOError:
-                        raise FilterException("Failed to read image file %s" % image_name)
-                    
-                #Keep JPG in same format since JPG->PNG is pretty bad
-                if im.format == 'JPEG':
-                    output_format = 'JPEG'
-                    output_extension = 'jpg'
-                    output_options = {'quality': 95, 'optimize':True}
-                else:
-                    output_format = 'PNG'
-                    output_extension = 'png'
-                    output_options = {'optimize':True}
-                    
-                #store a copy to the original image so we can resize from it directly each time
-                orig_im = im
-                
-                width, height = im.size
-                
-                #round down to power of 2
-                width = int(math.pow(2, int(math.log(width, 2))))
-                height = int(math.pow(2, int(math.log(height, 2))))
-
-                pil_images = []
-
-                while True:
-                    im = orig_im.resize((width, height), Image.ANTIALIAS)
-                    pil_images.insert(0, im)
-                    if width == 1 and height == 1:
-                        break
-                    width = max(width / 2, 1)
-                    height = max(height / 2, 1)
-
-                tar_buf = StringIO()
-                tar = tarfile.TarFile(fileobj=tar_buf, mode='w')
-              
-                cur_offset = 0
-                byte_ranges = []
-                for i, pil_img in enumerate(pil_images):
-                    buf = StringIO()
-                    pil_img.save(buf, output_format, **output_options)
-                    file_len = buf.tell()
-                    cur_name = '%dx%d.%s' % (pil_img.size[0], pil_img.size[1], output_extension)
-                    tar_info = tarfile.TarInfo(name=cur_name)
-                    tar_info.size=file_len
-                    buf.seek(0)
-                    tar.addfile(tarinfo=tar_info, fileobj=buf)
-                    
-                    #tar files have a 512 byte header
-                    cur_offset += 512
-                    file_start = cur_offset
-                    
-                    byte_ranges.append({'offset':file_start,
-                                        'length':file_len,
-                                        'width':pil_img.size[0],
-                                        'height':pil_img.size[1]})
-                    
-                    #file lengths are rounded up to nearest 512 multiple
-                    file_len = 512 * ((file_len + 512 - 1) / 512)
-                    cur_offset += file_len
-                
-                tar.close()
-                
-                mipmaps[propval.sampler.surface.image.path] = (tar_buf.getvalue(), byte_ranges)
+                cimg = propval.sampler.surface.image
+                if cimg.path not in seen:
+                    seen.add(cimg.path)
+                    images.append(cimg)
+    return images
+
+def loadMipMapImage(cimg, mesh):
+    """Returns the decoded PIL image of a texture, falling back to panda3d for
+    DDS formats that PIL and :func:`meshtool.util.loadDDS` can't read"""
+    im = getPILImage(cimg, mesh)
+    if im is not None:
+        return im
+
+    image_name = cimg.path
+    image_data = cimg.data
+
+    from panda3d.core import Texture
+    from panda3d.core import StringStream
+    from panda3d.core import PNMImage
+
+    #PIL failed, so lets try DDS reader with panda3d
+    t = Texture(image_name)
+    success = t.readDds(StringStream(image_data))
+    if success == 0:
+        raise FilterException("Failed to read image file %s" % image_name)
+
+    #convert DDS to PNG
+    outdata = t.getRamImageAs('RGBA').getData()
+    try:
+        im = Image.fromstring('RGBA', (t.getXSize(), t.getYSize()), outdata)
+        im.load()
+    except IOError:
+        raise FilterException("Failed to read image file %s" % image_name)
+    return im
+
+def getMipMapLevels(im, pyramid=True, power_of_2=True):
+    """Returns the mipmap levels of an image, from 1x1 up to its size rounded
+    down to powers of 2
+
+    :param pyramid: If True, only the largest level is resized from the
+                    image and each smaller level is downsampled from the
+                    one above it, which gives the same levels to within
+                    rounding at a fraction of the cost. If False, every
+                    level is resized from the image.
+    :param power_of_2: If False, the largest level is the image's own size
+                       and each smaller one is half the size of the one
+                       above it, rounded down
+    """
+    width, height = im.size
+
+    if power_of_2:
+        #round down to power of 2
+        width = int(math.pow(2, int(math.log(width, 2))))
+        height = int(math.pow(2, int(math.log(height, 2))))
+
+    pil_images = []
+
+    prev_im = None
+    while True:
+        if pyramid and prev_im is not None:
+            level_im = prev_im.resize((width, height), Image.ANTIALIAS)
+        elif im.size == (width, height):
+            #already a power of 2, and resizing would only copy it
+            level_im = im
+        else:
+            level_im = im.resize((width, height), Image.ANTIALIAS)
+        pil_images.insert(0, level_im)
+        prev_im = level_im
+        if width == 1 and height == 1:
+            break
+        width = max(width / 2, 1)
+        height = max(height / 2, 1)
+
+    return pil_images
+
+def writeMipMapTar(fileobj, pil_images, output_format, output_extension, output_options, pool=None):
+    """Encodes mipmap levels and writes them to a tar file as they're ready
+
+    :param fileobj: File object to write the tar file to
+    :param pil_images: The levels, in the order they should be in the tar
+    :param pool: An optional thread pool to encode the levels in
+    :returns: A list of the byte range, width and height of each level in the tar file
+    """
+    def encode(pil_img):
+        buf = StringIO()
+        pil_img.save(buf, output_format, **output_options)
+        return buf.getvalue()
+
+    if pool is not None:
+        encoded = pool.imap(encode, pil_images)
+    else:
+        encoded = itertools.imap(encode, pil_images)
+
+    tar = tarfile.TarFile(fileobj=fileobj, mode='w')
+
+    cur_offset = 0
+    byte_ranges = []
+    for pil_img, data in itertools.izip(pil_images, encoded):
+        file_len = len(data)
+        cur_name = '%dx%d.%s' % (pil_img.size[0], pil_img.size[1], output_extension)
+        tar_info = tarfile.TarInfo(name=cur_name)
+        tar_info.size=file_len
+        tar.addfile(tarinfo=tar_info, fileobj=StringIO(data))
+
+        #tar files have a 512 byte header
+        cur_offset += 512
+        file_start = cur_offset
+
+        byte_ranges.append({'offset':file_start,
+                            'length':file_len,
+                            'width':pil_img.size[0],
+                            'height':pil_img.size[1]})
+
+        #file lengths are rounded up to nearest 512 multiple
+        file_len = 512 * ((file_len + 512 - 1) / 512)
+        cur_offset += file_len
+
+    tar.close()
+    return byte_ranges
+
+def writeImageMipMaps(fileobj, cimg, mesh, pyramid=True, pool=None):
+    """Writes the mipmap tar file of one texture
+
+    :returns: The byte ranges of the levels, as :func:`writeMipMapTar`
+    """
+    im = loadMipMapImage(cimg, mesh)
+
+    #Keep JPG in same format since JPG->PNG is pretty bad
+    if im.format == 'JPEG':
+        output_format = 'JPEG'
+        output_extension = 'jpg'
+        output_options = {'quality': 95, 'optimize':True}
+    else:
+        output_format = 'PNG'
+        output_extension = 'png'
+        output_options = {'optimize':True}
+
+    pil_images = getMipMapLevels(im, pyramid)
+    return writeMipMapTar(fileobj, pil_images, output_format, output_extension, output_options, pool)
+
+def _mipMapPool(threads):
+    if threads is None:
+        threads = getThreads()
+    if threads <= 1:
+        return None
+    return ThreadPool(threads)
+
+def getMipMaps(mesh, pyramid=True, threads=None):
+    """Returns the mipmaps of each texture of a mesh, by image path, as a
+    tuple of the tar file's data and the byte ranges of its levels
+
+    :param pyramid: See :func:`getMipMapLevels`
+    :param threads: Number of threads to encode levels in. Defaults to
+                    :func:`meshtool.textures.getThreads`.
+    """
+    mipmaps = {}
+    pool = _mipMapPool(threads)
+    try:
+        for cimg in getMipMapImages(mesh):
+            tar_buf = StringIO()
+            byte_ranges = writeImageMipMaps(tar_buf, cimg, mesh, pyramid, pool)
+            mipmaps[cimg.path] = (tar_buf.getvalue(), byte_ranges)
+    finally:
+        if pool is not None:
+            pool.close()
     return mipmaps
 
-def saveMipMaps(mesh):
-    mipmaps = getMipMaps(mesh)
-    
+def _writeRenamed(path, write):
+    #written beside it then renamed, so a failure doesn't leave half a file
+    temp_path = path + '.tmp'
+    f = open(temp_path, 'wb')
+    try:
+        result = write(f)
+        f.close()
+        os.rename(temp_path, path)
+    except:
+        f.close()
+        os.remove(temp_path)
+        raise
+    return result
+
+def saveMipMaps(mesh, pyramid=True, threads=None):
+    """Writes the mipmaps of each texture of a mesh next to it, with .tar
+    added to its name. Each tar file is written as its levels are encoded,
+    rather than built in memory first, and followed by an index of the byte
+    range of each level, as described in :mod:`meshtool.mipmaps`.
+
+    :returns: False if the mesh has no directory to save to
+    """
     if not mesh.filename:
         return False
     reldir = os.path.dirname(mesh.filename)
     if not os.path.isdir(reldir):
         return False
-    
-    for imgpath, (tarbuf, ranges) in mipmaps.iteritems():
-        saveto = os.path.normpath(os.path.join(reldir, imgpath))
-        saveto += '.tar'
-        f = open(saveto, 'wb')
-        f.write(tarbuf)
-        f.close()
+
+    pool = _mipMapPool(threads)
+    try:
+        for cimg in getMipMapImages(mesh):
+            saveto = os.path.normpath(os.path.join(reldir, cimg.path))
+            saveto += '.tar'
+            byte_ranges = _writeRenamed(saveto, lambda f: writeImageMipMaps(f, cimg, mesh, pyramid, pool))
+            index = mipmap_index.makeIndex(byte_ranges)
+            _writeRenamed(mipmap_index.indexPath(saveto), lambda f: f.write(index))
+    finally:
+        if pool is not None:
+            pool.close()
     return True
 
 def FilterGenerator():
     class SaveMipMapsFilter(OptimizationFilter):
         def __init__(self):
-            super(SaveMipMapsFilter, self).__init__('save_mipmaps', 'Saves mipmaps to disk in tar format in the same location as textures but with an added .tar. The archive will contain PNG or JPG images.')
+            super(SaveMipMapsFilter, self).__init__('save_mipmaps', 'Saves mipmaps to disk in tar format in the same location as textures but with an added .tar. The archive will contain PNG or JPG images, and a .tar.json index of the byte range of each one is saved next to it.')
         def apply(self, mesh):
             succ = saveMipMaps(mesh)
             if not succ:
                 raise FilterException('Failed to save mipmaps')
             return mesh
-        
+
     return SaveMipMapsFilter()
 from meshtool.filters import factory
-factory.register(FilterGenerator().name, FilterGenerator)
\ No newline at end of file
+factory.register(FilterGenerator().name, FilterGenerator)
@@ -1,4 +1,5 @@
 from meshtool.filters.base_filters import OptimizationFilter
+from meshtool.textures import getPILImage
 import collada
 import numpy
 from meshtool.filters.atlas_filters.make_atlases import getTexcoordToImgMapping, TexcoordSet, MAX_TILING_DIMENSION
@@ -27,7 +28,7 @@ def splitTriangleTexcoords(mesh):
     unique_images = {}
     for cimg in mesh.images:
         if cimg.path not in unique_images:
-            unique_images[cimg.path] = cimg.pilimage
+            unique_images[cimg.path] = getPILImage(cimg, mesh)
     
     for geom in mesh.geometries:
         
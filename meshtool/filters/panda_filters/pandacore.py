@@ -3,7 +3,7 @@ import collada
 import posixpath
 import struct
 from math import pi, sin, cos
-from meshtool.util import Image, ImageOps
+from meshtool.util import Image, ImageOps, loadDDS
 from StringIO import StringIO
 import inspect
 import math
@@ -277,7 +277,12 @@ def pilFromData(image_data):
         im = Image.open(StringIO(image_data))
         im.load()
     except IOError:
-        #PIL couldn't open, so try to read with panda3d which supports DDS:
+        #PIL couldn't open, so try our DXT decoder
+        try:
+            return loadDDS(image_data)
+        except IOError:
+            pass
+        #and then panda3d, which supports other DDS formats:
         im = None
         tex = textureFromData(image_data)
         if tex is not None:
@@ -688,10 +693,35 @@ def getSceneMembers(col):
     
     return scene_members
 
+# When set, setupPandaApp reuses one offscreen ShowBase instead of opening
+# a new window for every mesh. Used by long running processes (--serve)
+_use_shared_app = False
+_shared_app = None
+
+def useSharedPandaApp():
+    global _use_shared_app
+    _use_shared_app = True
+
+def getPandaApp():
+    global _shared_app
+    if not _use_shared_app:
+        return ShowBase()
+    if _shared_app is None:
+        loadPrcFileData('', 'window-type offscreen')
+        loadPrcFileData('', 'audio-library-name null')
+        _shared_app = ShowBase()
+    else:
+        #clear out the previous mesh and its lights
+        render.clearLight()
+        for child in render.getChildren():
+            if child != base.camera:
+                child.removeNode()
+    return _shared_app
+
 def setupPandaApp(mesh):
     scene_members = getSceneMembers(mesh)
     
-    p3dApp = ShowBase()
+    p3dApp = getPandaApp()
     nodePath = getBaseNodePath(render)
     
     rotateNode = GeomNode("rotater")
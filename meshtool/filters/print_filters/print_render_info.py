@@ -1,4 +1,5 @@
 from meshtool.filters.base_filters import PrintFilter
+from meshtool.textures import getImageInfo, imageRAM
 import collada
 import math
 import itertools
@@ -20,38 +21,14 @@ def humanize_bytes(val, precision=1):
     return '%.*f %s' % (precision, val / factor, suffix)
 
 def getTextureRAM(mesh):
-    total_image_area = 0
+    total_image_bytes = 0
     for cimg in mesh.images:
-        pilimg = cimg.pilimage
-        
-        if pilimg:
-            total_image_area += pilimg.size[0] * pilimg.size[1] * len(pilimg.getbands())
-        else:
-            #PIL doesn't support DDS, so if loading failed, try and load it as a DDS with panda3d
-            imgdata = cimg.data
-            
-            #if we can't even load the image's data, can't convert
-            if imgdata is None:
-                continue
-            
-            try:
-                from panda3d.core import Texture
-                from panda3d.core import StringStream
-            except ImportError:
-                #if panda3d isn't installed and PIL failed, can't convert
-                continue
-            
-            t = Texture()
-            try:
-                success = t.readDds(StringStream(imgdata))
-            except:
-                success = 1
-            if success == 0:
-                #failed to load as DDS, so let's give up
-                continue
-            total_image_area += t.getXSize() * t.getYSize() * 3
+        #only the image headers are read, not the pixels
+        info = getImageInfo(cimg, mesh)
+        if info is not None:
+            total_image_bytes += imageRAM(info)
 
-    return total_image_area
+    return total_image_bytes
 
 def getSceneInfo(mesh):
     num_triangles = 0
@@ -10,6 +10,8 @@ def FilterGenerator():
             if os.path.exists(filename):
                 raise FilterException("specified filename already exists")
             
+            # write any changes, and any data loaded outside of the document, back to it
+            mesh.save()
             json_data = badgerfish.to_json(mesh.xmlnode.getroot(), indent=4)
             f = open(filename, 'w')
             f.write(json_data)
@@ -3,6 +3,7 @@ import os
 import zipfile
 from StringIO import StringIO
 import posixpath
+from meshtool.util import isExternalImage
 import save_obj_util
 
 def FilterGenerator():
@@ -26,6 +27,9 @@ def FilterGenerator():
 
             prev_written = []
             for cimg in mesh.images:
+                #shared images stay where their paths point
+                if isExternalImage(cimg):
+                    continue
                 img_data = cimg.data
                 img_name = posixpath.basename(cimg.path)
 
@@ -0,0 +1,203 @@
+import numpy
+
+def csrOffsets(sorted_ids, count):
+    """Returns the offsets of each id's run in a sorted array of ids from 0
+    to count-1, so that the run of id i is offsets[i]:offsets[i+1]"""
+    offsets = numpy.zeros(count + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(sorted_ids, minlength=count), out=offsets[1:])
+    return offsets
+
+class MeshConnectivity(object):
+    """Which triangles use each vertex and each edge of a triangle mesh, and
+    which vertices each vertex shares an edge with, stored as compressed
+    sparse row (CSR) arrays built with numpy sorts. The run of vertex v in
+    vert_tris is vert_tris[vert_tri_offsets[v]:vert_tri_offsets[v+1]], and
+    likewise for the other tables. Everything is sorted by id."""
+
+    def __init__(self, tris, num_vertices):
+        """
+        :param tris: An (N, 3) array of the vertex indices of each triangle
+        :param num_vertices: Number of vertices, including any that no
+                             triangle uses
+        """
+        tris = numpy.asarray(tris, dtype=numpy.int64).reshape(-1, 3)
+        self.num_vertices = num_vertices
+        self.num_tris = len(tris)
+
+        #vertex -> triangles, by sorting the corners of every triangle. a
+        # triangle with two identical vertices is only listed once
+        stride = max(self.num_tris, 1)
+        pairs = numpy.unique(tris.ravel() * stride + numpy.arange(len(tris)).repeat(3))
+        self.vert_tris = pairs % stride
+        self.vert_tri_offsets = csrOffsets(pairs // stride, num_vertices)
+
+        #each triangle's edges (0,1), (1,2) and (2,0), as (low, high) keys
+        starts = tris.ravel()
+        ends = tris[:,(1,2,0)].ravel()
+        keys = numpy.minimum(starts, ends) * num_vertices + numpy.maximum(starts, ends)
+        order = numpy.argsort(keys, kind='mergesort')
+        sorted_keys = keys[order]
+        first = numpy.ones(len(sorted_keys), dtype=bool)
+        first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        sorted_edge_ids = numpy.cumsum(first) - 1
+
+        #unique edges
+        self.edge_keys = sorted_keys[first]
+        self.edges = numpy.column_stack((self.edge_keys // num_vertices, self.edge_keys % num_vertices))
+        #triangle -> the edge each of its sides is
+        self.tri_edges = numpy.empty(len(keys), dtype=numpy.int64)
+        self.tri_edges[order] = sorted_edge_ids
+        self.tri_edges.shape = (-1, 3)
+
+        #edges -> triangles that use both of their vertices, once each. a
+        # triangle with two identical vertices has an edge from a vertex to
+        # itself, which every triangle using that vertex is on
+        side_edges = sorted_edge_ids
+        side_tris = order // 3
+        loops = numpy.where(self.edges[:,0] == self.edges[:,1])[0]
+        if len(loops) > 0:
+            keep = self.edges[side_edges,0] != self.edges[side_edges,1]
+            loop_verts = self.edges[loops,0]
+            loop_counts = self.vert_tri_offsets[loop_verts+1] - self.vert_tri_offsets[loop_verts]
+            side_edges = numpy.concatenate((side_edges[keep], numpy.repeat(loops, loop_counts)))
+            side_tris = numpy.concatenate([side_tris[keep]] + [self.trisOfVertex(v) for v in loop_verts])
+        pairs = numpy.unique(side_edges * stride + side_tris)
+        self.edge_tris = pairs % stride
+        self.edge_tri_offsets = csrOffsets(pairs // stride, len(self.edges))
+
+        #vertex -> vertices, from both ends of every edge but only once for
+        # an edge from a vertex to itself
+        edge_ids = numpy.arange(len(self.edges))
+        reverse = edge_ids[self.edges[:,0] != self.edges[:,1]]
+        ends = numpy.concatenate((self.edges[:,0], self.edges[reverse,1]))
+        others = numpy.concatenate((self.edges[:,1], self.edges[reverse,0]))
+        order = numpy.argsort(ends * num_vertices + others)
+        self.vert_neighbors = others[order]
+        self.vert_neighbor_edges = numpy.concatenate((edge_ids, reverse))[order]
+        self.vert_neighbor_offsets = csrOffsets(ends[order], num_vertices)
+
+    def trisOfVertex(self, v):
+        """Returns the array of triangles that use a vertex"""
+        return self.vert_tris[self.vert_tri_offsets[v]:self.vert_tri_offsets[v+1]]
+
+    def neighbors(self, v):
+        """Returns the array of vertices that share an edge with a vertex"""
+        return self.vert_neighbors[self.vert_neighbor_offsets[v]:self.vert_neighbor_offsets[v+1]]
+
+    def neighborEdges(self, v):
+        """Returns the edge between a vertex and each of its :meth:`neighbors`"""
+        return self.vert_neighbor_edges[self.vert_neighbor_offsets[v]:self.vert_neighbor_offsets[v+1]]
+
+    def edgeIndex(self, v1, v2):
+        """Returns the index in edges of the edge between two vertices, or -1
+        if there isn't one"""
+        key = min(v1, v2) * self.num_vertices + max(v1, v2)
+        i = numpy.searchsorted(self.edge_keys, key)
+        if i < len(self.edge_keys) and self.edge_keys[i] == key:
+            return int(i)
+        return -1
+
+    def trisOfEdge(self, edge):
+        """Returns the array of triangles that use both vertices of an edge,
+        by its index"""
+        return self.edge_tris[self.edge_tri_offsets[edge]:self.edge_tri_offsets[edge+1]]
+
+    def edgeTriCounts(self):
+        """Returns how many triangles use each edge"""
+        return numpy.diff(self.edge_tri_offsets)
+
+    def faceAdjacency(self, tris):
+        """Finds the pairs of triangles that are adjacent across an edge.
+        Triangles that traverse a shared edge in the same direction face
+        opposite ways and aren't adjacent, and neither are triangles with the
+        same vertices.
+
+        :param tris: The (N, 3) array of triangles this was built from
+        :returns: A tuple of a (P, 2) array of the adjacent triangles, with
+                  the lower one first, and an array of the edges that are
+                  between more than two adjacent pairs
+        """
+        tris = numpy.asarray(tris, dtype=numpy.int64).reshape(-1, 3)
+        stride = max(self.num_tris, 1)
+
+        #the sides of every triangle, grouped by edge, and whether each goes
+        # from the lower vertex of its edge to the higher one
+        side_edges = self.tri_edges.ravel()
+        order = numpy.argsort(side_edges, kind='mergesort')
+        side_edges = side_edges[order]
+        side_tris = order // 3
+        forward = (tris < tris[:,(1,2,0)]).ravel()[order]
+
+        #pair every side with each later side of the same edge. the sides of
+        # an edge are consecutive, so the pairs d apart are found together
+        # until no edge has more than d sides
+        pair_edges = []
+        pair_keys = []
+        pair_opposite = []
+        d = 1
+        while d < len(side_edges):
+            first = numpy.where(side_edges[d:] == side_edges[:-d])[0]
+            if len(first) == 0:
+                break
+            second = first + d
+            pair_edges.append(side_edges[first])
+            pair_keys.append(side_tris[first] * stride + side_tris[second])
+            pair_opposite.append(forward[first] != forward[second])
+            d += 1
+        if len(pair_keys) == 0:
+            return numpy.zeros((0, 2), dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        pair_edges = numpy.concatenate(pair_edges)
+        pair_keys = numpy.concatenate(pair_keys)
+        pair_opposite = numpy.concatenate(pair_opposite)
+
+        #sides of the same triangle, which it has when two of its vertices
+        # are the same, and triangles with the same vertices aren't adjacent
+        sorted_tris = numpy.sort(tris, axis=1)
+        first_tris = pair_keys // stride
+        second_tris = pair_keys % stride
+        valid = (first_tris != second_tris) & \
+                numpy.any(sorted_tris[first_tris] != sorted_tris[second_tris], axis=1)
+        pair_edges = pair_edges[valid]
+        pair_keys = pair_keys[valid]
+        pair_opposite = pair_opposite[valid]
+
+        #a pair of triangles is adjacent if they traverse every edge they
+        # share in opposite directions
+        keys, pair_ids = numpy.unique(pair_keys, return_inverse=True)
+        adjacent = numpy.ones(len(keys), dtype=bool)
+        adjacent[pair_ids[~pair_opposite]] = False
+
+        #count each adjacent pair once per edge it's across
+        edge_pairs = numpy.unique(pair_edges * len(keys) + pair_ids)
+        edge_pairs = edge_pairs[adjacent[edge_pairs % len(keys)]]
+        counts = numpy.bincount(edge_pairs // len(keys), minlength=len(self.edges))
+
+        keys = keys[adjacent]
+        return numpy.column_stack((keys // stride, keys % stride)), numpy.where(counts > 2)[0]
+
+    def edgeLengths(self, vertices):
+        """Returns the length of each edge, computed in the precision of
+        vertices like :func:`sander_simplify.v3dist` does"""
+        d = vertices[self.edges[:,0]] - vertices[self.edges[:,1]]
+        return numpy.sqrt((d[:,0]*d[:,0] + d[:,1]*d[:,1] + d[:,2]*d[:,2]).astype(numpy.float64))
+
+    def numComponents(self):
+        """Returns the number of connected components of the vertices, where
+        a vertex no triangle uses is a component of its own"""
+        #every vertex points at the lowest vertex found so far in its
+        # component. each pass points the labels at both ends of an edge at
+        # the lower of the two and then follows the pointers to the end
+        labels = numpy.arange(self.num_vertices)
+        while True:
+            low = numpy.minimum(labels[self.edges[:,0]], labels[self.edges[:,1]])
+            new_labels = labels.copy()
+            numpy.minimum.at(new_labels, labels[self.edges[:,0]], low)
+            numpy.minimum.at(new_labels, labels[self.edges[:,1]], low)
+            while True:
+                jumped = new_labels[new_labels]
+                if numpy.array_equal(jumped, new_labels):
+                    break
+                new_labels = jumped
+            if numpy.array_equal(new_labels, labels):
+                return int(numpy.sum(labels == numpy.arange(self.num_vertices)))
+            labels = new_labels
@@ -3,7 +3,7 @@ from networkx import NetworkXError
 import networkx as nx
 import __builtin__
 
-def astar_path(G, source, target, heuristic=None, weight='weight', exclude=None, subset=None):
+def astar_path(neighbors, source, target, heuristic=None, exclude=None, subset=None):
     """Return a list of nodes in a shortest path between source and target 
     using the A* ("A-star") algorithm.
 
@@ -11,7 +11,10 @@ def astar_path(G, source, target, heuristic=None, weight='weight', exclude=None,
     
     Parameters
     ----------
-    G : NetworkX graph
+    neighbors : function
+       A function that takes a node and returns a list of (neighbor, cost)
+       tuples for the edges from it, e.g. :meth:`MeshConnectivity.neighbors`
+       and edge lengths
 
     source : node
        Starting node for path
@@ -24,9 +27,6 @@ def astar_path(G, source, target, heuristic=None, weight='weight', exclude=None,
        from the a node to the target.  The function takes
        two nodes arguments and must return a number.
 
-    weight: string, optional (default='weight')
-       Edge data key corresponding to the edge weight.
-
     exclude: set, optional
        An optional set of nodes that will be excluded from
        the traversal
@@ -36,31 +36,16 @@ def astar_path(G, source, target, heuristic=None, weight='weight', exclude=None,
 
     Raises
     ------
-    NetworkXNoPath
+    NetworkXError
         If no path exists between source and target.
 
     Examples
     --------
     >>> G=nx.path_graph(5)
-    >>> print(nx.astar_path(G,0,4))
+    >>> print(astar_path(lambda n: [(m, 1) for m in G[n]], 0, 4))
     [0, 1, 2, 3, 4]
-    >>> G=nx.grid_graph(dim=[3,3])  # nodes are two-tuples (x,y)
-    >>> def dist(a, b):
-    ...    (x1, y1) = a
-    ...    (x2, y2) = b
-    ...    return ((x1 - x2) ** 2 + (y1 - y2) ** 2) ** 0.5
-    >>> print(nx.astar_path(G,(0,0),(2,2),dist))
-    [(0, 0), (0, 1), (1, 1), (1, 2), (2, 2)]
-
-
-    See Also
-    --------
-    shortest_path, dijkstra_path
 
     """
-    if G.is_multigraph():
-        raise NetworkXError("astar_path() not implemented for Multi(Di)Graphs")
-    
     if heuristic is None:
         # The default heuristic is h=0 - same as Dijkstra's algorithm
         def heuristic(u,v):
@@ -97,12 +82,12 @@ def astar_path(G, source, target, heuristic=None, weight='weight', exclude=None,
 
         explored[curnode] = parent
 
-        for neighbor, w in G[curnode].items():
+        for neighbor, w in neighbors(curnode):
             if neighbor in explored or \
                     (exclude and neighbor != target and neighbor in exclude) or \
                     (subset and neighbor not in subset):
                 continue
-            ncost = dist + w.get(weight,1)
+            ncost = dist + w
             if neighbor in enqueued:
                 qcost, h = enqueued[neighbor]
                 # if qcost < ncost, a longer path to neighbor remains
@@ -120,12 +105,13 @@ def astar_path(G, source, target, heuristic=None, weight='weight', exclude=None,
     raise nx.exception.NetworkXError("Node %s not reachable from %s"%(source,target))
 
 
-def dfs_interior_nodes(G, starting, boundary, subset):
+def dfs_interior_nodes(neighbors, starting, boundary, subset):
     """Produce nodes on the interior of a boundary of nodes
     
     Parameters
     ----------
-    G : NetworkX graph
+    neighbors : function
+       A function that takes a node and returns the nodes it has edges to
 
     starting : set
        Starting nodes to find interior nodes from
@@ -144,7 +130,7 @@ def dfs_interior_nodes(G, starting, boundary, subset):
         if start in visited:
             continue
         visited.add(start)
-        stack = [iter(G[start])]
+        stack = [iter(neighbors(start))]
         while stack:
             children = stack[-1]
             try:
@@ -152,7 +138,7 @@ def dfs_interior_nodes(G, starting, boundary, subset):
                 if child not in visited and child not in boundary and child in subset:
                     yield child
                     visited.add(child)
-                    stack.append(iter(G[child]))
+                    stack.append(iter(neighbors(child)))
             except StopIteration:
                 stack.pop()
                 
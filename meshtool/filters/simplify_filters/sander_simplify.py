@@ -3,13 +3,14 @@ from meshtool.filters.base_filters import SimplifyFilter
 import inspect
 import numpy
 import networkx as nx
-from itertools import chain, izip, combinations
+from itertools import chain, izip
 import datetime
 import math
 import __builtin__
 import heapq
 from render_utils import renderVerts, renderCharts
 from graph_utils import astar_path, dfs_interior_nodes, super_cycle
+from connectivity import MeshConnectivity
 import gc
 import sys
 import random
@@ -24,6 +25,8 @@ from meshtool.util import Image, ImageDraw
 from meshtool.filters.atlas_filters.rectpack import RectPack
 from StringIO import StringIO
 import meshtool.filters
+from meshtool import profiling
+from meshtool.textures import getPILImage
 import bisect
 
 #after numpy 1.3, unique1d was renamed to unique
@@ -459,8 +462,10 @@ class SanderSimplify(object):
     def begin_operation(self, message):
         print message,
         sys.stdout.flush()
+        profiling.beginSection(message)
         gc.disable()
     def end_operation(self):
+        profiling.endSection()
         seconds = next(self.timer).seconds
         hours = seconds // 3600
         seconds -= (hours * 3600)
@@ -487,35 +492,15 @@ class SanderSimplify(object):
 
     def build_vertex_graph(self):
         self.begin_operation('Building vertex graph...')
-        vertexgraph = nx.Graph()
-        vertexgraph.add_nodes_from(xrange(len(self.all_vertices)))
-
-        vertexgraph.add_edges_from(self.all_vert_indices[:,(0,1)])
-        vertexgraph.add_edges_from(self.all_vert_indices[:,(0,2)])
-        vertexgraph.add_edges_from(self.all_vert_indices[:,(1,2)])
-        
-        vertexgraph.add_nodes_from(( (edge[0], {facenum: True})
-                                     for facenum, edge in
-                                     enumerate(self.all_vert_indices[:,(0,1)]) ))
-        vertexgraph.add_nodes_from(( (edge[0], {facenum: True})
-                                     for facenum, edge in
-                                     enumerate(self.all_vert_indices[:,(0,2)]) ))
-        vertexgraph.add_nodes_from(( (edge[0], {facenum: True})
-                                     for facenum, edge in
-                                     enumerate(self.all_vert_indices[:,(1,2)]) ))
-        vertexgraph.add_nodes_from(( (edge[1], {facenum: True})
-                                     for facenum, edge in
-                                     enumerate(self.all_vert_indices[:,(0,1)]) ))
-        vertexgraph.add_nodes_from(( (edge[1], {facenum: True})
-                                     for facenum, edge in
-                                     enumerate(self.all_vert_indices[:,(0,2)]) ))
-        vertexgraph.add_nodes_from(( (edge[1], {facenum: True})
-                                     for facenum, edge in
-                                     enumerate(self.all_vert_indices[:,(1,2)]) ))
-        
-        self.vertexgraph = vertexgraph
+        self.connectivity = MeshConnectivity(self.all_vert_indices, len(self.all_vertices))
+        #the chart each triangle is in, which starts as a chart per triangle
+        self.tri2chart = numpy.arange(len(self.all_vert_indices))
         self.end_operation()
 
+    def vertex_charts(self, v):
+        """Returns the set of charts that have a triangle using vertex v"""
+        return set(self.tri2chart[self.connectivity.trisOfVertex(v)].tolist())
+
     def build_face_graph(self):
         self.begin_operation('Building face graph...')
         facegraph = nx.Graph()
@@ -526,40 +511,12 @@ class SanderSimplify(object):
                                    for i, tri in
                                    enumerate(self.all_vert_indices) ))
 
-        self.invalid_edges = set()
-        for (v1, v2) in self.vertexgraph.edges_iter():
-            adj_v1 = set(self.vertexgraph.node[v1].keys())
-            adj_v2 = set(self.vertexgraph.node[v2].keys())
-            adj_both = adj_v1.intersection(adj_v2)
-            if len(adj_both) < 2:
-                continue
-            numadded = 0
-            for (f1, f2) in combinations(adj_both, 2):
-                f1tri = self.all_vert_indices[f1]
-                f2tri = self.all_vert_indices[f2]
-
-                #if faces are the same up to winding order, they shouldnt be considered connected
-                if sorted(f1tri) == sorted(f2tri):
-                    continue
-                edges = [(f1tri[0], f1tri[1]), (f1tri[1], f1tri[2]), (f1tri[2], f1tri[0])]
-
-                #check to see if the adjacent triangles traverse a shared edge in the same order
-                # if they do, then they are facing opposite directions and so should not be merged
-                reallyConnected = True
-                for (f1v1, f1v2) in edges:
-                    if not f1v1 in f2tri or not f1v2 in f2tri:
-                        continue
-                    wheref2v1 = numpy.where(f2tri == f1v1)[0][0]
-                    nextlocf2 = wheref2v1 + 1 if wheref2v1 < 2 else 0
-                    if f2tri[nextlocf2] == f1v2:
-                        reallyConnected = False
-                
-                if reallyConnected:
-                    numadded += 1
-                    facegraph.add_edge(f1, f2)
-            if numadded > 2:
-                #edge is adjacent to more than two faces, so don't merge it
-                self.invalid_edges.add(tuple(sorted([v1, v2])))
+        #faces sharing an edge are connected unless they face opposite
+        # directions, and edges shared by more than two connected pairs of
+        # faces are invalid so that they don't get merged
+        adjacent, invalid = self.connectivity.faceAdjacency(self.all_vert_indices)
+        facegraph.add_edges_from(adjacent.tolist())
+        self.invalid_edges = set(tuple(edge) for edge in self.connectivity.edges[invalid].tolist())
         
         #store diffuse color of each face, or None for textures
         # this will be used to constrain the chart merging so that color-only
@@ -639,29 +596,22 @@ class SanderSimplify(object):
             # if the number of corners of the merged face is less than 3, disqualify it
             # where a "corner" is defined as a vertex with at least 3 adjacent faces
             
-            corners1 = set()
             vertices1 = set(chain.from_iterable(edges1))
-            for v in vertices1:
-                adj_v = set(self.vertexgraph.node[v].keys())
-                numadj = self.facegraph.subgraph(adj_v).number_of_edges()
-                if numadj >= 3:
-                    corners1.add(v)
-            
-            corners2 = set()
             vertices2 = set(chain.from_iterable(edges2))
-            for v in vertices2:
-                adj_v = set(self.vertexgraph.node[v].keys())
-                numadj = self.facegraph.subgraph(adj_v).number_of_edges()
-                if numadj >= 3:
-                    corners2.add(v)
+            vertex_adjacency = {}
+            for v in vertices1.union(vertices2):
+                adj_v = self.vertex_charts(v)
+                vertex_adjacency[v] = (adj_v, self.facegraph.subgraph(adj_v).number_of_edges())
+            
+            corners1 = set(v for v in vertices1 if vertex_adjacency[v][1] >= 3)
+            corners2 = set(v for v in vertices2 if vertex_adjacency[v][1] >= 3)
             
             combined_vertices = set(chain.from_iterable(combined_edges))
             newcorners = set()
             faces_sharing_vert = set()
             for v in combined_vertices:
-                adj_v = set(self.vertexgraph.node[v].keys())
+                adj_v, numadj = vertex_adjacency[v]
                 faces_sharing_vert.update(adj_v)
-                numadj = self.facegraph.subgraph(adj_v).number_of_edges()
                 if face1 in adj_v and face2 in adj_v:
                     numadj -= 1
                 if numadj >= 3:
@@ -708,7 +658,7 @@ class SanderSimplify(object):
                 othernewcorners = set()
                 otherprevcorners = set()
                 for v in vertices:
-                    adj_v = set(self.vertexgraph.node[v].keys())
+                    adj_v = self.vertex_charts(v)
                     numadj = self.facegraph.subgraph(adj_v).number_of_edges()
                     if numadj >= 3:
                         otherprevcorners.add(v)
@@ -751,12 +701,7 @@ class SanderSimplify(object):
                     if error > self.maxerror: self.maxerror = error
                     heapq.heappush(self.merge_priorities, (error, (newface, otherface)))
     
-            for v in combined_vertices:
-                if face1 in self.vertexgraph.node[v]:
-                    del self.vertexgraph.node[v][face1]
-                if face2 in self.vertexgraph.node[v]:
-                    del self.vertexgraph.node[v][face2]
-                self.vertexgraph.node[v][newface] = True
+            self.tri2chart[combined_tris] = newface
     
             self.facegraph.remove_node(face1)
             self.facegraph.remove_node(face2)
@@ -768,7 +713,7 @@ class SanderSimplify(object):
         for face, facedata in self.facegraph.nodes_iter(data=True):
             edges = facedata['edges']
             vertices = set(chain.from_iterable(edges))
-            corners = set((v for v in vertices if self.facegraph.subgraph(self.vertexgraph.node[v].keys()).number_of_edges() >= 3))
+            corners = set((v for v in vertices if self.facegraph.subgraph(self.vertex_charts(v)).number_of_edges() >= 3))
             self.facegraph.node[face]['corners'] = corners
             
         if enforce:
@@ -828,10 +773,19 @@ class SanderSimplify(object):
 
     def calc_edge_length(self):
         self.begin_operation('Computing distance between points')
-        for v1, v2 in self.vertexgraph.edges_iter():
-            self.vertexgraph.add_edge(v1, v2, distance=v3dist(self.all_vertices[v1],self.all_vertices[v2]))
+        self.edge_lengths = self.connectivity.edgeLengths(self.all_vertices)
         self.end_operation()
 
+    def edge_neighbors(self, v):
+        """Returns the neighbors of vertex v along with the length of the
+        edge to each, for :func:`graph_utils.astar_path`"""
+        return izip(self.connectivity.neighbors(v).tolist(),
+                    self.edge_lengths[self.connectivity.neighborEdges(v)].tolist())
+
+    def vertex_neighbors(self, v):
+        """Returns the neighbors of vertex v as a list"""
+        return self.connectivity.neighbors(v).tolist()
+
     def straighten_chart_boundaries(self):
         self.begin_operation('(Step 1 of 7) Straightening chart boundaries...')
         for (face1, face2) in self.facegraph.edges_iter():
@@ -911,9 +865,9 @@ class SanderSimplify(object):
             constrained_set = all_verts1.union(all_verts2)
             
             try:
-                straightened_path = astar_path(self.vertexgraph, start_path, end_path,
+                straightened_path = astar_path(self.edge_neighbors, start_path, end_path,
                                                heuristic=lambda x,y: v3dist(self.all_vertices[x], self.all_vertices[y]),
-                                               weight='distance', subset=constrained_set, exclude=stop_nodes)
+                                               subset=constrained_set, exclude=stop_nodes)
             except nx.exception.NetworkXError:
                 continue
             
@@ -943,11 +897,11 @@ class SanderSimplify(object):
             vertexset1 = boundary1.difference(straightened_path)
             vertexset2 = boundary2.difference(straightened_path)
             
-            allin1 = list(dfs_interior_nodes(self.vertexgraph,
+            allin1 = list(dfs_interior_nodes(self.vertex_neighbors,
                                              starting=vertexset1,
                                              boundary=boundary,
                                              subset=constrained_set.difference(boundary2)))
-            allin2 = list(dfs_interior_nodes(self.vertexgraph,
+            allin2 = list(dfs_interior_nodes(self.vertex_neighbors,
                                              starting=vertexset2,
                                              boundary=boundary,
                                              subset=constrained_set.difference(boundary1)))
@@ -1038,20 +992,9 @@ class SanderSimplify(object):
             if len(edges_to_remove) > 0 or len(edges_to_add) > 0:
                 continue
                 
-            #update adjaceny in vertex graph for swapped
-            orig_verts1 = set(chain.from_iterable(self.facegraph.node[face1]['edges']))
-            orig_verts2 = set(chain.from_iterable(self.facegraph.node[face2]['edges']))
-            new_verts1 = set(chain.from_iterable(new_edges1))
-            new_verts2 = set(chain.from_iterable(new_edges2))
-            
-            for v1lost in orig_verts1.difference(new_verts1):
-                del self.vertexgraph.node[v1lost][face1]
-            for v2lost in orig_verts2.difference(new_verts2):
-                del self.vertexgraph.node[v2lost][face2]
-            for v1added in new_verts1.difference(orig_verts1):
-                self.vertexgraph.node[v1added][face1] = True
-            for v2added in new_verts2.difference(orig_verts2):
-                self.vertexgraph.node[v2added][face2] = True
+            #update which chart the swapped triangles are in
+            self.tri2chart[tris1] = face1
+            self.tri2chart[tris2] = face2
                 
             self.facegraph.add_node(face1, tris=tris1, edges=new_edges1)
             self.facegraph.add_node(face2, tris=tris2, edges=new_edges2)
@@ -1103,8 +1046,8 @@ class SanderSimplify(object):
                 Bv = numpy.zeros(len(interior_verts), dtype=numpy.float32)
                 sumu = numpy.zeros(len(interior_verts), dtype=numpy.float32)
                 
-                for edge in self.vertexgraph.subgraph(unique_verts).edges_iter():
-                    v1, v2 = edge
+                chart_edges = numpy.unique(self.connectivity.tri_edges[facedata['tris']])
+                for v1, v2 in self.connectivity.edges[chart_edges].tolist():
                     if v1 in border_verts and v2 in border_verts:
                         continue
                     
@@ -1292,7 +1235,7 @@ class SanderSimplify(object):
                 elif isinstance(mat.effect.diffuse, tuple):
                     self.material2color[mat] = mat.effect.diffuse
                 else:
-                    self.material2color[mat] = mat.effect.diffuse.sampler.surface.image.pilimage
+                    self.material2color[mat] = getPILImage(mat.effect.diffuse.sampler.surface.image, self.mesh)
                     
             if mat is not None and mat.effect is not None and mat.effect.diffuse is not None and not isinstance(mat.effect.diffuse, tuple):
                 tri_uvs = self.all_orig_uvs[self.all_orig_uv_indices[i:end_range]]
@@ -1492,7 +1435,7 @@ class SanderSimplify(object):
         if v2 in self.all_edge_verts and v1 not in self.all_edge_verts:
             return
 
-        v2tris = list(self.vertexgraph.node[v2]['tris'])
+        v2tris = list(self.vertex_tris(v2))
         v2tri_idx = self.all_vert_indices[v2tris]
         
         moved = set()
@@ -1588,6 +1531,18 @@ class SanderSimplify(object):
         combined_error = texture_diff + quadric_error
         return combined_error
 
+    def vertex_tris(self, v, modify=False):
+        """Returns the triangles that use vertex v. The set for a vertex is
+        only created when it's going to be modified, until then the
+        triangles are read from the connectivity arrays."""
+        tris = self.vert_tris.get(v)
+        if tris is not None:
+            return tris
+        if not modify:
+            return self.connectivity.trisOfVertex(v).tolist()
+        tris = self.vert_tris[v] = set(self.connectivity.trisOfVertex(v).tolist())
+        return tris
+
     def initialize_simplification_errors(self):
         self.begin_operation('Calculationg priority queue for initial edge contractions...')
         
@@ -1602,11 +1557,9 @@ class SanderSimplify(object):
                 self.tri2face[tri] = face
             self.facegraph.node[face]['orig_tris'] = facedata['tris']
 
-        self.vertexgraph.add_nodes_from(( (i, {'tris':set()}) for i in xrange(len(self.all_vertices))))
-        for i, (v1,v2,v3) in enumerate(self.all_vert_indices):
-            self.vertexgraph.node[v1]['tris'].add(i)
-            self.vertexgraph.node[v2]['tris'].add(i)
-            self.vertexgraph.node[v3]['tris'].add(i)
+        #the triangles using each vertex once they start to change, see vertex_tris
+        self.vert_tris = {}
+        self.vertex_removed = numpy.zeros(len(self.all_vertices), dtype=bool)
 
         self.contraction_priorities = []
 
@@ -1630,28 +1583,27 @@ class SanderSimplify(object):
 
         #to preserve borders, we inflate the quadric error for edges that
         # only have one incident triangle
-        for v1,v2 in self.vertexgraph.edges_iter():
-            tris1 = self.vertexgraph.node[v1]['tris']
-            tris2 = self.vertexgraph.node[v2]['tris']
-            tris_both = tris1.intersection(tris2)
-            if len(tris_both) > 1: continue
-            t = list(tris_both)[0]
-            
-            v = self.all_vertices[v1] - self.all_vertices[v2]
-            normal2 = numpy.cross(v, normal[t])
-            normal2 = normal2 / numpy.linalg.norm(normal2)
-            d = -numpy.dot(normal[t], self.all_vertices[v1])
-            A3 = area[t] * numpy.outer(normal2, normal2)
-            b3 = area[t] * d * normal2
-            c3 = area[t] * d * d
-
-            self.vert_quadric_A[v1] += A3
-            self.vert_quadric_b[v1] += b3
-            self.vert_quadric_c[v1] += c3
+        border_edges = numpy.where(self.connectivity.edgeTriCounts() == 1)[0]
+        v1 = self.connectivity.edges[border_edges,0]
+        v2 = self.connectivity.edges[border_edges,1]
+        t = self.connectivity.edge_tris[self.connectivity.edge_tri_offsets[border_edges]]
+        
+        v = self.all_vertices[v1] - self.all_vertices[v2]
+        normal2 = numpy.cross(v, normal[t])
+        normal2 = normal2 / numpy.sqrt(numpy.sum(normal2 * normal2, axis=1))[:,numpy.newaxis]
+        d = -numpy.sum(normal[t] * self.all_vertices[v1], axis=1)
+        tarea = area[t]
+        A3 = tarea[:,numpy.newaxis,numpy.newaxis] * normal2[:,:,numpy.newaxis] * normal2[:,numpy.newaxis,:]
+        b3 = (tarea * d)[:,numpy.newaxis] * normal2
+        c3 = tarea * d * d
+        
+        numpy.add.at(self.vert_quadric_A, v1, A3)
+        numpy.add.at(self.vert_quadric_b, v1, b3)
+        numpy.add.at(self.vert_quadric_c, v1, c3)
 
         self.maxerror = 0
         
-        for (vv1, vv2) in self.vertexgraph.edges_iter():
+        for (vv1, vv2) in self.connectivity.edges.tolist():
             for (v1, v2) in ((vv1,vv2),(vv2,vv1)):
                 combined_error = self.evaluate_edge_collapse(v1,v2)
                 if combined_error is None:
@@ -1677,19 +1629,19 @@ class SanderSimplify(object):
             #considering (v1,v2) -> v1
             
             #check of one of these vertices was already contracted
-            if v1 not in self.vertexgraph or v2 not in self.vertexgraph:
+            if self.vertex_removed[v1] or self.vertex_removed[v2]:
                 continue
 
             #cutoff value was chosen which seems to work well for most models
             if error > 0:
                 logrel = math.log(1 + error) / math.log(1 + self.maxerror)
-                #print 'error', error, 'maxerror', self.maxerror, 'logrel', logrel, 'v1', v1, 'v2', v2, 'numverts', len(self.vertexgraph), 'numfaces', len(self.tris_left), 'contractions left', len(self.contraction_priorities)
+                #print 'error', error, 'maxerror', self.maxerror, 'logrel', logrel, 'v1', v1, 'v2', v2, 'numverts', len(self.vertex_removed) - numpy.sum(self.vertex_removed), 'numfaces', len(self.tris_left), 'contractions left', len(self.contraction_priorities)
             else: logrel = 0
             if logrel > SIMPLIFICATION_ERROR_THRESHOLD and len(self.tris_left) < TRIANGLE_MAXIMUM:
                 break
             
-            v2tris = list(self.vertexgraph.node[v2]['tris'])
-            v1tris = self.vertexgraph.node[v1]['tris']
+            v2tris = list(self.vertex_tris(v2, modify=True))
+            v1tris = self.vertex_tris(v1, modify=True)
             v2tri_idx = self.all_vert_indices[v2tris]
             
             invalid_contraction = False
@@ -1730,7 +1682,7 @@ class SanderSimplify(object):
                     self.new_uv_indices[t2][where_v2] = face_vert2uvidx[v1]
                     
                     #add tri to v1's list now that we moved it
-                    self.vertexgraph.node[v1]['tris'].add(t2)
+                    v1tris.add(t2)
                     
                     #try to find a triangle in the same chart as v2 that contains v1
                     # so we can copy its normal value
@@ -1757,13 +1709,13 @@ class SanderSimplify(object):
             #remove the degenerate triangle from the triangle list of other vertices in the triangle
             for tri in degenerate:
                 for v in self.all_vert_indices[tri]:
-                    self.vertexgraph.node[v]['tris'].discard(tri)
+                    self.vertex_tris(v, modify=True).discard(tri)
             
             #discard the degenerate triangles from the total list of tris
             self.tris_left.difference_update(degenerate)
             
             #remove vertex from graph
-            self.vertexgraph.remove_node(v2)
+            self.vertex_removed[v2] = True
             
             #update quadric
             self.vert_quadric_A[v1] += self.vert_quadric_A[v2]
@@ -1804,7 +1756,7 @@ class SanderSimplify(object):
                                              self.new_uv_indices[tri]))
             
             for v in tri_idx:
-                self.vertexgraph.node[v]['tris'].discard(tri)
+                self.vertex_tris(v, modify=True).discard(tri)
                 
             self.tris_left.remove(tri)
         
@@ -2069,9 +2021,9 @@ class SanderSimplify(object):
         self.build_face_graph()
         
         #renderCharts(self.facegraph, self.all_vertices, self.all_vert_indices)
-        print 'number of vertices =', len(self.vertexgraph)
+        print 'number of vertices =', self.connectivity.num_vertices
         print 'number of faces =', len(self.facegraph)
-        print 'connected vertex components =', nx.number_connected_components(self.vertexgraph)
+        print 'connected vertex components =', self.connectivity.numComponents()
         print 'connected face components =', nx.number_connected_components(self.facegraph)
         
         self.initialize_chart_merge_errors()
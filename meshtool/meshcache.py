@@ -0,0 +1,319 @@
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+from StringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import numpy
+import collada
+from collada.xmlutil import writeXML, COLLADA_NS
+
+import meshtool
+
+# Sidecar caches are stored next to the input as <input>.meshcache. Each holds
+# the COLLADA document of the loaded mesh with the geometry data taken out,
+# and the geometry data itself as raw arrays, so a load is an mmap instead
+# of a parse. The layout is:
+#   MAGIC, the length of the JSON header as a little endian uint64, the
+#   header, then the arrays and text at the offsets the header gives.
+SIDECAR_SUFFIX = '.meshcache'
+MAGIC = 'MESHCACHE\n'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+# how much of the start and end of an input is hashed to check it hasn't changed
+STAMP_HASH_SIZE = 1024 * 1024
+
+# primitive types whose index arrays are stored, and the text nodes they're read from
+_STORED_PRIMITIVES = {collada.triangleset.TriangleSet: ('p',),
+                      collada.polylist.Polylist: ('vcount', 'p'),
+                      collada.lineset.LineSet: ('p',)}
+
+_enabled = bool(os.environ.get('MESHTOOL_MESHCACHE'))
+
+def setEnabled(enabled):
+    """Turns sidecar caches on or off for load filters in this process and
+    any worker processes started after it"""
+    global _enabled
+    _enabled = enabled
+
+def isEnabled():
+    return _enabled
+
+def sidecarPath(filename):
+    return filename + SIDECAR_SUFFIX
+
+def fileStamp(path):
+    """Returns something that changes when a file does, without reading all
+    of it: its size, mtime, and a hash of its first and last megabyte. None
+    if the file doesn't exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    sha = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        sha.update(f.read(STAMP_HASH_SIZE))
+        if st.st_size > STAMP_HASH_SIZE:
+            f.seek(max(STAMP_HASH_SIZE, st.st_size - STAMP_HASH_SIZE))
+            sha.update(f.read(STAMP_HASH_SIZE))
+    finally:
+        f.close()
+    return [st.st_size, st.st_mtime, sha.hexdigest()]
+
+class RecordingLoader(object):
+    """Wraps an aux file loader, remembering the names of the files it loads"""
+    def __init__(self, aux_file_loader):
+        self.aux_file_loader = aux_file_loader
+        self.names = []
+    def __call__(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return self.aux_file_loader(name)
+
+def _storedPrimitives(mesh):
+    """Yields (geometry index, primitive index, primitive) for the primitives
+    whose indices go in the arrays instead of the document"""
+    for g, geom in enumerate(mesh.geometries):
+        for p, prim in enumerate(geom.primitives):
+            if type(prim) in _STORED_PRIMITIVES:
+                yield g, p, prim
+
+def _storedSources(geom):
+    """Returns the float sources of a geometry, by id"""
+    sources = {}
+    for src in geom.sourceById.values():
+        if isinstance(src, collada.source.FloatSource):
+            sources[src.id] = src
+    return sources
+
+def _childNode(node, name):
+    return node.find('{%s}%s' % (COLLADA_NS, name))
+
+def fillGeometry(mesh, sources, primitives):
+    """Puts geometry data back into a mesh loaded from a document it was taken
+    out of, as by :func:`writeSidecar`
+
+    :param sources: A list of (geometry index, source id, values) for float sources
+    :param primitives: A list of (geometry index, primitive index, index values,
+                       vcounts or None, texts) for triangle sets, polylists and
+                       line sets, where texts maps the names of their p and
+                       vcount nodes to the text to put back in the document
+    """
+    for g, src_id, values in sources:
+        src = _storedSources(mesh.geometries[g])[src_id]
+        src.data = values.reshape(-1, len(src.components))
+    for g, p, index, vcounts, texts in primitives:
+        geom = mesh.geometries[g]
+        prim = geom.primitives[p]
+        for name, text in texts.iteritems():
+            _childNode(prim.xmlnode, name).text = text
+        # recreate the primitive on the data, reusing its document node
+        if isinstance(prim, collada.polylist.Polylist):
+            geom.primitives[p] = type(prim)(prim.sources, prim.material, index, vcounts, prim.xmlnode)
+        else:
+            geom.primitives[p] = type(prim)(prim.sources, prim.material, index, prim.xmlnode)
+
+def writeSidecar(mesh, filename, loader_name, dependencies=None):
+    """Writes the sidecar cache for a mesh just loaded from filename
+
+    :param dependencies: A dict of the aux files read while loading the mesh,
+                         mapping the name they were loaded by to their
+                         :func:`fileStamp`
+    """
+    if getattr(mesh, 'zfile', None) is not None:
+        # aux files come from inside the zip
+        return
+
+    blobs = []
+    header = {'format_version': FORMAT_VERSION,
+              'meshtool_version': meshtool.__version__,
+              'loader': loader_name,
+              'source': fileStamp(filename),
+              'dependencies': dependencies or {},
+              'has_filename': mesh.filename is not None,
+              'sources': [],
+              'primitives': [],
+              'images': []}
+
+    def addBlob(data):
+        blobs.append(data)
+        return len(blobs) - 1
+
+    # take the data out of the document while it's written, putting it back after
+    restore = []
+    for g, geom in enumerate(mesh.geometries):
+        for src_id, src in sorted(_storedSources(geom).items()):
+            header['sources'].append([g, src_id, addBlob(numpy.ascontiguousarray(src.data, dtype=numpy.float32))])
+            array_node = _childNode(src.xmlnode, 'float_array')
+            restore.append((src, 'data', src.data))
+            restore.append((array_node, 'text', array_node.text))
+            src.data = numpy.zeros((0, len(src.components)), dtype=numpy.float32)
+            array_node.text = None
+    for g, p, prim in _storedPrimitives(mesh):
+        record = [g, p, addBlob(numpy.ascontiguousarray(prim.index.ravel(), dtype=numpy.int32)), None, {}]
+        if isinstance(prim, collada.polylist.Polylist):
+            record[3] = addBlob(numpy.ascontiguousarray(prim.vcounts, dtype=numpy.int32))
+        for name in _STORED_PRIMITIVES[type(prim)]:
+            node = _childNode(prim.xmlnode, name)
+            record[4][name] = addBlob(node.text or '')
+            restore.append((node, 'text', node.text))
+            node.text = None
+        header['primitives'].append(record)
+    for cimg in mesh.images:
+        # images that came with the mesh instead of being loaded when used
+        if getattr(cimg, '_data', None) is not None:
+            header['images'].append([cimg.id, addBlob(cimg._data)])
+
+    try:
+        # meshes built in memory (e.g. from OBJ) don't have a document until saved
+        mesh.save()
+        skeleton = StringIO()
+        writeXML(mesh.xmlnode, skeleton)
+        header['skeleton'] = addBlob(skeleton.getvalue())
+    finally:
+        for obj, attr, value in reversed(restore):
+            setattr(obj, attr, value)
+
+    sidecar_dir = os.path.dirname(os.path.abspath(filename))
+    try:
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=sidecar_dir)
+    except (IOError, OSError):
+        # the cache is only an optimization, so a read-only directory is fine
+        return
+    f = os.fdopen(fd, 'wb')
+    try:
+        # lay out the blobs, then write the header with their offsets in front of them
+        layout = []
+        offset = 0
+        for blob in blobs:
+            if isinstance(blob, numpy.ndarray):
+                layout.append([offset, str(blob.dtype), list(blob.shape)])
+                size = blob.nbytes
+            else:
+                layout.append([offset, None, [len(blob)]])
+                size = len(blob)
+            offset += (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        header['blobs'] = layout
+        header_data = json.dumps(header)
+        data_start = len(MAGIC) + 8 + len(header_data)
+        data_start = (data_start + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', data_start - len(MAGIC) - 8))
+        f.write(header_data.ljust(data_start - len(MAGIC) - 8))
+        for blob, (offset, dtype, shape) in zip(blobs, layout):
+            f.seek(data_start + offset)
+            f.write(blob.tostring() if isinstance(blob, numpy.ndarray) else blob)
+        f.close()
+        os.rename(temp_path, sidecarPath(filename))
+    finally:
+        f.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def readHeader(f):
+    """Returns the header of a sidecar cache and where its data starts, or
+    (None, None) if it isn't one"""
+    if f.read(len(MAGIC)) != MAGIC:
+        return None, None
+    try:
+        header_size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_size))
+    except (struct.error, ValueError):
+        return None, None
+    return header, len(MAGIC) + 8 + header_size
+
+def isCurrent(header, filename, loader_name, resolve=None):
+    """True if a sidecar cache was written for the file as it is now, by this
+    version of meshtool and the same loader"""
+    if header.get('format_version') != FORMAT_VERSION or \
+            header.get('meshtool_version') != meshtool.__version__ or \
+            header.get('loader') != loader_name:
+        return False
+    if header.get('source') != fileStamp(filename):
+        return False
+    for name, stamp in header.get('dependencies', {}).iteritems():
+        path = resolve(name) if resolve is not None else None
+        if stamp != (fileStamp(path) if path is not None else None):
+            return False
+    return True
+
+def readSidecar(filename, loader_name, resolve=None):
+    """Loads a mesh from the sidecar cache of filename. The geometry data is
+    mapped copy-on-write, so it's only read from disk as it's used.
+
+    :param resolve: A callable that returns the path of an aux file given the
+                    name it was loaded by, to check that it hasn't changed
+
+    :returns: A :class:`collada.Collada` or None if there's no up to date sidecar
+    """
+    try:
+        f = open(sidecarPath(filename), 'rb')
+    except IOError:
+        return None
+    try:
+        header, data_start = readHeader(f)
+        if header is None or not isCurrent(header, filename, loader_name, resolve):
+            return None
+        if os.fstat(f.fileno()).st_size <= data_start:
+            return None
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    finally:
+        f.close()
+
+    def blob(index):
+        offset, dtype, shape = header['blobs'][index]
+        offset += data_start
+        if dtype is None:
+            return data[offset:offset + shape[0]]
+        count = int(numpy.prod(shape))
+        return numpy.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+    mesh = collada.Collada(StringIO(blob(header['skeleton'])))
+    if header['has_filename']:
+        mesh.filename = filename
+        mesh.getFileData = mesh._getFileFromDisk
+    for image_id, index in header['images']:
+        mesh.images[image_id].data = blob(index)
+
+    sources = [(g, src_id, blob(index)) for g, src_id, index in header['sources']]
+    primitives = [(g, p, blob(index), blob(vcounts) if vcounts is not None else None,
+                   dict((name, blob(text_index)) for name, text_index in texts.iteritems()))
+                  for g, p, index, vcounts, texts in header['primitives']]
+    fillGeometry(mesh, sources, primitives)
+    return mesh
+
+def loadWithSidecar(loader_name, filename, load, aux_file_loader=None, resolve=None):
+    """Loads a file with its sidecar cache if it's enabled and up to date,
+    otherwise calls load and writes the sidecar cache for next time.
+
+    :param load: A callable that loads the file, given the aux file loader to use
+    :param aux_file_loader: The aux file loader to pass to load. The files it
+                            loads are checked along with the file itself.
+    :param resolve: A callable that returns the path of an aux file given its name
+
+    :returns: The loaded :class:`collada.Collada`
+    """
+    if not _enabled:
+        return load(aux_file_loader)
+    mesh = readSidecar(filename, loader_name, resolve)
+    if mesh is not None:
+        return mesh
+
+    recorder = RecordingLoader(aux_file_loader) if aux_file_loader is not None else None
+    mesh = load(recorder)
+    if mesh is not None:
+        dependencies = {}
+        if recorder is not None:
+            for name in recorder.names:
+                path = resolve(name) if resolve is not None else None
+                dependencies[name] = fileStamp(path) if path is not None else None
+        writeSidecar(mesh, filename, loader_name, dependencies)
+    return mesh
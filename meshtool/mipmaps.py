@@ -0,0 +1,117 @@
+import json
+import urllib2
+
+# save_mipmaps writes a <texture>.tar of the mipmap levels of each texture,
+# and next to it a <texture>.tar.json index of where each level's file is in
+# the tar. With the index, a client can fetch just the level it needs with
+# an HTTP Range request, instead of reading the tar headers first.
+
+INDEX_SUFFIX = '.json'
+INDEX_VERSION = 1
+
+def indexPath(tar_path):
+    """Returns the path of the index of a mipmap tar file"""
+    return tar_path + INDEX_SUFFIX
+
+def makeIndex(byte_ranges):
+    """Returns the text of an index
+
+    :param byte_ranges: The offset, length, width and height of each level,
+                        as returned by :func:`meshtool.filters.optimize_filters.save_mipmaps.writeMipMapTar`
+    """
+    levels = [[r['width'], r['height'], r['offset'], r['length']] for r in byte_ranges]
+    return json.dumps({'version': INDEX_VERSION, 'levels': levels},
+                      separators=(',', ':'))
+
+def parseIndex(data):
+    """Returns the levels of an index, as dicts with the offset, length,
+    width and height of each one, from smallest to largest"""
+    index = json.loads(data)
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError('Unsupported mipmap index version %r' % index.get('version'))
+    levels = [{'width': width, 'height': height, 'offset': offset, 'length': length}
+              for width, height, offset, length in index['levels']]
+    levels.sort(key=lambda level: level['width'] * level['height'])
+    return levels
+
+def findLevel(levels, width, height=None):
+    """Returns the level of a given size, or if there isn't one, the smallest
+    level at least that size, or the largest level if none are
+
+    :param height: Defaults to any height
+    """
+    for level in levels:
+        if level['width'] >= width and (height is None or level['height'] >= height):
+            return level
+    return levels[-1]
+
+def fileRangeFetcher(path):
+    """Returns a function fetch(offset, length) that reads a byte range of a local file"""
+    def fetch(offset, length):
+        f = open(path, 'rb')
+        try:
+            f.seek(offset)
+            return f.read(length)
+        finally:
+            f.close()
+    return fetch
+
+def httpRangeFetcher(url):
+    """Returns a function fetch(offset, length) that gets a byte range of a
+    URL with an HTTP Range request"""
+    def fetch(offset, length):
+        request = urllib2.Request(url)
+        request.add_header('Range', 'bytes=%d-%d' % (offset, offset + length - 1))
+        response = urllib2.urlopen(request)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+        if response.getcode() != 206:
+            # the server ignored the range and sent the whole file
+            data = data[offset:offset + length]
+        return data
+    return fetch
+
+class MipMapReader(object):
+    """Reads single levels out of a mipmap tar file through its index"""
+
+    def __init__(self, fetch, levels):
+        """
+        :param fetch: A function fetch(offset, length) returning that byte range of the tar file
+        :param levels: The levels, as returned by :func:`parseIndex`
+        """
+        self.fetch = fetch
+        self.levels = levels
+
+    def getLevel(self, width, height=None):
+        """Returns the level that :func:`findLevel` picks for a size"""
+        return findLevel(self.levels, width, height)
+
+    def read(self, width, height=None):
+        """Returns the image file data of the level that :func:`findLevel`
+        picks for a size, fetching only that level's bytes"""
+        level = self.getLevel(width, height)
+        data = self.fetch(level['offset'], level['length'])
+        if len(data) != level['length']:
+            raise IOError('Expected %d bytes of mipmap level, got %d' % (level['length'], len(data)))
+        return data
+
+def openFile(tar_path):
+    """Returns a :class:`MipMapReader` for a mipmap tar file on disk"""
+    f = open(indexPath(tar_path), 'rb')
+    try:
+        levels = parseIndex(f.read())
+    finally:
+        f.close()
+    return MipMapReader(fileRangeFetcher(tar_path), levels)
+
+def openURL(tar_url):
+    """Returns a :class:`MipMapReader` for a mipmap tar file served over
+    HTTP, with its index at the same URL plus :data:`INDEX_SUFFIX`"""
+    response = urllib2.urlopen(indexPath(tar_url))
+    try:
+        levels = parseIndex(response.read())
+    finally:
+        response.close()
+    return MipMapReader(httpRangeFetcher(tar_url), levels)
@@ -0,0 +1,194 @@
+import os
+import collada
+from meshtool import profiling, textures
+from meshtool.filters import factory
+from meshtool.filters.base_filters import FilterException, OpFilter, LoadFilter, SaveFilter
+
+class ChainError(Exception):
+    """Raised when a filter in a chain fails"""
+    pass
+
+class ChainUsageError(ChainError):
+    """Raised when a chain of filters isn't valid, e.g. it doesn't start with a load filter"""
+    pass
+
+class FilterChain(object):
+    """A load filter followed by a list of operation filters, along with the
+    arguments to pass to each of them. Filter instances are created once when
+    the chain is parsed and reused every time the chain is run."""
+
+    def __init__(self, ordered_args, instances=None):
+        """
+        :param ordered_args: A list of (filter_name, arguments) tuples, in the
+                             order the filters should be run
+        :param instances: Filter instances to use for each entry in ordered_args.
+                          Instances are created from the factory if not given.
+        """
+        if len(ordered_args) == 0:
+            raise ChainUsageError("no arguments given")
+
+        self.ordered_args = [(name, list(arguments)) for name, arguments in ordered_args]
+
+        if instances is None:
+            instances = [factory.getInstance(name) for name, arguments in self.ordered_args]
+        self.instances = instances
+
+        if self.instances[0] is None or not isinstance(self.instances[0], LoadFilter):
+            raise ChainUsageError("first argument must be a load filter")
+        for i, inst in enumerate(self.instances[1:]):
+            if inst is None or not isinstance(inst, OpFilter):
+                raise ChainUsageError("specified filter (argument %d:'%s') is not an operation filter" %
+                                      (i+1, self.ordered_args[i+1][0]))
+
+    def format(self, **fields):
+        """Returns a copy of this chain with every argument formatted as a
+        template with the given fields, e.g. '{name}.zip'"""
+        formatted = [(name, [arg.format(**fields) for arg in arguments])
+                     for name, arguments in self.ordered_args]
+        return FilterChain(formatted, self.instances)
+
+    def firstSaveIndex(self):
+        """Returns the index in the chain of its first save filter, or the
+        length of the chain if it doesn't have one"""
+        for i, inst in enumerate(self.instances):
+            if isinstance(inst, SaveFilter):
+                return i
+        return len(self.instances)
+
+    def run(self, profiler=None, cache=None, stop=None, stream=False):
+        """Runs the chain, returning the resulting :class:`collada.Collada` instance
+
+        :param profiler: An optional :class:`meshtool.profiling.FilterProfiler`
+                         that records each filter as it runs
+        :param cache: An optional :class:`meshtool.cache.ResultCache`. Results
+                      found in the cache are reused instead of running the
+                      filters that produced them. If every filter's result was
+                      found, None is returned since the mesh isn't loaded.
+        :param stop: If given, only the filters before this index in the
+                     chain are run, and the cache isn't used. The rest can
+                     be run later with :meth:`resume`.
+        :param stream: If True and the chain only converts an OBJ file to
+                       COLLADA, the file is converted by copying its text
+                       without loading the mesh, and None is returned. See
+                       :func:`meshtool.filters.load_filters.obj_to_collada.convertOBJ`
+                       for how the output differs.
+
+        :raises: :class:`ChainError` if any of the filters fail
+        """
+        previous_profiler = profiling.getActiveProfiler()
+        profiling.setActiveProfiler(profiler)
+        try:
+            if stop is not None:
+                return self._run(profiler, None, stop, False)
+            return self._run(profiler, cache, len(self.ordered_args), stream)
+        finally:
+            profiling.setActiveProfiler(previous_profiler)
+
+    def resume(self, collada_inst, start, profiler=None):
+        """Runs the filters of the chain from index start on, on a mesh that
+        the ones before it were run on with the stop argument of :meth:`run`
+
+        :raises: :class:`ChainError` if any of the filters fail
+        """
+        previous_profiler = profiling.getActiveProfiler()
+        profiling.setActiveProfiler(profiler)
+        try:
+            self._prefetch(collada_inst, start)
+            return self._apply(collada_inst, start, len(self.ordered_args))
+        finally:
+            profiling.setActiveProfiler(previous_profiler)
+
+    def _run(self, profiler, cache, stop, stream):
+        plan = None
+        start = 0
+        collada_inst = None
+        if cache is not None:
+            from meshtool.cache import CachePlan
+            plan = CachePlan(cache, self.ordered_args, stream)
+            profiling.beginSection('cache_restore')
+            try:
+                start, collada_inst = plan.restore()
+            finally:
+                profiling.endSection()
+            if start > 0 and collada_inst is None:
+                return None
+
+        if stream and start == 0 and stop == len(self.ordered_args) and self._stream():
+            if plan is not None:
+                plan.store(len(self.ordered_args) - 1, None)
+            return None
+
+        if start == 0:
+            collada_inst = self._load(profiler)
+
+        self._prefetch(collada_inst, start + 1, stop)
+
+        #filters before start were restored from the cache
+        return self._apply(collada_inst, start + 1, stop, plan)
+
+    def _apply(self, collada_inst, start, stop, plan=None):
+        """Runs the operation filters from index start up to stop on a mesh"""
+        for i in range(start, stop):
+            filter_name, arguments = self.ordered_args[i]
+            try:
+                collada_inst = profiling.applyFilter(filter_name, self.instances[i], collada_inst, *arguments)
+            except FilterException, e:
+                raise ChainError("(argument %d) '%s': %s" % (i, filter_name, str(e)))
+            if not isinstance(collada_inst, collada.Collada):
+                raise ChainError("got an incorrect return value from filter (argument %d) '%s' " % (i, filter_name))
+            if plan is not None:
+                plan.store(i, collada_inst)
+
+        return collada_inst
+
+    def _prefetch(self, collada_inst, start, stop=None):
+        """Starts decoding the textures of a mesh in the background if any of
+        the filters from index start up to stop decode them, so they're
+        decoded while the filters before them run"""
+        if stop is None:
+            stop = len(self.ordered_args)
+        remaining = [filter_name for filter_name, arguments in self.ordered_args[start:stop]]
+        if collada_inst is not None and textures.DECODING_FILTERS.intersection(remaining):
+            textures.prefetch(collada_inst)
+
+    def _stream(self):
+        """Runs a chain that only converts an OBJ file to COLLADA by copying the
+        records of one to the other, see :mod:`meshtool.filters.load_filters.obj_to_collada`.
+
+        :returns: False if the chain isn't a plain conversion or the input
+                  can't be streamed, in which case it should be run as usual
+        """
+        if [filter_name for filter_name, arguments in self.ordered_args] != ['load_obj', 'save_collada']:
+            return False
+        obj_filename = self.ordered_args[0][1][0]
+        collada_filename = self.ordered_args[1][1][0]
+        if not os.path.isfile(obj_filename) or os.path.exists(collada_filename):
+            # the filters give the errors for these
+            return False
+
+        from meshtool.filters.load_filters.load_obj import SlowPathNeeded
+        from meshtool.filters.load_filters.obj_to_collada import convertOBJFile
+        profiling.beginSection('obj_to_collada')
+        try:
+            converted = convertOBJFile(obj_filename, collada_filename)
+        except SlowPathNeeded:
+            return False
+        finally:
+            profiling.endSection()
+        if not converted:
+            raise ChainError("got an incorrect return value from filter (argument %d) '%s' " % (1, 'load_obj'))
+        return True
+
+    def _load(self, profiler):
+        (load_filter_name, load_filter_args) = self.ordered_args[0]
+        load = lambda: self.instances[0].apply(*load_filter_args)
+        try:
+            if profiler is None:
+                collada_inst = load()
+            else:
+                collada_inst = profiler.run(load_filter_name, load_filter_args, load)
+        except FilterException, e:
+            raise ChainError("(argument %d) '%s': %s" % (1, load_filter_name, str(e)))
+        if not isinstance(collada_inst, collada.Collada):
+            raise ChainError("got an incorrect return value from filter (argument %d) '%s' " % (1, load_filter_name))
+        return collada_inst
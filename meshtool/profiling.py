@@ -0,0 +1,175 @@
+import os
+import sys
+import time
+import threading
+
+import collada
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def peakRSS():
+    """Returns the peak resident set size of this process in bytes, since it
+    started, or None if it isn't available on this platform"""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #linux reports kilobytes, OS X reports bytes
+    if sys.platform != 'darwin':
+        maxrss *= 1024
+    return maxrss
+
+def cpuTime():
+    """Returns user plus system CPU time used by this process"""
+    times = os.times()
+    return times[0] + times[1]
+
+def meshCounts(mesh):
+    """Returns a tuple (triangles, vertices) for the geometries in the mesh.
+    Polygons are counted as the number of triangles they would fan into,
+    and vertices are the number of unique positions in the vertex sources."""
+    if mesh is None:
+        return (None, None)
+    num_triangles = 0
+    vertex_sources = {}
+    for geom in mesh.geometries:
+        for prim in geom.primitives:
+            if isinstance(prim, collada.triangleset.TriangleSet):
+                num_triangles += len(prim)
+            elif isinstance(prim, collada.polylist.Polylist):
+                num_triangles += int(sum(prim.vcounts)) - 2 * len(prim.vcounts)
+            if prim.vertex is not None:
+                vertex_sources[id(prim.vertex)] = len(prim.vertex)
+    return (num_triangles, sum(vertex_sources.values()))
+
+class FilterProfiler(object):
+    """Records wall time, CPU time, peak memory and mesh size for each filter
+    that runs. Filters run by other filters (e.g. meta filters) and sections
+    timed inside a filter are recorded as children of the filter running them.
+
+    The operating system only keeps the peak memory of the whole process,
+    so each record has process_peak_rss, the peak since the process started
+    as of when the filter finished, and peak_rss_growth, how much the filter
+    raised it. A filter that stays under the peak an earlier one set has a
+    growth of 0."""
+
+    def __init__(self):
+        self.records = []
+        self.counters = {}
+        self._stack = []
+        self._counter_lock = threading.Lock()
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def begin(self, name, arguments=None, mesh=None):
+        triangles, vertices = meshCounts(mesh)
+        record = {'name': name,
+                  'arguments': list(arguments) if arguments is not None else [],
+                  'triangles_before': triangles,
+                  'vertices_before': vertices,
+                  'children': [],
+                  '_wall_start': time.time(),
+                  '_cpu_start': cpuTime(),
+                  '_peak_rss_start': peakRSS(),
+                  '_traced_start': tracemalloc.get_traced_memory()[0] if tracemalloc is not None else None}
+        if len(self._stack) > 0:
+            self._stack[-1]['children'].append(record)
+        else:
+            self.records.append(record)
+        self._stack.append(record)
+        return record
+
+    def end(self, mesh=None, counts=True):
+        record = self._stack.pop()
+        record['wall_time'] = time.time() - record.pop('_wall_start')
+        record['cpu_time'] = cpuTime() - record.pop('_cpu_start')
+        peak_rss_start = record.pop('_peak_rss_start')
+        record['process_peak_rss'] = peakRSS()
+        record['peak_rss_growth'] = record['process_peak_rss'] - peak_rss_start if peak_rss_start is not None else None
+        traced_start = record.pop('_traced_start')
+        record['tracemalloc_delta'] = tracemalloc.get_traced_memory()[0] - traced_start if traced_start is not None else None
+        if counts:
+            record['triangles_after'], record['vertices_after'] = meshCounts(mesh)
+        return record
+
+    def run(self, name, arguments, func, mesh=None):
+        """Calls func, recording it under the given name. mesh is the input
+        mesh, if any, and func should return the output mesh."""
+        depth = len(self._stack)
+        self.begin(name, arguments, mesh)
+        try:
+            mesh = func()
+        finally:
+            #close any sections left open by an exception
+            while len(self._stack) > depth + 1:
+                self.end(counts=False)
+            self.end(mesh)
+        return mesh
+
+    def count(self, name, amount=1):
+        """Adds to a counter, both in the totals and in the record of the
+        filter or section currently running. Can be called from any thread."""
+        with self._counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            if len(self._stack) > 0:
+                counters = self._stack[-1].setdefault('counters', {})
+                counters[name] = counters.get(name, 0) + amount
+
+    def getJSON(self):
+        return json.dumps({'filters': self.records,
+                           'counters': self.counters,
+                           'total_wall_time': sum(r.get('wall_time', 0) for r in self.records),
+                           'total_cpu_time': sum(r.get('cpu_time', 0) for r in self.records),
+                           'process_peak_rss': peakRSS()}, indent=2)
+
+    def save(self, filename):
+        if filename == '-':
+            print self.getJSON()
+            return
+        f = open(filename, 'w')
+        f.write(self.getJSON())
+        f.close()
+
+# profiler for the chain currently running in this process, if any
+_active = None
+
+def setActiveProfiler(profiler):
+    global _active
+    _active = profiler
+
+def getActiveProfiler():
+    return _active
+
+def applyFilter(name, inst, mesh, *arguments):
+    """Applies an operation filter to a mesh, recording it with the active
+    profiler if there is one. Meta filters should use this to run sub-filters."""
+    if _active is None:
+        return inst.apply(mesh, *arguments)
+    return _active.run(name, arguments, lambda: inst.apply(mesh, *arguments), mesh)
+
+def beginSection(name):
+    """Starts timing a section of work inside the currently running filter"""
+    if _active is not None:
+        _active.begin(name)
+
+def endSection():
+    if _active is not None:
+        _active.end(counts=False)
+
+def count(name, amount=1):
+    """Adds to a counter of the active profiler, e.g. how many times something
+    was done inside a filter"""
+    if _active is not None:
+        _active.count(name, amount)
@@ -0,0 +1,339 @@
+import os
+import sys
+import time
+import signal
+import itertools
+import threading
+import traceback
+import collections
+import multiprocessing
+import SocketServer
+import BaseHTTPServer
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from meshtool.pipeline import FilterChain, ChainError, ChainUsageError
+from meshtool.batch import templateFields
+from meshtool.filters import factory
+
+# finished jobs are forgotten after this many more have finished
+MAX_FINISHED_JOBS = 1000
+# seconds between checks for jobs that have run out of time
+REAP_INTERVAL = 1.0
+
+class JobError(Exception):
+    """Raised when a job request is invalid"""
+    pass
+
+class QueueFullError(JobError):
+    """Raised when too many jobs are already waiting"""
+    pass
+
+# Worker processes stay up between jobs, so everything imported by the
+# first job (numpy, collada, filter modules) is already loaded for the next.
+_worker_cache = None
+
+def _initWorker(cache=None):
+    global _worker_cache
+    _worker_cache = cache
+    # the server process handles ctrl-c and closes the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # import what almost every chain needs up front, instead of on the first job
+    import numpy
+    import collada
+    try:
+        from meshtool.filters.panda_filters import pandacore
+    except ImportError:
+        pass
+    else:
+        pandacore.useSharedPandaApp()
+
+def _runJob(ordered_args):
+    """Runs a job in a worker, returning its (start, end, error) however it
+    ends, since the pool only calls back for jobs that return"""
+    start = time.time()
+    try:
+        FilterChain(ordered_args).run(cache=_worker_cache)
+    except ChainError, e:
+        return (start, time.time(), str(e))
+    except BaseException, e:
+        # including SystemExit, which would end the worker without a result
+        traceback.print_exc()
+        return (start, time.time(), "unexpected %s: %s" % (type(e).__name__, str(e)))
+    return (start, time.time(), None)
+
+class JobQueue(object):
+    """Runs filter chains on a bounded pool of worker processes, keeping
+    track of each job's state and timing"""
+
+    def __init__(self, workers=None, max_queued=100, cache=None, timeout=None):
+        """
+        :param workers: Number of worker processes. Defaults to the number of CPUs.
+        :param max_queued: Number of jobs that can be waiting for a worker
+                           before new ones are refused
+        :param cache: An optional :class:`meshtool.cache.ResultCache` for the workers to use
+        :param timeout: Seconds a job has from being submitted to finish
+                        before it's marked as failed, which is also how a
+                        job whose worker died is found. A worker running a
+                        job that timed out stays busy until it finishes.
+                        None waits forever.
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.max_queued = max_queued
+        self.pool = multiprocessing.Pool(workers, _initWorker, (cache,))
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.finished = collections.deque()
+        self.next_id = itertools.count(1)
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.started = time.time()
+        self.timeout = timeout
+        self.closing = threading.Event()
+        if timeout is not None:
+            reaper = threading.Thread(target=self._reap)
+            reaper.daemon = True
+            reaper.start()
+
+    def queueDepth(self):
+        """Number of submitted jobs that are waiting for a worker"""
+        return max(0, self.pending - self.workers)
+
+    def submit(self, ordered_args):
+        """Queues a chain to run, returning the new job's state
+
+        :raises: :class:`QueueFullError` if the queue is full
+        """
+        with self.lock:
+            if self.queueDepth() >= self.max_queued:
+                raise QueueFullError("queue is full (%d jobs waiting)" % self.queueDepth())
+            job_id = str(self.next_id.next())
+            job = {'id': job_id,
+                   'state': 'queued',
+                   'arguments': ordered_args,
+                   'submitted': time.time(),
+                   'done': threading.Event()}
+            self.jobs[job_id] = job
+            self.pending += 1
+        self.pool.apply_async(_runJob, (ordered_args,),
+                              callback=lambda result: self._finish(job_id, result))
+        return job
+
+    def _finish(self, job_id, result):
+        """Records the (start, end, error) of a job, unless it has already
+        finished, as a job that timed out has if it ever returns"""
+        start, end, error = result
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['done'].is_set():
+                return
+            if start is None:
+                # never reported starting
+                start = end
+            job['state'] = 'failed' if error is not None else 'succeeded'
+            job['error'] = error
+            job['queue_seconds'] = max(0.0, start - job['submitted'])
+            job['run_seconds'] = end - start
+            self.pending -= 1
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.total_seconds += end - start
+            self.finished.append(job_id)
+            while len(self.finished) > MAX_FINISHED_JOBS:
+                del self.jobs[self.finished.popleft()]
+            job['done'].set()
+
+    def _reap(self):
+        """Fails the jobs that have run out of time, until closed"""
+        while not self.closing.wait(min(REAP_INTERVAL, self.timeout)):
+            now = time.time()
+            with self.lock:
+                expired = [job_id for job_id, job in self.jobs.iteritems()
+                           if not job['done'].is_set() and now - job['submitted'] > self.timeout]
+            for job_id in expired:
+                self._finish(job_id, (None, now, "timed out after %gs" % self.timeout))
+
+    def getJob(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return dict((k, v) for k, v in job.iteritems() if k != 'done')
+
+    def wait(self, job_id, timeout=None):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            job['done'].wait(timeout)
+        return self.getJob(job_id)
+
+    def getStats(self):
+        with self.lock:
+            finished = self.completed + self.failed
+            return {'workers': self.workers,
+                    'queue_depth': self.queueDepth(),
+                    'max_queued': self.max_queued,
+                    'running': self.pending - self.queueDepth(),
+                    'succeeded': self.completed,
+                    'failed': self.failed,
+                    'mean_run_seconds': self.total_seconds / finished if finished > 0 else None,
+                    'uptime': time.time() - self.started}
+
+    def close(self):
+        self.closing.set()
+        self.pool.close()
+        self.pool.join()
+
+def parseJob(parser, request):
+    """Turns a job request into the arguments for a :class:`FilterChain`.
+
+    A request is a dict with the keys:
+      - input: path of the file to load
+      - output: path to save to, optional
+      - chain: list of command line arguments, e.g.
+        ["--load_obj", "{input}", "--medium_optimizations", "--save_collada", "{output}"]
+
+    The chain is a template, filled in like the arguments of a batch run with
+    {output} added.
+
+    :raises: :class:`JobError` if the request isn't valid
+    """
+    if not isinstance(request, dict):
+        raise JobError("request must be a JSON object")
+    input_path = request.get('input')
+    argv = request.get('chain')
+    if not isinstance(input_path, basestring):
+        raise JobError("request must give an input path")
+    if not isinstance(argv, list) or not all(isinstance(a, basestring) for a in argv):
+        raise JobError("request must give the filter chain as a list of strings")
+    try:
+        args = parser.parse_args([str(a) for a in argv])
+    except SystemExit:
+        # argparse has already printed why
+        raise JobError("invalid filter arguments")
+    if not 'ordered_args' in args:
+        raise JobError("no filters given")
+
+    for filter_name, arguments in args.ordered_args:
+        descriptor = factory.getDescriptor(filter_name)
+        if descriptor.CATEGORY == 'Visualizations':
+            raise JobError("filter '%s' needs a window and can't be run by the server" % filter_name)
+
+    fields = templateFields(input_path)
+    fields['output'] = request.get('output') or ''
+    try:
+        chain = FilterChain(args.ordered_args).format(**fields)
+    except ChainUsageError, e:
+        raise JobError(str(e))
+    except (KeyError, ValueError, IndexError), e:
+        raise JobError("invalid template in filter arguments: %s" % str(e))
+    return chain.ordered_args
+
+class JobRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles:
+      - POST /jobs to submit a job. If the request has "wait": true, the
+        response is sent once the job is done.
+      - GET /jobs/<id> to get the state and timing of a job
+      - GET /stats for queue depth, worker count and timing totals
+    """
+
+    def sendJSON(self, code, obj):
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.sendJSON(200, self.server.queue.getStats())
+        elif self.path.startswith('/jobs/'):
+            job = self.server.queue.getJob(self.path[len('/jobs/'):])
+            if job is None:
+                self.sendJSON(404, {'error': 'no such job'})
+            else:
+                self.sendJSON(200, job)
+        else:
+            self.sendJSON(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self.sendJSON(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.getheader('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.sendJSON(400, {'error': 'request body must be JSON'})
+            return
+        try:
+            ordered_args = parseJob(self.server.parser, request)
+            job = self.server.queue.submit(ordered_args)
+        except QueueFullError, e:
+            self.sendJSON(503, {'error': str(e)})
+            return
+        except JobError, e:
+            self.sendJSON(400, {'error': str(e)})
+            return
+        if request.get('wait'):
+            self.sendJSON(200, self.server.queue.wait(job['id']))
+        else:
+            self.sendJSON(202, self.server.queue.getJob(job['id']))
+
+    def log_message(self, format, *args):
+        # unix socket clients don't have an address
+        address = self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+        sys.stderr.write("%s - - [%s] %s\n" % (address, self.log_date_time_string(), format % args))
+
+class TCPJobServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class UnixJobServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+def makeServer(address, parser, queue):
+    """Creates a server listening on either a localhost port, given as
+    host:port or just port, or on a UNIX socket, given as a path"""
+    if ':' in address or address.isdigit():
+        host, _, port = address.rpartition(':')
+        server = TCPJobServer((host or 'localhost', int(port)), JobRequestHandler)
+    else:
+        if os.path.exists(address):
+            os.remove(address)
+        server = UnixJobServer(address, JobRequestHandler)
+    server.parser = parser
+    server.queue = queue
+    return server
+
+def serve(address, parser, workers=None, max_queued=100, cache=None, timeout=None):
+    """Runs jobs submitted to the given address until interrupted
+
+    :param address: host:port, port, or the path of a UNIX socket
+    :param parser: The command line parser, used to parse each job's filter chain
+    :param timeout: Passed to :class:`JobQueue`
+    """
+    queue = JobQueue(workers, max_queued, cache, timeout)
+    server = makeServer(address, parser, queue)
+    # stop cleanly when asked to by a service manager, as with ctrl-c
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print "Serving on %s with %d workers" % (address, queue.workers)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.close()
+        if isinstance(server, UnixJobServer):
+            os.remove(address)
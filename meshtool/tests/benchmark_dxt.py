@@ -0,0 +1,49 @@
+#benchmark: python meshtool/tests/benchmark_dxt.py [size]
+#times decoding size x size DXT textures with numpy, and with panda3d's
+#readDds if it's installed
+import sys
+import time
+import numpy
+from meshtool.util import Image, decodeDXT, loadDDS, saveDDS, DXT_BLOCK_SIZES
+
+def decodeWithPanda(data):
+    """Decodes a DDS file the way meshtool did before it had its own decoder"""
+    from panda3d.core import Texture, StringStream
+    tex = Texture()
+    if tex.readDds(StringStream(data)) == 0:
+        raise IOError('panda3d could not read the DDS file')
+    pixels = tex.getRamImageAs('RGBA').getData()
+    return Image.frombuffer('RGBA', (tex.getXSize(), tex.getYSize()), pixels, 'raw', 'RGBA', 0, 1)
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    megapixels = size * size / 1e6
+    numpy.random.seed(0)
+    try:
+        import panda3d.core
+        has_panda = True
+    except ImportError:
+        has_panda = False
+        print 'panda3d not installed, only timing the numpy decoder'
+
+    num_blocks = (size // 4) ** 2
+    for fourcc in ('DXT1', 'DXT3', 'DXT5'):
+        #random blocks hit every color and alpha mode
+        data = numpy.random.randint(0, 256, num_blocks * DXT_BLOCK_SIZES[fourcc]).astype(numpy.uint8).tostring()
+        start = time.time()
+        decodeDXT(data, size, size, fourcc)
+        elapsed = time.time() - start
+        print '%s decodeDXT %dx%d: %.3f seconds, %.1f MP/s' % (fourcc, size, size, elapsed, megapixels / elapsed)
+
+    #saveDDS can only encode these two
+    pixels = numpy.random.randint(0, 256, (size, size, 4)).astype(numpy.uint8)
+    for fourcc in ('DXT1', 'DXT5'):
+        dds = saveDDS([pixels], fourcc)
+        decoders = [('loadDDS', loadDDS)]
+        if has_panda:
+            decoders.append(('panda3d readDds', decodeWithPanda))
+        for name, decode in decoders:
+            start = time.time()
+            decode(dds)
+            elapsed = time.time() - start
+            print '%s %s %dx%d: %.3f seconds, %.1f MP/s' % (fourcc, name, size, size, elapsed, megapixels / elapsed)
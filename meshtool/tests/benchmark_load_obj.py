@@ -0,0 +1,15 @@
+#benchmark: python meshtool/tests/benchmark_load_obj.py [size]
+#times loading a size x size grid OBJ line by line and vectorized
+import sys
+import time
+from meshtool.filters.load_filters.load_obj import loadOBJ
+from test_obj import makeTestOBJ
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    data = makeTestOBJ(size)
+    print 'OBJ with %d vertices and %d faces, %.1f MB' % ((size + 1) ** 2, size * size, len(data) / 1e6)
+    for vectorized in (False, True):
+        start = time.time()
+        loadOBJ(data, vectorized=vectorized)
+        print '%s: %.3f seconds' % ('vectorized' if vectorized else 'line by line', time.time() - start)
@@ -0,0 +1,19 @@
+#benchmark: python meshtool/tests/benchmark_rectpack.py [num_rects]
+import sys
+import time
+import random
+from meshtool.filters.atlas_filters.rectpack import RectPack
+
+if __name__ == '__main__':
+    num_rects = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random.seed(0)
+    rp = RectPack()
+    for i in range(num_rects):
+        #chart sizes like sander_simplify makes, powers of 2 from 8 to 256
+        rp.addRectangle(i, 2 ** random.randint(3, 8), 2 ** random.randint(3, 8))
+    start = time.time()
+    rp.pack()
+    elapsed = time.time() - start
+    used = sum(w * h for w, h in rp.rectangles.itervalues())
+    print 'packed %d rectangles into %dx%d (%.1f%% used) in %.2f seconds' % \
+        (num_rects, rp.width, rp.height, 100.0 * used / (rp.width * rp.height), elapsed)
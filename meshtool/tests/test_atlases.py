@@ -0,0 +1,141 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+from StringIO import StringIO
+from meshtool.util import Image, isExternalImage
+from meshtool.filters.load_filters.load_obj import loadOBJ
+from meshtool.filters.atlas_filters.make_atlases import compositeImage, makeAtlases, makeSharedAtlases, \
+    getAtlasLayers, MAX_IMAGE_DIMENSION
+from meshtool.filters.base_filters import FilterException
+from meshtool.filters import factory
+import collada
+from meshtool.profiling import FilterProfiler, setActiveProfiler
+
+def makeMesh(textures):
+    """Makes a mesh with a square for each (name, color, tile) texture"""
+    obj = ['mtllib m.mtl']
+    mtl = []
+    files = {}
+    for i, (name, color, tile) in enumerate(textures):
+        buf = StringIO()
+        Image.new('RGB', (32, 16), color).save(buf, 'PNG')
+        files[name] = buf.getvalue()
+        mtl += ['newmtl m%d' % i, 'map_Kd %s' % name]
+        obj += ['v %d 0 0' % i, 'v %d 1 0' % i, 'v %d 1 1' % i]
+        obj += ['vt 0.2 0.2', 'vt %g 0.2' % (tile - 0.2), 'vt %g 0.8' % (tile - 0.2)]
+        obj += ['g g%d' % i, 'usemtl m%d' % i, 'f %d/%d %d/%d %d/%d' % ((3*i+1,) * 2 + (3*i+2,) * 2 + (3*i+3,) * 2)]
+    files['m.mtl'] = '\n'.join(mtl) + '\n'
+    return loadOBJ('\n'.join(obj) + '\n', aux_file_loader=files.get)
+
+class CompositeTester(unittest.TestCase):
+    def setUp(self):
+        # smooth enough that PIL never has to clip while resampling
+        y, x = numpy.mgrid[0:30, 0:50]
+        bands = [128 + 60 * numpy.sin(x / 4.0 + c) * numpy.cos(y / 5.0 - c) for c in range(3)]
+        self.src = Image.fromarray(numpy.dstack(bands).astype(numpy.uint8), 'RGB')
+
+    def tiled(self, tile_x, tile_y):
+        width, height = self.src.size
+        tiled = Image.new('RGB', (width * tile_x, height * tile_y))
+        for x in range(tile_x):
+            for y in range(tile_y):
+                tiled.paste(self.src, (x * width, y * height))
+        return tiled
+
+    def test_copy(self):
+        atlas = numpy.zeros((70, 110, 4), dtype=numpy.uint8)
+        compositeImage(atlas[5:65, 10:110], self.src, 2, 2)
+        expected = numpy.asarray(self.tiled(2, 2).convert('RGBA'))
+        self.assertTrue(numpy.array_equal(atlas[5:65, 10:110], expected))
+        self.assertFalse(atlas[:5].any())
+
+    def test_resample(self):
+        region = numpy.zeros((64, 128, 4), dtype=numpy.uint8)
+        compositeImage(region, self.src, 3, 3)
+        expected = numpy.asarray(self.tiled(3, 3).resize((128, 64), Image.ANTIALIAS).convert('RGBA'))
+        # the same as resizing the tiled image, except near the edges where
+        # the filter wraps around instead of stopping
+        diff = numpy.abs(region.astype(int) - expected)[8:-8, 8:-8]
+        self.assertLessEqual(diff.max(), 1)
+
+class SharedAtlasTester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def colors(self, mesh):
+        """Returns the color at the middle of each triangle's texture
+        coordinates, by the triangle's first x coordinate"""
+        colors = {}
+        for boundgeom in mesh.scene.objects('geometry'):
+            for boundprim in boundgeom.primitives():
+                cimg = boundprim.material.effect.diffuse.sampler.surface.image
+                if isExternalImage(cimg):
+                    data = open(os.path.join(self.directory, os.path.basename(cimg.path)), 'rb').read()
+                else:
+                    data = cimg.data
+                image = Image.open(StringIO(data))
+                u, v = boundprim.texcoordset[0][boundprim.texcoord_indexset[0]].reshape(-1, 2).mean(axis=0) % 1.0
+                x = int(boundprim.vertex[boundprim.vertex_index].reshape(-1, 3)[:, 0].min())
+                colors[x] = image.convert('RGB').getpixel((int(u * image.size[0]), int((1 - v) * image.size[1])))
+        return colors
+
+    def test_shared(self):
+        # the same two textures under different names, one tiled in only one mesh
+        mesh1 = makeMesh([('a.png', (255, 0, 0), 1), ('b.png', (0, 255, 0), 1), ('own.png', (0, 0, 255), 1)])
+        mesh2 = makeMesh([('x.png', (255, 0, 0), 1), ('y.png', (0, 255, 0), 2)])
+        expected = [self.colors(mesh1), self.colors(mesh2)]
+
+        names = makeSharedAtlases([mesh1, mesh2], self.directory, 'atlases')
+        self.assertEqual(names, ['shared-atlas-0.png'])
+        data = open(os.path.join(self.directory, names[0]), 'rb').read()
+        # the second texture is tiled twice for the second mesh
+        self.assertEqual(Image.open(StringIO(data)).size, (64, 32))
+        self.assertEqual(sorted(cimg.path for cimg in mesh1.images), ['./own.png', 'atlases/shared-atlas-0.png'])
+        self.assertEqual([cimg.path for cimg in mesh2.images], ['atlases/shared-atlas-0.png'])
+        # the page is only referred to, not copied into the meshes
+        self.assertTrue(isExternalImage(mesh2.images[0]))
+        self.assertIsNone(mesh2.images[0]._data)
+        self.assertEqual([self.colors(mesh1), self.colors(mesh2)], expected)
+
+class AtlasTester(unittest.TestCase):
+    def setUp(self):
+        self.profiler = FilterProfiler()
+        setActiveProfiler(self.profiler)
+
+    def tearDown(self):
+        setActiveProfiler(None)
+
+    def test_decodes(self):
+        mesh = makeMesh([('a.png', (255, 0, 0), 1), ('b.png', (0, 255, 0), 1), ('c.png', (0, 0, 255), 1)])
+        # too wide to be atlased
+        buf = StringIO()
+        Image.new('RGB', (MAX_IMAGE_DIMENSION + 1, 16), (0, 0, 255)).save(buf, 'PNG')
+        mesh.images[2].data = buf.getvalue()
+        pages = makeAtlases(mesh)
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(sorted(cimg.path for cimg in mesh.images), ['./atlas.png', './c.png'])
+        # planned from headers, so only the two packed images are decoded,
+        # and they're dropped once they're drawn
+        self.assertEqual(self.profiler.counters['texture_decodes'], 2)
+        self.assertEqual(len(mesh._texture_manager.textures), 0)
+
+    def test_same_size(self):
+        mesh = makeMesh([('a.png', (255, 0, 0), 1), ('b.png', (0, 255, 0), 1)])
+        make_atlas_pages = factory.getInstance('make_atlas_pages')
+        self.assertRaises(FilterException, make_atlas_pages.apply, mesh, '0', 'true')
+        self.assertRaises(FilterException, make_atlas_pages.apply, mesh, '1', 'maybe')
+        self.assertIsNone(getAtlasLayers(mesh))
+
+        make_atlas_pages.apply(mesh, '1', 'true')
+        self.assertEqual([cimg.path for cimg in mesh.images], ['./atlas.png'])
+        self.assertEqual(Image.open(StringIO(mesh.images[0].data)).size, (MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+        # the layer order is saved with the mesh
+        buf = StringIO()
+        mesh.write(buf)
+        saved = collada.Collada(StringIO(buf.getvalue()), aux_file_loader=lambda path: None)
+        self.assertEqual(getAtlasLayers(saved), [mesh.images[0].id])
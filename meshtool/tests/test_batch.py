@@ -0,0 +1,97 @@
+import unittest
+import os
+import shutil
+import zipfile
+import tempfile
+from StringIO import StringIO
+from meshtool.util import Image
+from meshtool.batch import readManifest, templateFields, runBatch, runSharedAtlasBatch
+from meshtool.pipeline import FilterChain, ChainUsageError
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+OBJDIR = os.path.join(CURDIR, 'data', 'obj')
+
+def writeOBJ(path, textures):
+    """Writes an OBJ file with a square for each texture, given as the
+    names of PNG files next to it, and its MTL file"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    obj = ['mtllib %s.mtl' % name]
+    mtl = []
+    for i, texture in enumerate(textures):
+        mtl += ['newmtl m%d' % i, 'map_Kd %s' % texture]
+        obj += ['v %d 0 0' % i, 'v %d 1 0' % i, 'v %d 1 1' % i, 'vt 0.2 0.2', 'vt 0.8 0.2', 'vt 0.8 0.8']
+        obj += ['g g%d' % i, 'usemtl m%d' % i, 'f %d/%d %d/%d %d/%d' % ((3*i+1,) * 2 + (3*i+2,) * 2 + (3*i+3,) * 2)]
+    directory = os.path.dirname(path)
+    open(os.path.join(directory, name + '.mtl'), 'w').write('\n'.join(mtl) + '\n')
+    open(path, 'w').write('\n'.join(obj) + '\n')
+
+class BatchTester(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_manifest(self):
+        for name in ['b.obj', 'a.obj', 'c.dae']:
+            open(os.path.join(self.tempdir, name), 'w').close()
+        self.assertEqual(readManifest(os.path.join(self.tempdir, '*.obj')),
+                         [os.path.join(self.tempdir, 'a.obj'), os.path.join(self.tempdir, 'b.obj')])
+        self.assertEqual(readManifest(os.path.join(self.tempdir, '*.png')), [])
+
+        manifest = os.path.join(self.tempdir, 'manifest.txt')
+        f = open(manifest, 'w')
+        f.write('# models to convert\nmodels/duck.obj\n\n  other/box.obj  \n')
+        f.close()
+        self.assertEqual(readManifest(manifest), ['models/duck.obj', 'other/box.obj'])
+
+    def test_fields(self):
+        self.assertEqual(templateFields('models/duck.obj'),
+                         {'input': 'models/duck.obj', 'dir': 'models', 'basename': 'duck.obj',
+                          'name': 'duck', 'ext': '.obj'})
+
+    def test_failure(self):
+        # loading the missing input raises a FilterException
+        missing = os.path.join(self.tempdir, 'missing.obj')
+        spider = os.path.join(OBJDIR, 'spider.obj')
+        chain = FilterChain([('load_obj', ['{input}']),
+                             ('save_collada', [os.path.join(self.tempdir, '{name}.dae')])])
+        out = StringIO()
+        results = runBatch(chain, [missing, spider], workers=1, out=out)
+
+        self.assertEqual([r.input_path for r in results], [missing, spider])
+        self.assertFalse(results[0].succeeded())
+        self.assertIn('not a valid file', results[0].error)
+        self.assertTrue(results[1].succeeded())
+        self.assertTrue(os.path.isfile(os.path.join(self.tempdir, 'spider.dae')))
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir, 'missing.dae')))
+        self.assertIn('Processed 2 files', out.getvalue())
+        self.assertIn('1 succeeded, 1 failed', out.getvalue())
+        self.assertIn('  %s: %s' % (missing, results[0].error), out.getvalue())
+
+    def test_shared_atlases(self):
+        colors = {'shared.png': (255, 0, 0), 'a.png': (0, 255, 0), 'b.png': (0, 0, 255)}
+        for texture, color in colors.iteritems():
+            Image.new('RGB', (32, 16), color).save(os.path.join(self.tempdir, texture))
+        inputs = [os.path.join(self.tempdir, 'a.obj'), os.path.join(self.tempdir, 'b.obj')]
+        writeOBJ(inputs[0], ['shared.png', 'a.png'])
+        writeOBJ(inputs[1], ['b.png', 'shared.png'])
+        atlas_dir = os.path.join(self.tempdir, 'atlases')
+        chain = FilterChain([('load_obj', ['{input}']),
+                             ('save_collada_zip', [os.path.join(self.tempdir, '{name}.zip')])])
+        results = runSharedAtlasBatch(chain, inputs, atlas_dir, 'http://example.com/atlases', out=StringIO())
+
+        self.assertTrue(all(r.succeeded() for r in results))
+        self.assertEqual(os.listdir(atlas_dir), ['shared-atlas-0.png'])
+        for name, own in [('a', 'a.png'), ('b', 'b.png')]:
+            z = zipfile.ZipFile(os.path.join(self.tempdir, name + '.zip'))
+            # the shared page isn't copied into each zip, only referred to
+            self.assertEqual(sorted(z.namelist()), sorted(['%s/%s' % (name, own), '%s/%s.dae' % (name, name)]))
+            dae = z.read('%s/%s.dae' % (name, name))
+            self.assertIn('http://example.com/atlases/shared-atlas-0.png', dae)
+            self.assertIn('./%s' % own, dae)
+
+        # each input would have its own atlas before the shared ones are made
+        chain = FilterChain([('load_obj', ['{input}']), ('make_atlases', []),
+                             ('save_collada_zip', ['{name}.zip'])])
+        self.assertRaises(ChainUsageError, runSharedAtlasBatch, chain, inputs, atlas_dir)
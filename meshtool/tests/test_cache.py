@@ -0,0 +1,121 @@
+import unittest
+import os
+import re
+import shutil
+import tempfile
+from meshtool.cache import ResultCache, chainKeys, auxiliaryText, auxiliaryFiles
+from meshtool.pipeline import FilterChain, ChainError
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+OBJDIR = os.path.join(CURDIR, 'data', 'obj')
+
+def withoutDates(dae_data):
+    return re.sub(r'<(created|modified)>[^<]*<', '', dae_data)
+
+class CacheTester(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.tempdir, 'cache'))
+        self.obj_spider = os.path.join(OBJDIR, 'spider.obj')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_keys(self):
+        args = [('load_obj', [self.obj_spider]),
+                ('triangulate', []),
+                ('save_collada', [os.path.join(self.tempdir, 'a.dae')]),
+                ('print_info', [])]
+        keys = chainKeys(args)
+        # stops at the print filter
+        self.assertEqual(len(keys), 3)
+        # where the output goes doesn't change the key, but its name does
+        args[2] = ('save_collada', [os.path.join(self.tempdir, 'other', 'a.dae')])
+        self.assertEqual(chainKeys(args), keys)
+        args[2] = ('save_collada', [os.path.join(self.tempdir, 'b.dae')])
+        self.assertEqual(chainKeys(args)[:2], keys[:2])
+        self.assertNotEqual(chainKeys(args)[2], keys[2])
+
+    def test_texture_changes_key(self):
+        # copy the spider so one of its textures can be changed
+        objdir = os.path.join(self.tempdir, 'obj')
+        shutil.copytree(OBJDIR, objdir)
+        obj_path = os.path.join(objdir, 'spider.obj')
+        key = chainKeys([('load_obj', [obj_path])])[0]
+        f = open(os.path.join(objdir, 'SpiderTex.jpg'), 'ab')
+        f.write('changed')
+        f.close()
+        self.assertNotEqual(chainKeys([('load_obj', [obj_path])])[0], key)
+
+    def test_auxiliary_text(self):
+        dae_path = os.path.join(self.tempdir, 'spider.dae')
+        FilterChain([('load_obj', [self.obj_spider]), ('save_collada', [dae_path])]).run()
+        for load_filter_name, path in [('load_obj', self.obj_spider), ('load_collada', dae_path)]:
+            data = open(path, 'rb').read()
+            text = auxiliaryText(load_filter_name, [data])
+            # markers split across chunks are still found
+            chunks = [data[i:i+7] for i in range(0, len(data), 7)]
+            self.assertEqual(auxiliaryText(load_filter_name, chunks), text)
+            self.assertLess(len(text), len(data) / 10)
+        self.assertEqual(auxiliaryFiles('load_obj', self.obj_spider, auxiliaryText('load_obj', [open(self.obj_spider).read()])),
+                         ['spider.mtl', r'.\wal67ar_small.jpg', r'.\wal69ar_small.jpg', r'.\SpiderTex.jpg',
+                          r'.\drkwood2.jpg', r'.\engineflare1.jpg'])
+        # only the images' paths, not the surfaces that refer to the images
+        self.assertEqual(sorted(auxiliaryFiles('load_collada', dae_path, text)),
+                         ['./SpiderTex.jpg', './drkwood2.jpg', './engineflare1.jpg', './wal67ar_small.jpg', './wal69ar_small.jpg'])
+
+    def test_restore(self):
+        out_path = os.path.join(self.tempdir, 'out.dae')
+        chain = FilterChain([('load_obj', [self.obj_spider]),
+                             ('medium_optimizations', []),
+                             ('save_collada', [out_path])])
+        mesh = chain.run(cache=self.cache)
+        self.assertIsNotNone(mesh)
+        expected = open(out_path, 'rb').read()
+        os.remove(out_path)
+
+        # everything is restored, including the output file
+        self.assertIsNone(chain.run(cache=self.cache))
+        self.assertEqual(open(out_path, 'rb').read(), expected)
+
+        # like running the save filter, restoring doesn't overwrite a file
+        f = open(out_path, 'wb')
+        f.write('mine')
+        f.close()
+        self.assertRaises(ChainError, chain.run, cache=self.cache)
+        self.assertEqual(open(out_path, 'rb').read(), 'mine')
+
+        # a different tail picks up from the stored mesh
+        tail = FilterChain([('load_obj', [self.obj_spider]),
+                            ('medium_optimizations', []),
+                            ('strip_lines', [])])
+        mesh = tail.run(cache=self.cache)
+        self.assertEqual(len(mesh.images), 5)
+        self.assertEqual(mesh.filename, self.obj_spider)
+
+    def test_stream(self):
+        stream_path = os.path.join(self.tempdir, 'stream.dae')
+        FilterChain([('load_obj', [self.obj_spider]), ('save_collada', [stream_path])]).run(stream=True)
+        out_path = os.path.join(self.tempdir, 'out.dae')
+        chain = FilterChain([('load_obj', [self.obj_spider]), ('save_collada', [out_path])])
+        chain.run()
+        expected = withoutDates(open(out_path, 'rb').read())
+        self.assertNotEqual(withoutDates(open(stream_path, 'rb').read()), expected)
+        os.remove(out_path)
+
+        # a streamed result isn't restored for a run that doesn't stream
+        chain.run(cache=self.cache, stream=True)
+        os.remove(out_path)
+        self.assertIsNotNone(chain.run(cache=self.cache))
+        self.assertEqual(withoutDates(open(out_path, 'rb').read()), expected)
+
+    def test_eviction(self):
+        cache = ResultCache(os.path.join(self.tempdir, 'small'), max_size=150)
+        cache.put('a', {'data': 'x' * 100})
+        os.utime(cache._path('a'), (0, 0))
+        cache.put('b', {'data': 'y' * 100})
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), {'data': 'y' * 100})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+import collada
+import numpy
+from meshtool.filters.load_filters.load_obj import loadOBJFromFile, filepath_loader
+from meshtool.filters.load_filters.stream_collada import loadColladaStreamed
+
+class ColladaTester(unittest.TestCase):
+    def setUp(self):
+        obj_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'obj')
+        self.tempdir = tempfile.mkdtemp()
+        shutil.copytree(obj_dir, os.path.join(self.tempdir, 'obj'))
+        self.obj_dir = os.path.join(self.tempdir, 'obj')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def saveOBJ(self, name):
+        obj_path = os.path.join(self.obj_dir, name + '.obj')
+        dae_path = os.path.join(self.obj_dir, name + '.dae')
+        loadOBJFromFile(obj_path, aux_file_loader=filepath_loader(obj_path)).write(dae_path)
+        return dae_path
+
+    def test_streamed(self):
+        # loads the same mesh and writes the same document as pycollada
+        for name in ['spider', 'regr01', 'testline', 'testmixed']:
+            dae_path = self.saveOBJ(name)
+            loaded = collada.Collada(dae_path)
+            streamed = loadColladaStreamed(dae_path)
+            for geom1, geom2 in zip(loaded.geometries, streamed.geometries):
+                self.assertEqual(len(geom1.primitives), len(geom2.primitives))
+                for prim1, prim2 in zip(geom1.primitives, geom2.primitives):
+                    self.assertIs(type(prim1), type(prim2))
+                    self.assertTrue(numpy.array_equal(prim1.index, prim2.index))
+                    self.assertTrue(numpy.array_equal(prim1.vertex, prim2.vertex))
+            self.assertEqual([i.data for i in loaded.images], [i.data for i in streamed.images])
+
+            out1 = StringIO()
+            loaded.write(out1)
+            out2 = StringIO()
+            streamed.write(out2)
+            self.assertEqual(out1.getvalue(), out2.getvalue())
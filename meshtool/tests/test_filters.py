@@ -0,0 +1,29 @@
+import unittest
+import sys
+from meshtool.filters import factory
+
+class FilterRegistryTester(unittest.TestCase):
+    def test_descriptors_match_filters(self):
+        # building the parser only uses descriptors, so they have to stay in sync
+        # with what each filter module actually registers
+        for name in factory.getFilterNames():
+            descriptor = factory.getDescriptor(name)
+            self.assertEqual(descriptor.name, name)
+
+            inst = factory.getInstance(name)
+            if inst is None:
+                # optional dependency not installed
+                continue
+            self.assertEqual(inst.name, descriptor.name)
+            self.assertEqual(inst.CATEGORY, descriptor.CATEGORY)
+            self.assertEqual(inst.description, descriptor.description)
+            self.assertEqual([(a.name, a.description, type(a)) for a in inst.arguments],
+                             [(a.name, a.description, type(a)) for a in descriptor.arguments])
+
+    def test_lazy_import(self):
+        descriptor = factory.getDescriptor('print_bounds')
+        self.assertIsNotNone(descriptor)
+        inst = factory.getInstance('print_bounds')
+        self.assertIsNotNone(inst)
+        self.assertIn(descriptor.module, sys.modules)
+        self.assertIsNone(factory.getInstance('not_a_real_filter'))
@@ -0,0 +1,51 @@
+import unittest
+import os
+import shutil
+import tarfile
+import tempfile
+from StringIO import StringIO
+from meshtool.util import Image
+from meshtool.filters.load_filters.load_obj import loadOBJFromFile, filepath_loader
+from meshtool.filters.optimize_filters.save_mipmaps import saveMipMaps
+from meshtool import mipmaps
+
+class MipMapTester(unittest.TestCase):
+    def setUp(self):
+        obj_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'obj')
+        self.tempdir = tempfile.mkdtemp()
+        shutil.copytree(obj_dir, os.path.join(self.tempdir, 'obj'))
+        obj_path = os.path.join(self.tempdir, 'obj', 'spider.obj')
+        self.mesh = loadOBJFromFile(obj_path, aux_file_loader=filepath_loader(obj_path))
+        self.mesh.filename = os.path.join(self.tempdir, 'obj', 'spider.dae')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_index(self):
+        self.assertTrue(saveMipMaps(self.mesh))
+        for cimg in self.mesh.images:
+            tar_path = os.path.normpath(os.path.join(self.tempdir, 'obj', cimg.path)) + '.tar'
+            tar = tarfile.open(tar_path)
+            members = dict((m.name, tar.extractfile(m).read()) for m in tar)
+
+            # a stand-in for HTTP Range requests that records what was fetched
+            fetched = []
+            fetch_file = mipmaps.fileRangeFetcher(tar_path)
+            def fetch(offset, length):
+                fetched.append((offset, length))
+                return fetch_file(offset, length)
+
+            reader = mipmaps.openFile(tar_path)
+            reader.fetch = fetch
+            self.assertEqual(len(reader.levels), len(members))
+            for level in reader.levels:
+                data = reader.read(level['width'], level['height'])
+                self.assertEqual(fetched[-1], (level['offset'], level['length']))
+                self.assertEqual(data, members['%dx%d.jpg' % (level['width'], level['height'])])
+                self.assertEqual(Image.open(StringIO(data)).size, (level['width'], level['height']))
+
+            # sizes between levels round up, and past the largest give the largest
+            largest = reader.levels[-1]
+            self.assertEqual(reader.getLevel(3)['width'], 4)
+            self.assertIs(reader.getLevel(largest['width'] * 2), largest)
+            self.assertEqual(len(fetched), len(members))
@@ -1,12 +1,40 @@
 import unittest
 import os
+import shutil
+import tempfile
 import collada
-from meshtool.filters.load_filters.load_obj import loadOBJ, filepath_loader
+import numpy
+from meshtool.filters.load_filters import load_obj
+from meshtool.filters.load_filters.load_obj import loadOBJ, loadOBJFromFile, filepath_loader
+from meshtool.pipeline import FilterChain
+from meshtool.filters import factory
+from meshtool import meshcache
 
 CURDIR = os.path.dirname(os.path.abspath(__file__))
 DATADIR = os.path.join(CURDIR, 'data')
 OBJDIR = os.path.join(DATADIR, 'obj')
 
+def makeTestOBJ(size):
+    """Returns the text of an OBJ file of a size x size grid of quads with
+    normals and texture coordinates, split into a few groups and materials"""
+    lines = []
+    for y in range(size + 1):
+        for x in range(size + 1):
+            lines.append("v %f %f %f" % (x, y, (x * y) % 7 / 7.0))
+            lines.append("vt %f %f" % (float(x) / size, float(y) / size))
+    lines.append("vn 0 0 1")
+    for y in range(size):
+        if y % (size // 4 or 1) == 0:
+            lines.append("g part%d" % y)
+            lines.append("usemtl material%d" % (y % 3))
+        for x in range(size):
+            a = y * (size + 1) + x + 1
+            b = a + 1
+            c = a + size + 2
+            d = a + size + 1
+            lines.append("f %d/%d/1 %d/%d/1 %d/%d/1 %d/%d/1" % (a, a, b, b, c, c, d, d))
+    return "\n".join(lines) + "\n"
+
 class ObjTester(unittest.TestCase):
     def setUp(self):
         self.obj_box = os.path.join(OBJDIR, 'box.obj')
@@ -173,4 +201,106 @@ class ObjTester(unittest.TestCase):
         self.assertEqual(len(poly), 6)
         
         col.save()
-    
\ No newline at end of file
+    
+        
+    def assertSameMesh(self, col1, col2):
+        self.assertEqual(len(col1.geometries), len(col2.geometries))
+        for geom1, geom2 in zip(col1.geometries, col2.geometries):
+            self.assertEqual(geom1.id, geom2.id)
+            self.assertEqual(len(geom1.primitives), len(geom2.primitives))
+            for prim1, prim2 in zip(geom1.primitives, geom2.primitives):
+                self.assertIs(type(prim1), type(prim2))
+                self.assertEqual(prim1.material, prim2.material)
+                self.assertTrue(numpy.array_equal(prim1.index, prim2.index))
+                self.assertTrue(numpy.array_equal(prim1.vertex, prim2.vertex))
+                if prim1.normal is None:
+                    self.assertIsNone(prim2.normal)
+                else:
+                    self.assertTrue(numpy.array_equal(prim1.normal, prim2.normal))
+                self.assertEqual(len(prim1.texcoordset), len(prim2.texcoordset))
+                for tex1, tex2 in zip(prim1.texcoordset, prim2.texcoordset):
+                    self.assertTrue(numpy.array_equal(tex1, tex2))
+        self.assertEqual(sorted(m.id for m in col1.materials), sorted(m.id for m in col2.materials))
+        self.assertEqual([i.path for i in col1.images], [i.path for i in col2.images])
+    
+    def test_vectorized(self):
+        for filename in [self.obj_box, self.obj_spider, self.obj_regr01, self.obj_testline,
+                         self.obj_testpoints, self.obj_testmixed]:
+            data = open(filename, 'rb').read()
+            vectorized = loadOBJ(data, aux_file_loader=filepath_loader(filename), vectorized=True)
+            by_line = loadOBJ(data, aux_file_loader=filepath_loader(filename), vectorized=False)
+            self.assertSameMesh(vectorized, by_line)
+        
+        data = makeTestOBJ(20)
+        self.assertSameMesh(loadOBJ(data, vectorized=True), loadOBJ(data, vectorized=False))
+        
+        # indented records and extra vertex values fall back to reading line by line
+        data = "v 0 0 0 1\n v 1 0 0\nv 1 1 0 0.5 0.5 0.5\nf 1 2 3\n"
+        self.assertSameMesh(loadOBJ(data, vectorized=True), loadOBJ(data, vectorized=False))
+    
+    def test_windows(self):
+        # read the file from an mmap a few hundred bytes at a time, so groups and
+        # faces span several windows
+        by_line = loadOBJ(open(self.obj_spider, 'rb').read(), aux_file_loader=filepath_loader(self.obj_spider),
+                          vectorized=False)
+        window_size = load_obj.OBJ_WINDOW_SIZE
+        load_obj.OBJ_WINDOW_SIZE = 500
+        try:
+            windowed = loadOBJFromFile(self.obj_spider)
+            parallel = loadOBJFromFile(self.obj_spider, processes=2)
+        finally:
+            load_obj.OBJ_WINDOW_SIZE = window_size
+        self.assertSameMesh(windowed, by_line)
+        self.assertSameMesh(parallel, by_line)
+    
+    def test_convert(self):
+        # converting straight to COLLADA gives the same mesh as loading the OBJ
+        tempdir = tempfile.mkdtemp()
+        try:
+            grid_path = os.path.join(tempdir, 'grid.obj')
+            f = open(grid_path, 'wb')
+            f.write(makeTestOBJ(20))
+            f.close()
+            for obj_path in [self.obj_spider, self.obj_regr01, grid_path]:
+                out_path = os.path.join(tempdir, os.path.basename(obj_path) + '.dae')
+                chain = FilterChain([('load_obj', [obj_path]), ('save_collada', [out_path])])
+                self.assertIsNone(chain.run(stream=True))
+                streamed = collada.Collada(out_path, aux_file_loader=filepath_loader(obj_path))
+                self.assertSameMesh(streamed, loadOBJFromFile(obj_path))
+                self.assertEqual(len(streamed.images), len(loadOBJFromFile(obj_path).images))
+            
+            # lines are loaded as usual
+            out_path = os.path.join(tempdir, 'line.dae')
+            self.assertIsNotNone(FilterChain([('load_obj', [self.obj_testline]), ('save_collada', [out_path])]).run(stream=True))
+            self.assertTrue(os.path.isfile(out_path))
+            
+            # and so is everything unless streaming is asked for
+            out_path = os.path.join(tempdir, 'grid.dae')
+            self.assertIsNotNone(FilterChain([('load_obj', [grid_path]), ('save_collada', [out_path])]).run())
+            self.assertTrue(os.path.isfile(out_path))
+        finally:
+            shutil.rmtree(tempdir)
+    
+    def test_meshcache(self):
+        # the second load comes from the sidecar, until a texture changes
+        tempdir = tempfile.mkdtemp()
+        meshcache.setEnabled(True)
+        try:
+            obj_dir = os.path.join(tempdir, 'obj')
+            shutil.copytree(os.path.dirname(self.obj_spider), obj_dir)
+            obj_path = os.path.join(obj_dir, os.path.basename(self.obj_spider))
+            loader = factory.getInstance('load_obj')
+            loaded = loader.apply(obj_path)
+            self.assertTrue(os.path.isfile(meshcache.sidecarPath(obj_path)))
+            cached = meshcache.readSidecar(obj_path, 'load_obj', load_obj.filepath_resolver(obj_path))
+            self.assertIsNotNone(cached)
+            self.assertSameMesh(cached, loaded)
+            self.assertEqual([i.data for i in cached.images], [i.data for i in loaded.images])
+            
+            texture_path = os.path.join(obj_dir, 'SpiderTex.jpg')
+            st = os.stat(texture_path)
+            os.utime(texture_path, (st.st_atime, st.st_mtime + 10))
+            self.assertIsNone(meshcache.readSidecar(obj_path, 'load_obj', load_obj.filepath_resolver(obj_path)))
+        finally:
+            meshcache.setEnabled(False)
+            shutil.rmtree(tempdir)
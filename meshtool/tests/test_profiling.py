@@ -0,0 +1,64 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from meshtool.pipeline import FilterChain
+from meshtool.profiling import FilterProfiler
+from meshtool import profiling
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+OBJDIR = os.path.join(CURDIR, 'data', 'obj')
+
+class ProfilerTester(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_report(self):
+        chain = FilterChain([('load_obj', [os.path.join(OBJDIR, 'box.obj')]),
+                             ('triangulate', []),
+                             ('save_collada', [os.path.join(self.tempdir, 'box.dae')])])
+        profiler = FilterProfiler()
+        chain.run(profiler)
+        report_path = os.path.join(self.tempdir, 'profile.json')
+        profiler.save(report_path)
+        report = json.load(open(report_path))
+
+        self.assertEqual([r['name'] for r in report['filters']], ['load_obj', 'triangulate', 'save_collada'])
+        load, triangulate, save = report['filters']
+        self.assertEqual(load['triangles_before'], None)
+        self.assertEqual(triangulate['triangles_before'], load['triangles_after'])
+        self.assertEqual(triangulate['triangles_after'], 12)
+        self.assertEqual(save['arguments'], [os.path.join(self.tempdir, 'box.dae')])
+        for record in report['filters']:
+            self.assertGreaterEqual(record['wall_time'], 0)
+            self.assertGreaterEqual(record['peak_rss_growth'], 0)
+            self.assertLessEqual(record['process_peak_rss'], report['process_peak_rss'])
+        self.assertAlmostEqual(report['total_wall_time'], sum(r['wall_time'] for r in report['filters']))
+
+    def test_sections(self):
+        profiler = FilterProfiler()
+        profiler.begin('outer')
+        profiling.setActiveProfiler(profiler)
+        try:
+            profiling.beginSection('inner')
+            profiling.count('things', 2)
+            profiling.endSection()
+            profiling.count('things')
+        finally:
+            profiling.setActiveProfiler(None)
+        profiler.end(counts=False)
+
+        report = json.loads(profiler.getJSON())
+        outer = report['filters'][0]
+        inner = outer['children'][0]
+        self.assertEqual(inner['name'], 'inner')
+        self.assertEqual(inner['counters'], {'things': 2})
+        self.assertEqual(outer['counters'], {'things': 1})
+        self.assertEqual(report['counters'], {'things': 3})
+        # the outer record covers the inner one
+        self.assertGreaterEqual(outer['peak_rss_growth'], inner['peak_rss_growth'])
+        self.assertGreaterEqual(outer['process_peak_rss'], inner['process_peak_rss'])
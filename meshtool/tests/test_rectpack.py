@@ -0,0 +1,67 @@
+import unittest
+import random
+import numpy
+from meshtool.filters.atlas_filters.rectpack import RectPack
+
+class RectPackTester(unittest.TestCase):
+    def assertValidPlacements(self, rp, keys, width, height):
+        used = numpy.zeros((height, width), dtype=numpy.bool_)
+        for key in keys:
+            x, y, w, h = rp.getPlacement(key)
+            self.assertEqual((w, h), rp.rectangles[key])
+            # aligned so that no rectangle crosses a power of 2 boundary
+            self.assertEqual((x % w, y % h), (0, 0))
+            self.assertTrue(x + w <= width and y + h <= height)
+            self.assertFalse(used[y:y+h, x:x+w].any())
+            used[y:y+h, x:x+w] = True
+
+    def assertValidPacking(self, rp):
+        self.assertValidPlacements(rp, rp.placements, rp.width, rp.height)
+        self.assertEqual(set(rp.placements) | set(rp.rejects), set(rp.rectangles))
+
+    def test_pack(self):
+        random.seed(0)
+        rp = RectPack()
+        for i in range(500):
+            rp.addRectangle(i, random.randint(1, 64), random.randint(1, 64))
+        self.assertTrue(rp.pack())
+        self.assertValidPacking(rp)
+        for size in (rp.width, rp.height):
+            self.assertEqual(size & (size - 1), 0)
+
+        # squares of powers of 2 pack with no gaps
+        rp = RectPack()
+        for i in range(16):
+            rp.addRectangle(i, 8, 8)
+        rp.addRectangle('big', 32, 32)
+        self.assertTrue(rp.pack())
+        self.assertValidPacking(rp)
+        self.assertEqual(rp.width * rp.height, 2048)
+
+    def test_rejects(self):
+        rp = RectPack(64, 64)
+        for i in range(5):
+            rp.addRectangle(i, 32, 32)
+        rp.addRectangle('wide', 128, 4)
+        self.assertFalse(rp.pack())
+        self.assertValidPacking(rp)
+        self.assertEqual((rp.width, rp.height), (64, 64))
+        self.assertEqual(len(rp.rejects), 2)
+        self.assertIn('wide', rp.rejects)
+
+    def test_pages(self):
+        rp = RectPack(64, 64)
+        for i in range(9):
+            rp.addRectangle(i, 32, 32)
+        rp.addRectangle('small', 16, 16)
+        self.assertTrue(rp.packPages())
+        # the small one fills in the first page that has room
+        self.assertEqual([(w, h, len(keys)) for w, h, keys in rp.pages],
+                         [(64, 64, 4), (64, 64, 4), (64, 32, 2)])
+        self.assertEqual(rp.getPage('small'), 2)
+        for width, height, keys in rp.pages:
+            self.assertValidPlacements(rp, keys, width, height)
+
+        self.assertFalse(rp.packPages(maxpages=2, samesize=True))
+        self.assertEqual([(w, h) for w, h, keys in rp.pages], [(64, 64), (64, 64)])
+        self.assertEqual(len(rp.rejects), 2)
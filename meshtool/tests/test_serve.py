@@ -0,0 +1,68 @@
+import unittest
+import os
+import shutil
+import tempfile
+from meshtool.__main__ import makeParser
+from meshtool.serve import JobQueue, JobError, parseJob
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+OBJDIR = os.path.join(CURDIR, 'data', 'obj')
+
+class ParseJobTester(unittest.TestCase):
+    def setUp(self):
+        self.parser = makeParser()
+
+    def test_template(self):
+        request = {'input': 'models/duck.obj', 'output': 'out/duck.dae',
+                   'chain': ['--load_obj', '{input}', '--save_collada', '{dir}/{name}-{output}']}
+        self.assertEqual(parseJob(self.parser, request),
+                         [('load_obj', ['models/duck.obj']),
+                          ('save_collada', ['models/duck-out/duck.dae'])])
+
+    def test_invalid(self):
+        chain = ['--load_obj', '{input}', '--print_info']
+        for request in [[], {'chain': chain}, {'input': 'a.obj', 'chain': '--print_info'},
+                        {'input': 'a.obj', 'chain': []}, {'input': 'a.obj', 'chain': ['--load_obj', '{nope}']}]:
+            self.assertRaises(JobError, parseJob, self.parser, request)
+
+class JobQueueTester(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.queue = JobQueue(workers=1, timeout=60)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_jobs(self):
+        output = os.path.join(self.tempdir, 'spider.dae')
+        failing = self.queue.submit([('load_obj', [os.path.join(self.tempdir, 'missing.obj')]),
+                                     ('save_collada', [output])])
+        succeeding = self.queue.submit([('load_obj', [os.path.join(OBJDIR, 'spider.obj')]),
+                                        ('save_collada', [output])])
+        failed = self.queue.wait(failing['id'], 60)
+        self.assertEqual(failed['state'], 'failed')
+        self.assertIn('not a valid file', failed['error'])
+        succeeded = self.queue.wait(succeeding['id'], 60)
+        self.assertEqual(succeeded['state'], 'succeeded')
+        self.assertIsNone(succeeded['error'])
+        self.assertTrue(os.path.isfile(output))
+
+        stats = self.queue.getStats()
+        self.assertEqual((stats['succeeded'], stats['failed']), (1, 1))
+        self.assertEqual((stats['queue_depth'], stats['running']), (0, 0))
+
+    def test_timeout(self):
+        # far less time than loading the spider takes
+        queue = JobQueue(workers=1, timeout=0.001)
+        output = os.path.join(self.tempdir, 'spider.dae')
+        job = queue.submit([('load_obj', [os.path.join(OBJDIR, 'spider.obj')]),
+                            ('save_collada', [output])])
+        timed_out = queue.wait(job['id'], 60)
+        self.assertEqual(timed_out['state'], 'failed')
+        self.assertIn('timed out', timed_out['error'])
+        # the job still finishes, but is left as it was
+        queue.close()
+        self.assertTrue(os.path.isfile(output))
+        self.assertEqual(queue.getJob(job['id']), timed_out)
+        self.assertEqual(queue.getStats()['succeeded'], 0)
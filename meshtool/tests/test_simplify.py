@@ -0,0 +1,98 @@
+import unittest
+import os
+import numpy
+import networkx as nx
+from meshtool.filters.load_filters.load_obj import loadOBJFromFile
+from meshtool.filters import factory
+from meshtool.filters.simplify_filters.sander_simplify import uniqify_multidim_indexes
+from meshtool.filters.simplify_filters.connectivity import MeshConnectivity
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+OBJDIR = os.path.join(CURDIR, 'data', 'obj')
+
+def loadTriangles(filename):
+    """Returns the vertices and triangles of an OBJ file with identical
+    vertices merged, like SanderSimplify.uniqify_list does"""
+    mesh = factory.getInstance('triangulate').apply(loadOBJFromFile(filename))
+    vertices = []
+    tris = []
+    offset = 0
+    for boundgeom in mesh.scene.objects('geometry'):
+        for boundprim in boundgeom.primitives():
+            if boundprim.vertex_index is None or len(boundprim.vertex_index) == 0:
+                continue
+            vertices.append(boundprim.vertex)
+            tris.append(boundprim.vertex_index + offset)
+            offset += len(boundprim.vertex)
+    return uniqify_multidim_indexes(numpy.concatenate(vertices), numpy.concatenate(tris))
+
+def vertexGraph(num_vertices, tris):
+    """Builds the networkx vertex graph SanderSimplify used, with the
+    triangles using each vertex as its node attributes"""
+    graph = nx.Graph()
+    graph.add_nodes_from(xrange(num_vertices))
+    for i, tri in enumerate(tris.tolist()):
+        graph.add_edges_from([(tri[0], tri[1]), (tri[0], tri[2]), (tri[1], tri[2])])
+        for v in tri:
+            graph.node[v][i] = True
+    return graph
+
+class ConnectivityTester(unittest.TestCase):
+
+    def assertSameAsGraph(self, vertices, tris):
+        connectivity = MeshConnectivity(tris, len(vertices))
+        graph = vertexGraph(len(vertices), tris)
+
+        self.assertEqual(set(tuple(sorted(e)) for e in graph.edges()),
+                         set(tuple(e) for e in connectivity.edges.tolist()))
+        for v in xrange(len(vertices)):
+            self.assertEqual(sorted(graph.node[v].keys()), connectivity.trisOfVertex(v).tolist())
+            self.assertEqual(sorted(graph.neighbors(v)), connectivity.neighbors(v).tolist())
+            for other, edge in zip(connectivity.neighbors(v), connectivity.neighborEdges(v)):
+                self.assertEqual(connectivity.edgeIndex(v, other), edge)
+        for edge, (v1, v2) in enumerate(connectivity.edges.tolist()):
+            tris_both = set(graph.node[v1].keys()).intersection(graph.node[v2].keys())
+            self.assertEqual(sorted(tris_both), connectivity.trisOfEdge(edge).tolist())
+        for tri, edges in enumerate(connectivity.tri_edges):
+            v1, v2, v3 = tris[tri]
+            self.assertEqual(connectivity.edges[edges].tolist(),
+                             [sorted([v1, v2]), sorted([v2, v3]), sorted([v3, v1])])
+        self.assertEqual(nx.number_connected_components(graph), connectivity.numComponents())
+
+    def test_box(self):
+        self.assertSameAsGraph(*loadTriangles(os.path.join(OBJDIR, 'box.obj')))
+
+    def test_spider(self):
+        # has triangles that become degenerate when vertices are merged
+        self.assertSameAsGraph(*loadTriangles(os.path.join(OBJDIR, 'spider.obj')))
+
+    def test_regr01(self):
+        self.assertSameAsGraph(*loadTriangles(os.path.join(OBJDIR, 'regr01.obj')))
+
+    def test_components(self):
+        vertices = numpy.zeros((8, 3), dtype=numpy.float32)
+        tris = numpy.array([[0, 1, 2], [2, 1, 3], [4, 5, 7]])
+        connectivity = MeshConnectivity(tris, len(vertices))
+        # vertex 6 isn't used by any triangle
+        self.assertEqual(connectivity.numComponents(), 3)
+        self.assertEqual(connectivity.edgeIndex(1, 2), connectivity.edgeIndex(2, 1))
+        self.assertEqual(connectivity.edgeIndex(0, 3), -1)
+        self.assertEqual(connectivity.edgeTriCounts()[connectivity.edgeIndex(1, 2)], 2)
+        self.assertSameAsGraph(vertices, tris)
+
+    def assertAdjacency(self, tris, pairs, invalid=[]):
+        tris = numpy.array(tris)
+        connectivity = MeshConnectivity(tris, tris.max() + 1)
+        adjacent, invalid_edges = connectivity.faceAdjacency(tris)
+        self.assertEqual(sorted(adjacent.tolist()), pairs)
+        self.assertEqual(connectivity.edges[invalid_edges].tolist(), invalid)
+
+    def test_adjacency(self):
+        self.assertAdjacency([[0, 1, 2], [2, 1, 3]], [[0, 1]])
+        # opposite facing, and the same triangle facing both ways
+        self.assertAdjacency([[0, 1, 2], [1, 2, 3]], [])
+        self.assertAdjacency([[0, 1, 2], [0, 2, 1]], [])
+        # the middle triangle is adjacent to both of the others
+        self.assertAdjacency([[0, 1, 2], [1, 0, 3], [0, 1, 4]], [[0, 1], [1, 2]])
+        self.assertAdjacency([[0, 1, 2], [1, 0, 3], [0, 1, 4], [1, 0, 5]],
+                             [[0, 1], [0, 3], [1, 2], [2, 3]], invalid=[[0, 1]])
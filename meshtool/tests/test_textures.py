@@ -0,0 +1,172 @@
+import unittest
+import os
+import struct
+from StringIO import StringIO
+import numpy
+from meshtool.util import Image, loadDDS, saveDDS, DXT_BLOCK_SIZES
+from meshtool.filters.load_filters.load_obj import loadOBJFromFile, filepath_loader
+from meshtool import textures
+from meshtool.profiling import FilterProfiler, setActiveProfiler
+
+class TextureManagerTester(unittest.TestCase):
+    def setUp(self):
+        self.obj_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'obj', 'spider.obj')
+        self.mesh = loadOBJFromFile(self.obj_path, aux_file_loader=filepath_loader(self.obj_path))
+        self.profiler = FilterProfiler()
+        setActiveProfiler(self.profiler)
+
+    def tearDown(self):
+        setActiveProfiler(None)
+
+    def test_shared(self):
+        textures.prefetch(self.mesh)
+        for cimg in self.mesh.images:
+            img = textures.getPILImage(cimg, self.mesh)
+            self.assertEqual(img.size, cimg.pilimage.size)
+            self.assertIs(textures.getPILImage(cimg, self.mesh), img)
+        num_images = len(self.mesh.images)
+        self.assertEqual(self.profiler.counters['texture_decodes'], num_images)
+        self.assertEqual(self.profiler.counters['texture_hits'], 2 * num_images)
+
+        # new data for an image is decoded again
+        cimg = self.mesh.images[0]
+        img = textures.getPILImage(cimg, self.mesh)
+        cimg.data = self.mesh.images[1].data
+        self.assertEqual(textures.getPILImage(cimg, self.mesh).size, self.mesh.images[1].pilimage.size)
+        self.assertEqual(self.profiler.counters['texture_decodes'], num_images + 1)
+
+    def test_budget(self):
+        manager = textures.TextureManager(budget=1)
+        self.mesh._texture_manager = manager
+        for cimg in self.mesh.images:
+            self.assertIsNotNone(textures.getPILImage(cimg, self.mesh))
+        # only the last image is kept
+        self.assertEqual(len(manager.textures), 1)
+        self.assertEqual(self.profiler.counters['texture_evictions'], len(self.mesh.images) - 1)
+
+    def test_probe(self):
+        # header sizes match what PIL decodes to
+        for cimg in self.mesh.images:
+            img = cimg.pilimage
+            for format in ['JPEG', 'PNG', 'TGA', 'BMP']:
+                if format == 'JPEG' and img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                buf = StringIO()
+                img.save(buf, format)
+                decoded = Image.open(StringIO(buf.getvalue()))
+                info = textures.probeImage(buf.getvalue())
+                self.assertEqual((info.width, info.height), decoded.size)
+                self.assertEqual(info.channels, len(decoded.getbands()))
+            self.assertEqual(textures.getImageInfo(cimg, self.mesh).width, cimg.pilimage.size[0])
+        self.assertIsNone(textures.probeImage('not an image'))
+        self.assertNotIn('texture_decodes', self.profiler.counters)
+
+    def test_optimize_threads(self):
+        from meshtool.filters.optimize_filters.optimize_textures import optimizeTextures
+        def pngMesh():
+            mesh = loadOBJFromFile(self.obj_path, aux_file_loader=filepath_loader(self.obj_path))
+            for i, cimg in enumerate(mesh.images):
+                img = cimg.pilimage.convert('RGBA')
+                if i % 2 == 0:
+                    img.putpixel((0, 0), (0, 0, 0, 0))
+                buf = StringIO()
+                img.save(buf, 'PNG')
+                cimg.data = buf.getvalue()
+                cimg.path = cimg.path[:-4] + '.png'
+            # the second would be renamed to the first's original path
+            mesh.images[0].path = './tex.jpg'
+            mesh.images[1].path = './tex.png'
+            return mesh
+        serial = pngMesh()
+        optimizeTextures(serial, threads=1)
+        self.assertEqual([c.path for c in serial.images[:2]], ['./tex.png', './tex-x.jpg'])
+        threaded = pngMesh()
+        optimizeTextures(threaded, threads=3)
+        self.assertEqual([(c.path, c.data) for c in serial.images],
+                         [(c.path, c.data) for c in threaded.images])
+
+    def test_downscale(self):
+        from meshtool.filters.optimize_filters.downscale_textures import downscaleTextures
+        before = [textures.getImageInfo(cimg, self.mesh) for cimg in self.mesh.images]
+        budget = sum(textures.imageRAM(info) for info in before) / 4
+        downscaleTextures(self.mesh, budget)
+        after = [textures.probeImage(cimg.data) for cimg in self.mesh.images]
+        self.assertLessEqual(sum(textures.imageRAM(info) for info in after), budget)
+        for old, new in zip(before, after):
+            self.assertEqual(new.format, old.format)
+            self.assertLessEqual(new.width, old.width)
+            self.assertLessEqual(new.height, old.height)
+            if (new.width, new.height) != (old.width, old.height):
+                self.assertEqual(new.width & (new.width - 1), 0)
+                self.assertEqual(new.height & (new.height - 1), 0)
+
+def makeDDS(width, height, fourcc, blocks):
+    header = 'DDS ' + struct.pack('<7I', 124, 0x1007, height, width, 0, 0, 1) + '\0' * 44
+    header += struct.pack('<2I', 32, 4) + fourcc + '\0' * 40
+    return header + blocks
+
+class DXTTester(unittest.TestCase):
+    def test_blocks(self):
+        # red and blue end points, with each texel picking the next palette entry
+        indices = sum(((i % 4) << (2 * i)) for i in range(16))
+        block = struct.pack('<HHI', 0xf800, 0x001f, indices)
+        img = loadDDS(makeDDS(4, 4, 'DXT1', block))
+        self.assertEqual(img.mode, 'RGBA')
+        self.assertEqual([img.getpixel((i, 0)) for i in range(4)],
+                         [(255, 0, 0, 255), (0, 0, 255, 255), (170, 0, 85, 255), (85, 0, 170, 255)])
+        # c0 <= c1 gives the midpoint and transparent black
+        block = struct.pack('<HHI', 0x001f, 0xf800, indices)
+        img = loadDDS(makeDDS(4, 4, 'DXT1', block))
+        self.assertEqual([img.getpixel((i, 0)) for i in range(2, 4)], [(127, 0, 127, 255), (0, 0, 0, 0)])
+
+    def test_pil(self):
+        # decodes random blocks as PIL does, for sizes that aren't whole blocks
+        random = numpy.random.RandomState(0)
+        for fourcc in ['DXT1', 'DXT3', 'DXT5']:
+            width, height = 37, 21
+            blocks = random.randint(0, 256, (10 * 6, DXT_BLOCK_SIZES[fourcc])).astype(numpy.uint8)
+            if fourcc != 'DXT1':
+                # PIL decodes DXT3 and DXT5 blocks with c0 <= c1 like DXT1 ones
+                blocks[:, 9] |= 0x80
+                blocks[:, 11] &= 0x7f
+            data = makeDDS(width, height, fourcc, blocks.tostring())
+            expected = Image.open(StringIO(data))
+            self.assertTrue(numpy.array_equal(numpy.asarray(loadDDS(data)), numpy.asarray(expected)))
+            self.assertEqual(textures.probeImage(data), textures.ImageInfo(width, height, 4, 'DDS', fourcc))
+
+    def test_encode(self):
+        obj_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'obj', 'spider.obj')
+        mesh = loadOBJFromFile(obj_path, aux_file_loader=filepath_loader(obj_path))
+        pixels = numpy.asarray(mesh.images[0].pilimage.convert('RGBA')).copy()
+        # a vertical alpha gradient over a size that isn't whole blocks
+        pixels = pixels[:-3, :-2]
+        pixels[:, :, 3] = numpy.linspace(0, 255, pixels.shape[0])[:, None]
+        height, width = pixels.shape[:2]
+        for fourcc in ['DXT1', 'DXT5']:
+            decoded = numpy.asarray(loadDDS(saveDDS([pixels], fourcc)))
+            self.assertEqual(decoded.shape, pixels.shape)
+            error = decoded[:, :, :3].astype(float) - pixels[:, :, :3]
+            psnr = 10 * numpy.log10(255.0 ** 2 / (error ** 2).mean())
+            self.assertGreater(psnr, 30)
+            if fourcc == 'DXT1':
+                self.assertTrue((decoded[:, :, 3] == 255).all())
+            else:
+                self.assertLessEqual(abs(decoded[:, :, 3].astype(int) - pixels[:, :, 3]).max(), 3)
+
+        # a solid color that's exact in 565 comes back exactly
+        solid = numpy.empty((8, 8, 4), dtype=numpy.uint8)
+        solid[:] = (255, 0, 132, 255)
+        self.assertTrue((numpy.asarray(loadDDS(saveDDS([solid], 'DXT1'))) == solid).all())
+
+    def test_compress_textures(self):
+        from meshtool.filters.optimize_filters.compress_textures import compressTextures
+        obj_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'obj', 'spider.obj')
+        mesh = loadOBJFromFile(obj_path, aux_file_loader=filepath_loader(obj_path))
+        sizes = [cimg.pilimage.size for cimg in mesh.images]
+        compressTextures(mesh, mipmaps=True)
+        for cimg, (width, height) in zip(mesh.images, sizes):
+            self.assertTrue(cimg.path.endswith('.dds'))
+            info = textures.probeImage(cimg.data)
+            self.assertEqual((info.width, info.height, info.compression), (width, height, 'DXT1'))
+            num_levels = struct.unpack('<I', cimg.data[28:32])[0]
+            self.assertEqual(num_levels, len(bin(max(width, height))) - 2)
@@ -0,0 +1,412 @@
+import os
+import time
+import struct
+import threading
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+
+from meshtool.util import Image, loadDDS, DXT_BLOCK_SIZES
+from meshtool import profiling
+
+# Each mesh gets a TextureManager the first time one of its images is
+# decoded. It keeps the decoded PIL images, by path, for every filter that
+# needs them, instead of each filter decoding them again, and drops the
+# least recently used ones once they take up more than the budget.
+
+DEFAULT_BUDGET = 1024 * 1024 * 1024
+
+# filters that decode textures, directly or through the filters they run.
+# make_atlases isn't one, since it decodes each image only when it's drawn
+# onto a page and drops it right after
+DECODING_FILTERS = set(['split_triangle_texcoords', 'optimize_textures',
+                        'sander_simplify', 'medium_optimizations', 'full_optimizations',
+                        'save_mipmaps', 'compress_textures', 'downscale_textures'])
+
+if os.environ.get('MESHTOOL_TEXTURE_BUDGET'):
+    _budget = int(os.environ['MESHTOOL_TEXTURE_BUDGET']) * 1024 * 1024
+else:
+    _budget = DEFAULT_BUDGET
+
+def setBudget(budget):
+    """Sets the number of bytes of decoded images each mesh keeps, for
+    meshes loaded after this in this process and worker processes started
+    after it"""
+    global _budget
+    _budget = budget
+
+def getBudget():
+    return _budget
+
+if os.environ.get('MESHTOOL_TEXTURE_THREADS'):
+    _threads = int(os.environ['MESHTOOL_TEXTURE_THREADS'])
+else:
+    _threads = None
+
+def setThreads(threads):
+    """Sets the number of threads used to decode and encode textures. None
+    uses one per CPU."""
+    global _threads
+    _threads = threads
+
+def getThreads():
+    if _threads is None:
+        return multiprocessing.cpu_count()
+    return _threads
+
+def decodeImage(data):
+    """Decodes image file data with PIL, or with :func:`meshtool.util.loadDDS`
+    for DXT compressed DDS files PIL can't read, returning None if neither
+    can, as :attr:`collada.material.CImage.pilimage` does"""
+    if not data:
+        return None
+    try:
+        img = Image.open(StringIO(data))
+        img.load()
+    except IOError:
+        try:
+            img = loadDDS(data)
+        except IOError:
+            return None
+    return img
+
+def imageBytes(img):
+    """Returns the size of a decoded image in memory"""
+    if img is None:
+        return 0
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+ImageInfo = collections.namedtuple('ImageInfo', ['width', 'height', 'channels', 'format', 'compression'])
+# the block compression of a DDS file, e.g. 'DXT1', and None for anything else
+ImageInfo.__new__.__defaults__ = (None,)
+
+# JPEG start of frame markers, which give the image's size
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+# JPEG markers without a length after them
+_JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xDA)) | set([0x01])
+# channels of each PNG color type
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# DDS pixel format flags
+_DDPF_ALPHAPIXELS = 0x1
+_DDPF_FOURCC = 0x4
+_DDPF_RGB = 0x40
+_DDPF_LUMINANCE = 0x20000
+
+def _probeJPEG(data):
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != '\xff':
+            return None
+        marker = ord(data[pos + 1])
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            pos += 2
+            continue
+        length, = struct.unpack('>H', data[pos + 2:pos + 4])
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 10 > len(data):
+                return None
+            height, width, components = struct.unpack('>HHB', data[pos + 5:pos + 10])
+            if height == 0:
+                # height is given later, in a DNL marker
+                return None
+            return ImageInfo(width, height, components, 'JPEG')
+        pos += 2 + length
+    return None
+
+def _probePNG(data):
+    if len(data) < 26 or data[12:16] != 'IHDR':
+        return None
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', data[16:26])
+    if color_type not in _PNG_CHANNELS:
+        return None
+    return ImageInfo(width, height, _PNG_CHANNELS[color_type], 'PNG')
+
+def _probeDDS(data):
+    if len(data) < 128:
+        return None
+    height, width = struct.unpack('<II', data[12:20])
+    flags, fourcc, bit_count = struct.unpack('<I4sI', data[80:92])
+    compression = None
+    if flags & _DDPF_FOURCC:
+        # block compressed, which PIL decodes to RGBA
+        channels = 4 if fourcc in ('DXT1', 'DXT3', 'DXT5') else 3
+        compression = fourcc
+    elif flags & _DDPF_RGB:
+        channels = 4 if flags & _DDPF_ALPHAPIXELS else 3
+    elif flags & _DDPF_LUMINANCE:
+        channels = 2 if flags & _DDPF_ALPHAPIXELS else 1
+    else:
+        channels = 3
+    return ImageInfo(width, height, channels, 'DDS', compression)
+
+def _probeTGA(data):
+    # TGA has no signature, so only accept headers PIL would
+    if len(data) < 18:
+        return None
+    colormap_type, image_type = struct.unpack('<BB', data[1:3])
+    width, height, depth = struct.unpack('<HHB', data[12:17])
+    if colormap_type not in (0, 1) or width == 0 or height == 0:
+        return None
+    if image_type in (1, 9) and depth == 8:
+        channels = 1
+    elif image_type in (3, 11) and depth in (1, 8, 16):
+        channels = 2 if depth == 16 else 1
+    elif image_type in (2, 10) and depth in (24, 32):
+        channels = 4 if depth == 32 else 3
+    else:
+        return None
+    return ImageInfo(width, height, channels, 'TGA')
+
+def probeImage(data):
+    """Reads the size, number of channels and format of an image from its
+    header, without decoding it. JPEG, PNG, DDS and TGA headers are read
+    here, and anything else is opened with PIL, which reads just the header
+    until the image is loaded. Channels are counted as in the PIL image the
+    data decodes to, e.g. 1 for palette images.
+
+    :returns: An :class:`ImageInfo`, or None if the data isn't an image
+    """
+    if not data:
+        return None
+    info = None
+    if data.startswith('\xff\xd8'):
+        info = _probeJPEG(data)
+    elif data.startswith('\x89PNG\r\n\x1a\n'):
+        info = _probePNG(data)
+    elif data.startswith('DDS '):
+        info = _probeDDS(data)
+    else:
+        info = _probeTGA(data)
+    if info is not None:
+        return info
+    try:
+        img = Image.open(StringIO(data))
+    except IOError:
+        return None
+    return ImageInfo(img.size[0], img.size[1], len(img.getbands()), img.format)
+
+def hasAlpha(info):
+    """Returns whether an image decodes to a PIL image with an alpha band,
+    given its :class:`ImageInfo`. Four channel JPEGs are CMYK."""
+    return info.channels in (2, 4) and info.format != 'JPEG'
+
+def imageRAM(info):
+    """Returns the bytes of memory an image takes once uploaded, given its
+    :class:`ImageInfo`. Block compressed images stay compressed."""
+    if info.compression in DXT_BLOCK_SIZES:
+        num_blocks = ((info.width + 3) / 4) * ((info.height + 3) / 4)
+        return num_blocks * DXT_BLOCK_SIZES[info.compression]
+    return info.width * info.height * info.channels
+
+class Texture(object):
+    """A decoded image, or one being decoded by a prefetch thread"""
+    def __init__(self, data):
+        # data is None if the prefetch thread reads it from the file
+        self.from_file = data is None
+        self.data = data
+        self.image = None
+        self.nbytes = 0
+        self.done = threading.Event()
+
+    def decode(self):
+        start = time.time()
+        self.image = decodeImage(self.data)
+        self.nbytes = imageBytes(self.image)
+        profiling.count('texture_decodes')
+        profiling.count('texture_decode_seconds', time.time() - start)
+
+class TextureManager(object):
+    """Decodes the images of one mesh, keeping them for reuse within a budget"""
+
+    def __init__(self, budget=None):
+        """
+        :param budget: Bytes of decoded images to keep. Defaults to :func:`getBudget`.
+        """
+        self.budget = budget if budget is not None else _budget
+        self.lock = threading.Lock()
+        # by path, least recently used first
+        self.textures = collections.OrderedDict()
+        self.size = 0
+
+    def _add(self, path, texture):
+        """Adds a decoded texture to the total, then evicts what's needed to
+        get back under the budget. Called with the lock held."""
+        self.size += texture.nbytes
+        for other_path in list(self.textures):
+            if self.size <= self.budget:
+                break
+            other = self.textures[other_path]
+            if other_path == path or not other.done.is_set():
+                continue
+            del self.textures[other_path]
+            self.size -= other.nbytes
+            profiling.count('texture_evictions')
+
+    def _remove(self, path, texture):
+        """Forgets a texture if it's still the one stored for path. Called with the lock held."""
+        if self.textures.get(path) is texture:
+            del self.textures[path]
+            self.size -= texture.nbytes
+
+    def getImage(self, cimg):
+        """Returns the decoded PIL image of a :class:`collada.material.CImage`,
+        or None if it can't be decoded. The image is shared, so it shouldn't
+        be changed in place."""
+        with self.lock:
+            texture = self.textures.get(cimg.path)
+        if texture is not None:
+            texture.done.wait()
+            with self.lock:
+                # a prefetch that failed or was evicted isn't stored any more
+                stored = self.textures.get(cimg.path) is texture
+            if stored and cimg._data is None and texture.from_file:
+                # read by the prefetch thread
+                cimg.data = texture.data
+            if stored and (cimg._data is texture.data or cimg._data == texture.data):
+                with self.lock:
+                    if self.textures.get(cimg.path) is texture:
+                        # now the most recently used
+                        del self.textures[cimg.path]
+                        self.textures[cimg.path] = texture
+                profiling.count('texture_hits')
+                return texture.image
+
+        texture = Texture(cimg.data)
+        texture.decode()
+        texture.done.set()
+        with self.lock:
+            old = self.textures.get(cimg.path)
+            if old is not None:
+                self._remove(cimg.path, old)
+            self.textures[cimg.path] = texture
+            self._add(cimg.path, texture)
+        return texture.image
+
+    def getInfo(self, cimg):
+        """Returns the :class:`ImageInfo` of a :class:`collada.material.CImage`,
+        from its decoded image if there is one and its header otherwise. DDS
+        headers are always read, since decoding loses their compression."""
+        with self.lock:
+            texture = self.textures.get(cimg.path)
+        if texture is not None and texture.done.is_set() and texture.image is not None and \
+                (cimg._data is texture.data or cimg._data == texture.data) and \
+                not texture.data.startswith('DDS '):
+            img = texture.image
+            return ImageInfo(img.size[0], img.size[1], len(img.getbands()), img.format)
+        profiling.count('texture_probes')
+        return probeImage(cimg.data)
+
+    def release(self, paths=None):
+        """Forgets the decoded images with the given paths, or all of them,
+        waiting for any that are still being prefetched"""
+        with self.lock:
+            if paths is None:
+                paths = list(self.textures)
+            released = [(path, self.textures[path]) for path in paths if path in self.textures]
+        for path, texture in released:
+            texture.done.wait()
+        with self.lock:
+            for path, texture in released:
+                self._remove(path, texture)
+
+    def _prefetchTexture(self, cimg, texture):
+        try:
+            if texture.from_file:
+                texture.data = cimg.collada.getFileData(cimg.path)
+            with self.lock:
+                over_budget = self.size >= self.budget
+            if over_budget:
+                profiling.count('texture_prefetches_skipped')
+                with self.lock:
+                    self._remove(cimg.path, texture)
+                return
+            texture.decode()
+            profiling.count('texture_prefetches')
+            with self.lock:
+                if self.textures.get(cimg.path) is texture:
+                    self._add(cimg.path, texture)
+        except Exception:
+            # left for the filter that uses it to load, which reports any error
+            with self.lock:
+                self._remove(cimg.path, texture)
+        finally:
+            texture.done.set()
+
+    def prefetch(self, images, threads=None):
+        """Starts decoding images in a pool of threads, returning without
+        waiting for them. A filter asking for an image that's still being
+        decoded waits for it.
+
+        :param images: The :class:`collada.material.CImage` objects to decode
+        :param threads: Number of threads. Defaults to :func:`getThreads`.
+        """
+        pending = []
+        with self.lock:
+            for cimg in images:
+                if cimg.path in self.textures:
+                    continue
+                texture = Texture(cimg._data)
+                self.textures[cimg.path] = texture
+                pending.append((cimg, texture))
+        if len(pending) == 0:
+            return
+        if threads is None:
+            threads = getThreads()
+        pool = ThreadPool(min(threads, len(pending)))
+        for cimg, texture in pending:
+            pool.apply_async(self._prefetchTexture, (cimg, texture))
+        # the threads exit once they've done everything queued
+        pool.close()
+
+def getTextureManager(mesh):
+    """Returns the :class:`TextureManager` of a mesh, creating it if needed"""
+    manager = getattr(mesh, '_texture_manager', None)
+    if manager is None:
+        manager = TextureManager()
+        mesh._texture_manager = manager
+    return manager
+
+def getPILImage(cimg, mesh=None):
+    """Returns the decoded PIL image of a :class:`collada.material.CImage`
+    through its mesh's :class:`TextureManager`, or None if it can't be decoded
+
+    :param mesh: The mesh the image is in. Defaults to the image's collada
+                 attribute, which isn't set for images created in memory.
+    """
+    if mesh is None:
+        mesh = cimg.collada
+    if mesh is None:
+        return cimg.pilimage
+    return getTextureManager(mesh).getImage(cimg)
+
+def getImageInfo(cimg, mesh=None):
+    """Returns the :class:`ImageInfo` of a :class:`collada.material.CImage`,
+    without decoding it if it hasn't been already, or None if it isn't an image"""
+    if mesh is None:
+        mesh = cimg.collada
+    if mesh is None:
+        return probeImage(cimg.data)
+    return getTextureManager(mesh).getInfo(cimg)
+
+def release(mesh, images=None):
+    """Drops the decoded images of a mesh so their memory can be freed
+
+    :param images: The :class:`collada.material.CImage` objects to drop.
+                   Defaults to all of them.
+    """
+    manager = getattr(mesh, '_texture_manager', None)
+    if manager is None:
+        return
+    if images is None:
+        manager.release()
+    else:
+        manager.release([cimg.path for cimg in images])
+
+def prefetch(mesh):
+    """Starts decoding all of the images of a mesh in the background"""
+    getTextureManager(mesh).prefetch(mesh.images)
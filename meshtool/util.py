@@ -1,7 +1,10 @@
 import re
 import os
+import struct
 import unicodedata
 
+import numpy
+
 try:
     import Image
 except ImportError:
@@ -33,6 +36,13 @@ def to_unicode(s):
     except UnicodeDecodeError:
         return s.decode('latin-1')
 
+def isExternalImage(cimg):
+    """Returns whether a :class:`collada.material.CImage` only refers to an
+    image saved somewhere else, such as a page made by
+    :func:`meshtool.filters.atlas_filters.make_atlases.makeSharedAtlases`,
+    which savers should leave where it is instead of copying"""
+    return getattr(cimg, 'external', False)
+
 _slugify_strip_re = re.compile(r'[^\w\s-]')
 _slugify_hyphenate_re = re.compile(r'[-\s]+')
 def slugify(value):
@@ -65,3 +75,305 @@ def which(program):
                 return exe_file
 
     return None
+
+# bytes per 4x4 block of each block compressed DDS format
+DXT_BLOCK_SIZES = {'DXT1': 8, 'DXT3': 16, 'DXT5': 16}
+# blocks decoded at a time, to bound the size of the intermediate arrays
+_DXT_CHUNK_BLOCKS = 64 * 1024
+
+def _expand565(colors):
+    """Returns the 8 bit RGB of an array of 16 bit 565 colors, as an (N, 3) array"""
+    colors = colors.astype(numpy.uint16)
+    r = (colors >> 11) & 0x1f
+    g = (colors >> 5) & 0x3f
+    b = colors & 0x1f
+    rgb = numpy.empty((len(colors), 3), dtype=numpy.uint16)
+    rgb[:, 0] = (r << 3) | (r >> 2)
+    rgb[:, 1] = (g << 2) | (g >> 4)
+    rgb[:, 2] = (b << 3) | (b >> 2)
+    return rgb
+
+def _colorPalette(c0, c1, four_color_only):
+    """Returns the RGBA palettes of DXT color blocks with the given 565 end
+    points, as an (N, 4, 4) array
+
+    :param four_color_only: DXT3 and DXT5 always interpolate two colors, while
+                            DXT1 blocks with c0 <= c1 have one interpolated
+                            color and transparent black instead
+    """
+    rgb0 = _expand565(c0)
+    rgb1 = _expand565(c1)
+
+    palette = numpy.empty((len(c0), 4, 4), dtype=numpy.uint8)
+    palette[:, :, 3] = 255
+    palette[:, 0, :3] = rgb0
+    palette[:, 1, :3] = rgb1
+    palette[:, 2, :3] = (2 * rgb0 + rgb1) // 3
+    palette[:, 3, :3] = (rgb0 + 2 * rgb1) // 3
+    if not four_color_only:
+        three = c0 <= c1
+        palette[three, 2, :3] = (rgb0[three] + rgb1[three]) // 2
+        palette[three, 3] = 0
+    return palette
+
+def _decodeColorBlocks(blocks, four_color_only):
+    """Decodes the 8 byte color part of DXT blocks to an (N, 16, 4) RGBA array
+
+    :param four_color_only: See :func:`_colorPalette`
+    """
+    c0 = blocks[:, 0].astype(numpy.uint16) | (blocks[:, 1].astype(numpy.uint16) << 8)
+    c1 = blocks[:, 2].astype(numpy.uint16) | (blocks[:, 3].astype(numpy.uint16) << 8)
+    palette = _colorPalette(c0, c1, four_color_only)
+
+    bits = numpy.ascontiguousarray(blocks[:, 4:8]).view('<u4').reshape(-1, 1)
+    indices = (bits >> (2 * numpy.arange(16, dtype=numpy.uint32))) & 3
+    # look up whole RGBA texels at once, as 32 bit values
+    indices += 4 * numpy.arange(len(blocks), dtype=numpy.uint32)[:, None]
+    return palette.view(numpy.uint32).ravel().take(indices).view(numpy.uint8).reshape(-1, 16, 4)
+
+def _alphaPalette(a0, a1):
+    """Returns the palettes of DXT5 alpha blocks with the given end points,
+    as an (N, 8) array"""
+    a0 = a0.astype(numpy.uint16).reshape(-1, 1)
+    a1 = a1.astype(numpy.uint16).reshape(-1, 1)
+    palette = numpy.empty((len(a0), 8), dtype=numpy.uint8)
+    palette[:, 0:1] = a0
+    palette[:, 1:2] = a1
+    # 6 interpolated values, or 4 and then 0 and 255 if a0 <= a1
+    weights = numpy.arange(1, 7, dtype=numpy.uint16)
+    palette[:, 2:] = ((7 - weights) * a0 + weights * a1) // 7
+    six = (a0 <= a1).ravel()
+    weights = numpy.arange(1, 5, dtype=numpy.uint16)
+    palette[six, 2:6] = ((5 - weights) * a0[six] + weights * a1[six]) // 5
+    palette[six, 6] = 0
+    palette[six, 7] = 255
+    return palette
+
+def _decodeDXT5Alpha(blocks):
+    """Decodes the 8 byte alpha part of DXT5 blocks to an (N, 16) array"""
+    palette = _alphaPalette(blocks[:, 0], blocks[:, 1])
+
+    # 3 bit indices, 8 texels to each 24 bits
+    shifts = 3 * numpy.arange(8, dtype=numpy.uint32)
+    indices = numpy.empty((len(blocks), 16), dtype=numpy.uint32)
+    for half, start in enumerate((2, 5)):
+        bits = blocks[:, start].astype(numpy.uint32) | (blocks[:, start + 1].astype(numpy.uint32) << 8) | \
+            (blocks[:, start + 2].astype(numpy.uint32) << 16)
+        indices[:, half * 8:half * 8 + 8] = (bits[:, None] >> shifts) & 7
+    indices += 8 * numpy.arange(len(blocks), dtype=numpy.uint32)[:, None]
+    return palette.ravel().take(indices)
+
+def _decodeDXT3Alpha(blocks):
+    """Decodes the 8 byte explicit alpha part of DXT3 blocks to an (N, 16) array"""
+    low = blocks[:, :8] & 0x0f
+    high = blocks[:, :8] >> 4
+    alpha = numpy.empty((len(blocks), 16), dtype=numpy.uint8)
+    alpha[:, 0::2] = low * 17
+    alpha[:, 1::2] = high * 17
+    return alpha
+
+def decodeDXT(data, width, height, fourcc):
+    """Decodes DXT1, DXT3 or DXT5 (BC1-3) block compressed image data
+
+    :param data: The blocks, row by row, starting with the top left
+    :param fourcc: One of 'DXT1', 'DXT3' or 'DXT5'
+    :returns: A (height, width, 4) uint8 RGBA numpy array
+    """
+    block_size = DXT_BLOCK_SIZES[fourcc]
+    blocks_wide = (width + 3) // 4
+    blocks_high = (height + 3) // 4
+    num_blocks = blocks_wide * blocks_high
+    if len(data) < num_blocks * block_size:
+        raise ValueError('Expected %d bytes of %s data, got %d' % (num_blocks * block_size, fourcc, len(data)))
+    blocks = numpy.frombuffer(data, dtype=numpy.uint8, count=num_blocks * block_size)
+    blocks = blocks.reshape(num_blocks, block_size)
+
+    texels = numpy.empty((num_blocks, 16, 4), dtype=numpy.uint8)
+    for start in range(0, num_blocks, _DXT_CHUNK_BLOCKS):
+        chunk = blocks[start:start + _DXT_CHUNK_BLOCKS]
+        if fourcc == 'DXT1':
+            texels[start:start + len(chunk)] = _decodeColorBlocks(chunk, False)
+        else:
+            out = texels[start:start + len(chunk)]
+            out[:] = _decodeColorBlocks(chunk[:, 8:], True)
+            if fourcc == 'DXT3':
+                out[:, :, 3] = _decodeDXT3Alpha(chunk)
+            else:
+                out[:, :, 3] = _decodeDXT5Alpha(chunk)
+
+    # (block row, block column, texel row, texel column) to pixel rows
+    pixels = texels.reshape(blocks_high, blocks_wide, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    pixels = pixels.reshape(blocks_high * 4, blocks_wide * 4, 4)
+    return numpy.ascontiguousarray(pixels[:height, :width])
+
+# blocks encoded at a time, smaller than for decoding since each texel is
+# compared against every palette entry
+_DXT_ENCODE_CHUNK_BLOCKS = 16 * 1024
+
+# the palette index of each step from the first end point to the second
+_COLOR_STEP_INDICES = numpy.array([0, 2, 3, 1], dtype=numpy.uint32)
+_ALPHA_STEP_INDICES = numpy.array([0, 2, 3, 4, 5, 6, 7, 1], dtype=numpy.uint32)
+
+def _quantize565(rgb):
+    """Returns the nearest 16 bit 565 colors to an (N, 3) float array"""
+    rgb = numpy.clip(rgb, 0, 255)
+    r = numpy.rint(rgb[:, 0] * (31 / 255.0)).astype(numpy.uint16)
+    g = numpy.rint(rgb[:, 1] * (63 / 255.0)).astype(numpy.uint16)
+    b = numpy.rint(rgb[:, 2] * (31 / 255.0)).astype(numpy.uint16)
+    return (r << 11) | (g << 5) | b
+
+def _encodeColorBlocks(texels):
+    """Encodes (N, 16, 3) RGB texels to the 8 byte color part of DXT blocks,
+    using only four color blocks, so they decode the same in DXT1, DXT3 and DXT5"""
+    # one (N, 16) array per channel, since numpy is much faster at
+    # elementwise math on those than at reducing over a small last axis
+    colors = texels.transpose(2, 0, 1).astype(numpy.float32, order='C')
+    mean = colors.mean(axis=2)
+    centered = colors - mean[:, :, None]
+
+    # end points are the extremes of the texels along their principal axis,
+    # found by power iteration on their covariance
+    covariance = {}
+    for i in range(3):
+        for j in range(i, 3):
+            covariance[i, j] = covariance[j, i] = (centered[i] * centered[j]).sum(axis=1)
+    axis = colors.max(axis=2) - colors.min(axis=2)
+    for iteration in range(4):
+        axis = numpy.array([covariance[i, 0] * axis[0] + covariance[i, 1] * axis[1] +
+                            covariance[i, 2] * axis[2] for i in range(3)])
+        norm = numpy.sqrt((axis * axis).sum(axis=0))
+        norm[norm == 0] = 1
+        axis /= norm
+    projected = centered[0] * axis[0][:, None] + centered[1] * axis[1][:, None] + \
+        centered[2] * axis[2][:, None]
+    low = projected.min(axis=1)
+    high = projected.max(axis=1)
+    # pulled in slightly, since the interpolated colors cover the ends better
+    inset = (high - low) / 16.0
+    c0 = _quantize565((mean + axis * (high - inset)).T)
+    c1 = _quantize565((mean + axis * (low + inset)).T)
+
+    # c0 > c1 picks four colors, and when they're equal every texel uses c0
+    swap = c0 < c1
+    c0[swap], c1[swap] = c1[swap], c0[swap]
+
+    # the palette is evenly spaced along the line between the end points,
+    # so each texel takes the step nearest its projection onto it
+    rgb0 = _expand565(c0).T.astype(numpy.float32)
+    line = _expand565(c1).T.astype(numpy.float32) - rgb0
+    length = (line * line).sum(axis=0)
+    length[length == 0] = 1
+    scale = line * (3 / length)
+    steps = (colors[0] - rgb0[0][:, None]) * scale[0][:, None] + \
+        (colors[1] - rgb0[1][:, None]) * scale[1][:, None] + \
+        (colors[2] - rgb0[2][:, None]) * scale[2][:, None]
+    steps = numpy.clip(numpy.rint(steps), 0, 3).astype(numpy.uint32)
+    indices = _COLOR_STEP_INDICES.take(steps)
+    bits = (indices << (2 * numpy.arange(16, dtype=numpy.uint32))).sum(axis=1, dtype=numpy.uint32)
+
+    blocks = numpy.empty((len(texels), 8), dtype=numpy.uint8)
+    blocks[:, 0:2] = c0.astype('<u2').view(numpy.uint8).reshape(-1, 2)
+    blocks[:, 2:4] = c1.astype('<u2').view(numpy.uint8).reshape(-1, 2)
+    blocks[:, 4:8] = bits.astype('<u4').view(numpy.uint8).reshape(-1, 4)
+    return blocks
+
+def _encodeDXT5Alpha(alpha):
+    """Encodes (N, 16) alpha values to the 8 byte alpha part of DXT5 blocks"""
+    a0 = alpha.max(axis=1)
+    a1 = alpha.min(axis=1)
+    # a0 > a1 gives 6 evenly spaced values between them, and when they're
+    # equal every texel uses a0
+    span = (a0 - a1.astype(numpy.float32))
+    span[span == 0] = 1
+    steps = (a0[:, None] - alpha.astype(numpy.float32)) * (7 / span)[:, None]
+    steps = numpy.clip(numpy.rint(steps), 0, 7).astype(numpy.uint32)
+    indices = _ALPHA_STEP_INDICES.take(steps)
+
+    blocks = numpy.empty((len(alpha), 8), dtype=numpy.uint8)
+    blocks[:, 0] = a0
+    blocks[:, 1] = a1
+    # 3 bit indices, 8 texels to each 24 bits
+    shifts = 3 * numpy.arange(8, dtype=numpy.uint32)
+    for half, start in enumerate((2, 5)):
+        bits = (indices[:, half * 8:half * 8 + 8] << shifts).sum(axis=1, dtype=numpy.uint32)
+        blocks[:, start] = bits & 0xff
+        blocks[:, start + 1] = (bits >> 8) & 0xff
+        blocks[:, start + 2] = bits >> 16
+    return blocks
+
+def encodeDXT(pixels, fourcc):
+    """Encodes an image as DXT1 or DXT5 (BC1 or BC3) blocks. DXT1 ignores alpha.
+
+    :param pixels: A (height, width, 4) uint8 RGBA numpy array. Sizes that
+                   aren't a multiple of 4 are padded by repeating the edges.
+    :param fourcc: 'DXT1' or 'DXT5'
+    :returns: The blocks, row by row, as a string
+    """
+    if fourcc not in ('DXT1', 'DXT5'):
+        raise ValueError('Unsupported DXT format %r' % fourcc)
+    height, width = pixels.shape[:2]
+    blocks_wide = (width + 3) // 4
+    blocks_high = (height + 3) // 4
+    if blocks_wide * 4 != width or blocks_high * 4 != height:
+        pixels = numpy.pad(pixels, ((0, blocks_high * 4 - height), (0, blocks_wide * 4 - width), (0, 0)), 'edge')
+    # pixel rows to (block row, block column, texel row, texel column)
+    texels = pixels.reshape(blocks_high, 4, blocks_wide, 4, 4).transpose(0, 2, 1, 3, 4)
+    texels = texels.reshape(-1, 16, 4)
+
+    block_size = DXT_BLOCK_SIZES[fourcc]
+    blocks = numpy.empty((len(texels), block_size), dtype=numpy.uint8)
+    for start in range(0, len(texels), _DXT_ENCODE_CHUNK_BLOCKS):
+        chunk = texels[start:start + _DXT_ENCODE_CHUNK_BLOCKS]
+        out = blocks[start:start + len(chunk)]
+        if fourcc == 'DXT1':
+            out[:] = _encodeColorBlocks(chunk[:, :, :3])
+        else:
+            out[:, :8] = _encodeDXT5Alpha(chunk[:, :, 3])
+            out[:, 8:] = _encodeColorBlocks(chunk[:, :, :3])
+    return blocks.tostring()
+
+# DDS header flags
+_DDSD_REQUIRED = 0x1 | 0x2 | 0x4 | 0x1000
+_DDSD_MIPMAPCOUNT = 0x20000
+_DDSD_LINEARSIZE = 0x80000
+_DDPF_FOURCC = 0x4
+_DDSCAPS_COMPLEX = 0x8
+_DDSCAPS_TEXTURE = 0x1000
+_DDSCAPS_MIPMAP = 0x400000
+
+def saveDDS(levels, fourcc):
+    """Returns a DDS file of DXT1 or DXT5 compressed images
+
+    :param levels: (height, width, 4) uint8 RGBA numpy arrays, the first
+                   being the image and any others its mipmaps, largest first
+    :param fourcc: 'DXT1' or 'DXT5'
+    """
+    height, width = levels[0].shape[:2]
+    data = [encodeDXT(level, fourcc) for level in levels]
+    flags = _DDSD_REQUIRED | _DDSD_LINEARSIZE
+    caps = _DDSCAPS_TEXTURE
+    if len(levels) > 1:
+        flags |= _DDSD_MIPMAPCOUNT
+        caps |= _DDSCAPS_COMPLEX | _DDSCAPS_MIPMAP
+    header = struct.pack('<4s7I44x', 'DDS ', 124, flags, height, width, len(data[0]), 0, len(levels))
+    header += struct.pack('<2I4s20x', 32, _DDPF_FOURCC, fourcc)
+    header += struct.pack('<I16x', caps)
+    return header + ''.join(data)
+
+def loadDDS(data):
+    """Decodes the top level of a DXT1, DXT3 or DXT5 DDS file to an RGBA PIL
+    image, without PIL's DDS support or panda3d
+
+    :raises IOError: If the data isn't a DDS file in one of those formats
+    """
+    if len(data) < 128 or data[:4] != 'DDS ':
+        raise IOError('Not a DDS file')
+    header_size, flags, height, width = struct.unpack('<4I', data[4:20])
+    fourcc = data[84:88]
+    if header_size != 124 or fourcc not in DXT_BLOCK_SIZES:
+        raise IOError('Unsupported DDS format %r' % fourcc)
+    try:
+        pixels = decodeDXT(buffer(data, 128), width, height, fourcc)
+    except ValueError, ex:
+        raise IOError(str(ex))
+    return Image.fromarray(pixels, 'RGBA')